@@ -1,7 +1,11 @@
+import contextlib
 import os
 import random
 import time
 from helpers.AdversarialAttack import AdversarialAttack
+from helpers.AttackSchedule import AttackSchedule
+from helpers.DetectionReport import DetectionReport
+from helpers.FrameOverlay import FrameOverlay
 from helpers.MediaConverter import MediaConverter
 
 
@@ -12,6 +16,312 @@ def clear_terminal():
     os.system("clear")
 
 
+def generate_disturbed_video_in_memory(
+    original_video_filepath,
+    result_dir,
+    save_frames_to_disk,
+    media_converter,
+    adversarial_attack,
+    disturbed_video_codec="mp4v",
+    ground_truth_filepath="attacked_intervals.json",
+    attack_schedule=None,
+    max_frames=60,
+    attack_variants=None,
+):
+    """
+    Generates the disturbed videos keeping frames in memory between stages.
+
+    The video is streamed once, every frame is written to the output videos as soon as it is ready.
+    The additional attack variants are written in the same pass, as by
+    generate_attack_variants_in_memory, and share the perturbed frames of the disturbed video.
+
+    Args:
+        original_video_filepath (str): Path of the input video.
+        result_dir (str): Directory to store the results.
+        save_frames_to_disk (bool): Whether to also save the intermediate frames as images.
+        media_converter (MediaConverter): Instance of the MediaConverter class.
+        adversarial_attack (AdversarialAttack): Instance of the AdversarialAttack class.
+        disturbed_video_codec (str, optional): Codec of the disturbed video. Defaults to "mp4v".
+        ground_truth_filepath (str, optional): JSON file of the attacked frame intervals.
+            Defaults to "attacked_intervals.json".
+        attack_schedule (AttackSchedule, optional): Frames to attack. Defaults to frames 20 to 30
+            with epsilon 10.
+        max_frames (int, optional): Number of frames making up the disturbed video, None for all
+            frames. Defaults to 60.
+        attack_variants (dict, optional): Name of each additional variant to its AttackSchedule.
+            Defaults to None.
+
+    Returns:
+        tuple: The path of the disturbed video and the list of attacked frame indexes.
+    """
+    if attack_schedule is None:
+        attack_schedule = AttackSchedule.from_range(20, 31, epsilon=10)
+
+    output_videos_dir = os.path.join(result_dir, "output_videos")
+    original_output_frames_dir = os.path.join(result_dir, "original_output_frames")
+    disturbed_output_frames_dir = os.path.join(result_dir, "disturbed_output_frames")
+    disturbed_decorated_output_frames_dir = os.path.join(
+        result_dir, "disturbed_decorated_output_frames"
+    )
+
+    print("\nProcessing original and disturbed videos...")
+
+    frames = media_converter.stream_video_frames(original_video_filepath)
+    actual_attack_indexes = []
+    # An error aborts every video, so no partial video is left behind as if it were complete
+    with contextlib.ExitStack() as sinks:
+        original_video = sinks.enter_context(
+            media_converter.open_video_sink(
+                output_videos_dir, "resulting_original_video.mp4"
+            )
+        )
+        disturbed_video = sinks.enter_context(
+            media_converter.open_video_sink(
+                output_videos_dir,
+                media_converter.get_video_file_name(
+                    "disturbed_video", disturbed_video_codec
+                ),
+                disturbed_video_codec,
+            )
+        )
+        disturbed_decorated_video = sinks.enter_context(
+            media_converter.open_video_sink(
+                output_videos_dir, "disturbed_decorated_video.mp4"
+            )
+        )
+        variant_videos = _open_variant_videos(
+            result_dir,
+            media_converter,
+            attack_variants or {},
+            disturbed_video_codec,
+            sinks,
+        )
+
+        original_frame_paths = []
+        disturbed_frame_paths = {}
+        disturbed_frame_count = 0
+
+        for i, _, frame in frames:
+            original_video.write(frame)
+            if save_frames_to_disk:
+                original_frame_paths.append(
+                    media_converter.save_frame(frame, original_output_frames_dir, i)
+                )
+
+            # Only the first max_frames frames make up the disturbed video
+            if max_frames is not None and i >= max_frames:
+                continue
+            disturbed_frame_count += 1
+
+            if i % 50 == 0:
+                print("")
+            else:
+                print(".", end="")
+
+            # Generate disturbances for the scheduled frames, once per epsilon for all videos
+            disturbed_frames = {}
+            _write_variant_frames(
+                variant_videos, i, frame, disturbed_frames, adversarial_attack
+            )
+            if attack_schedule.is_attacked(i):
+                disturbed_frame = _get_disturbed_frame(
+                    i,
+                    frame,
+                    attack_schedule.epsilon,
+                    disturbed_frames,
+                    adversarial_attack,
+                )
+                disturbed_decorated_frame = media_converter.decorate_frame(
+                    disturbed_frame, color=(0, 0, 255), index=i
+                )
+                actual_attack_indexes.append(i)
+            else:
+                disturbed_frame = frame
+                disturbed_decorated_frame = media_converter.decorate_frame(
+                    frame, color=(0, 255, 0), index=i
+                )
+
+            disturbed_video.write(disturbed_frame)
+            disturbed_decorated_video.write(disturbed_decorated_frame)
+            if save_frames_to_disk:
+                # Clean disturbed frames are the original frames, the manifest points to them
+                if actual_attack_indexes and actual_attack_indexes[-1] == i:
+                    disturbed_frame_paths[i] = media_converter.save_frame(
+                        disturbed_frame, disturbed_output_frames_dir, i
+                    )
+                media_converter.save_frame(
+                    disturbed_decorated_frame, disturbed_decorated_output_frames_dir, i
+                )
+
+    print(f"\nAttacked images indexes: {actual_attack_indexes}")
+    AttackSchedule.save_ground_truth(
+        ground_truth_filepath,
+        DetectionReport.get_mask(actual_attack_indexes, disturbed_frame_count),
+        attack_schedule=attack_schedule.to_spec(),
+    )
+    _save_variant_ground_truths(variant_videos, disturbed_frame_count)
+
+    if save_frames_to_disk:
+        FrameOverlay(
+            original_frame_paths[:disturbed_frame_count], disturbed_frame_paths
+        ).save_manifest(disturbed_output_frames_dir)
+
+    print(f"Original video saved to {original_video.file_name}")
+    disturbed_video_filepath = disturbed_video.file_name
+    print("Disturbed video saved to " + disturbed_video_filepath)
+    return (
+        os.path.join(output_videos_dir, disturbed_video_filepath),
+        actual_attack_indexes,
+    )
+
+
+def generate_attack_variants_in_memory(
+    original_video_filepath,
+    result_dir,
+    media_converter,
+    adversarial_attack,
+    attack_schedules,
+    disturbed_video_codec="mp4v",
+    max_frames=None,
+):
+    """
+    Generates one disturbed video per attack schedule from a single decode of the video.
+
+    Every variant gets its own directory below result_dir/variants with its disturbed video and
+    attacked_intervals.json. A frame is perturbed once per epsilon and shared by the variants
+    attacking it with that epsilon, the perturbation of a frame only depends on its index.
+
+    Args:
+        original_video_filepath (str): Path of the input video.
+        result_dir (str): Directory to store the results.
+        media_converter (MediaConverter): Instance of the MediaConverter class.
+        adversarial_attack (AdversarialAttack): Instance of the AdversarialAttack class.
+        attack_schedules (dict): Name of each variant to its AttackSchedule.
+        disturbed_video_codec (str, optional): Codec of the disturbed videos. Defaults to "mp4v".
+        max_frames (int, optional): Number of frames making up the disturbed videos, None for
+            all frames. Defaults to None.
+
+    Returns:
+        dict: Name of each variant to the path of its disturbed video and its attacked frame
+            indexes.
+    """
+    frames = media_converter.stream_video_frames(original_video_filepath)
+    frame_count = 0
+
+    print(f"\nGenerating {len(attack_schedules)} disturbed videos...")
+
+    # An error aborts every video, so no partial video is left behind as if it were complete
+    with contextlib.ExitStack() as sinks:
+        variant_videos = _open_variant_videos(
+            result_dir, media_converter, attack_schedules, disturbed_video_codec, sinks
+        )
+        for i, _, frame in frames:
+            if max_frames is not None and i >= max_frames:
+                break
+            frame_count += 1
+
+            if i % 50 == 0:
+                print("")
+            else:
+                print(".", end="")
+
+            _write_variant_frames(variant_videos, i, frame, {}, adversarial_attack)
+
+    print("")
+    return _save_variant_ground_truths(variant_videos, frame_count)
+
+
+def _open_variant_videos(
+    result_dir, media_converter, attack_schedules, disturbed_video_codec, sinks
+):
+    """
+    Opens the disturbed video of every variant in its directory below result_dir/variants, in
+    the sinks ExitStack that closes them, or aborts them on an error.
+
+    Returns:
+        dict: Name of each variant to its schedule, directory, video sink and attacked frame
+            indexes.
+    """
+    video_file_name = media_converter.get_video_file_name(
+        "disturbed_video", disturbed_video_codec
+    )
+    variant_videos = {}
+    for name, attack_schedule in attack_schedules.items():
+        variant_dir = os.path.join(result_dir, "variants", name)
+        variant_videos[name] = {
+            "attack_schedule": attack_schedule,
+            "dir": variant_dir,
+            "video": sinks.enter_context(
+                media_converter.open_video_sink(
+                    variant_dir, video_file_name, disturbed_video_codec
+                )
+            ),
+            "actual_attack_indexes": [],
+        }
+    return variant_videos
+
+
+def _get_disturbed_frame(i, frame, epsilon, disturbed_frames, adversarial_attack):
+    """
+    Returns the frame perturbed with epsilon, perturbing it on the first request only. The
+    perturbation only depends on the index of the frame, so the videos attacking a frame with
+    the same epsilon share it.
+    """
+    if epsilon not in disturbed_frames:
+        disturbed_frames[epsilon] = adversarial_attack.fgsm_attack_frame(
+            frame, epsilon=epsilon, rng=adversarial_attack.get_frame_rng(i)
+        )
+    return disturbed_frames[epsilon]
+
+
+def _write_variant_frames(
+    variant_videos, i, frame, disturbed_frames, adversarial_attack
+):
+    """
+    Writes a frame to the disturbed video of every variant, perturbed where its schedule
+    attacks it.
+    """
+    for variant in variant_videos.values():
+        attack_schedule = variant["attack_schedule"]
+        if not attack_schedule.is_attacked(i):
+            variant["video"].write(frame)
+            continue
+
+        variant["video"].write(
+            _get_disturbed_frame(
+                i, frame, attack_schedule.epsilon, disturbed_frames, adversarial_attack
+            )
+        )
+        variant["actual_attack_indexes"].append(i)
+
+
+def _save_variant_ground_truths(variant_videos, frame_count):
+    """
+    Saves the attacked_intervals.json of every variant once its disturbed video is closed.
+
+    Returns:
+        dict: Name of each variant to the path of its disturbed video and its attacked frame
+            indexes.
+    """
+    variants = {}
+    for name, variant in variant_videos.items():
+        disturbed_video_filepath = os.path.join(
+            variant["dir"], variant["video"].file_name
+        )
+        actual_attack_indexes = variant["actual_attack_indexes"]
+        AttackSchedule.save_ground_truth(
+            os.path.join(variant["dir"], "attacked_intervals.json"),
+            DetectionReport.get_mask(actual_attack_indexes, frame_count),
+            attack_schedule=variant["attack_schedule"].to_spec(),
+        )
+        print(
+            f"Variant {name}: {len(actual_attack_indexes)} of {frame_count} frames "
+            f"attacked, saved to {disturbed_video_filepath}"
+        )
+        variants[name] = (disturbed_video_filepath, actual_attack_indexes)
+    return variants
+
+
 def main():
     start_time = time.time()
     result_dir = "results/"
@@ -29,36 +339,90 @@ def main():
     )
     original_video_filepath = "sample_video/video.avi"
 
-    media_converter = MediaConverter()
-    adversarial_attack = AdversarialAttack()
+    # Keep frames in memory between stages, frames are only written to disk on request
+    keep_frames_in_memory = True
+    save_frames_to_disk = False
 
-    print("\nProcessing original video...")
+    # Lossless formats keep the perturbation intact for process_video.py, a "raw" disturbed
+    # video is a frame store that is read back without decoding
+    frame_format = "png"
+    disturbed_video_codec = "FFV1"
 
-    # Convert video to frames
-    image_vectors = media_converter.convert_video_to_frames(
-        video_filepath=original_video_filepath
-    )
-    original_images_file_paths = media_converter.save_frames_to_folder(
-        frames=image_vectors, output_dir=original_output_frames_dir
-    )
-    resulting_original_video_filepath = media_converter.convert_images_to_video(
-        image_paths=original_images_file_paths,
-        output_dir=output_videos_dir,
-        file_name="resulting_original_video.mp4",
-    )
+    # Frames of the disturbed video to attack, see AttackSchedule for the pattern types
+    attack_schedule_spec = {
+        "patterns": [{"type": "range", "start": 20, "end": 31}],
+        "seed": 0,
+        "epsilon": 10,
+    }
+    # Number of frames making up the disturbed video, None for all frames
+    max_frames = 60
+    ground_truth_filepath = "attacked_intervals.json"
 
-    print(f"Original video saved to {resulting_original_video_filepath}")
+    # Additional disturbed videos generated in the same decode pass, one per schedule, e.g.
+    # {"sparse": {"patterns": [{"type": "rate", "rate": 0.05}], "seed": 1, "epsilon": 10}}
+    attack_variants = {}
 
-    disturbed_image_file_paths = []
-    disturbed_decorated_image_file_paths = []
-    generated_detection_file_paths = []
-    detected_attack_indexes = []
-    actual_attack_indexes = []
+    media_converter = MediaConverter(frame_format=frame_format)
+    adversarial_attack = AdversarialAttack(image_format=frame_format)
+    attack_schedule = AttackSchedule.from_spec(attack_schedule_spec)
+    attack_variant_schedules = {
+        name: AttackSchedule.from_spec(spec) for name, spec in attack_variants.items()
+    }
+
+    if keep_frames_in_memory:
+        # The variants are written in the same decode pass as the disturbed video
+        generate_disturbed_video_in_memory(
+            original_video_filepath=original_video_filepath,
+            result_dir=result_dir,
+            save_frames_to_disk=save_frames_to_disk,
+            media_converter=media_converter,
+            adversarial_attack=adversarial_attack,
+            disturbed_video_codec=disturbed_video_codec,
+            ground_truth_filepath=ground_truth_filepath,
+            attack_schedule=attack_schedule,
+            max_frames=max_frames,
+            attack_variants=attack_variant_schedules,
+        )
+    else:
+        if attack_variant_schedules:
+            generate_attack_variants_in_memory(
+                original_video_filepath=original_video_filepath,
+                result_dir=result_dir,
+                media_converter=media_converter,
+                adversarial_attack=adversarial_attack,
+                attack_schedules=attack_variant_schedules,
+                disturbed_video_codec=disturbed_video_codec,
+                max_frames=max_frames,
+            )
+
+        print("\nProcessing original video...")
+
+        # Convert video to frames
+        image_vectors = media_converter.convert_video_to_frames(
+            video_filepath=original_video_filepath
+        )
+        original_images_file_paths = media_converter.save_frames_to_folder(
+            frames=image_vectors, output_dir=original_output_frames_dir
+        )
+        resulting_original_video_filepath = media_converter.convert_images_to_video(
+            image_paths=original_images_file_paths,
+            output_dir=output_videos_dir,
+            file_name="resulting_original_video.mp4",
+        )
+
+        print(f"Original video saved to {resulting_original_video_filepath}")
 
-    print("\nGenerating disturbed video...")
+        # Only the attacked frames are stored, the others resolve to the original frames
+        disturbed_images_file_paths = original_images_file_paths[:max_frames]
+        disturbed_frames = FrameOverlay(disturbed_images_file_paths)
+        disturbed_decorated_image_file_paths = []
+        generated_detection_file_paths = []
+        detected_attack_indexes = []
+        actual_attack_indexes = []
 
-    with open("attacked_indexes.txt", "w") as file:
-        for i in range(len(original_images_file_paths[:60])):
+        print("\nGenerating disturbed video...")
+
+        for i in range(len(disturbed_images_file_paths)):
             if i % 50 == 0:
                 print("")
             else:
@@ -66,11 +430,11 @@ def main():
 
             image_file_path = original_images_file_paths[i]
 
-            # Generate disturbances for specific frames
-            if True and (i >= 20) and (i <= 30):
+            # Generate disturbances for the scheduled frames
+            if attack_schedule.is_attacked(i):
                 disturbed_image_file_path = adversarial_attack.fgsm_attack(
                     image_path=image_file_path,
-                    epsilon=10,
+                    epsilon=attack_schedule.epsilon,
                     output_dir=disturbed_output_frames_dir,
                 )
                 disturbed_decorated_image_file_path = media_converter.decorate_image(
@@ -79,13 +443,9 @@ def main():
                     color=(0, 0, 255),
                     count=i,
                 )
+                disturbed_frames.set_frame(i, disturbed_image_file_path)
                 actual_attack_indexes.append(i)
-                file.write(str(i) + "\n")
             else:
-                disturbed_image_file_path = media_converter.copy_and_paste_file(
-                    original_filepath=image_file_path,
-                    destination_directory=disturbed_output_frames_dir,
-                )
                 disturbed_decorated_image_file_path = media_converter.decorate_image(
                     image_path=image_file_path,
                     output_dir=disturbed_decorated_output_frames_dir,
@@ -96,24 +456,35 @@ def main():
             disturbed_decorated_image_file_paths.append(
                 disturbed_decorated_image_file_path
             )
-            disturbed_image_file_paths.append(disturbed_image_file_path)
 
         print(f"\nAttacked images indexes: {actual_attack_indexes}")
+        AttackSchedule.save_ground_truth(
+            ground_truth_filepath,
+            DetectionReport.get_mask(
+                actual_attack_indexes, len(disturbed_images_file_paths)
+            ),
+            attack_schedule=attack_schedule.to_spec(),
+        )
 
-    print("Saving disturbed video")
+        disturbed_frames.save_manifest(disturbed_output_frames_dir)
 
-    disturbed_video_filepath = media_converter.convert_images_to_video(
-        image_paths=disturbed_image_file_paths,
-        output_dir=output_videos_dir,
-        file_name="disturbed_video.mp4",
-    )
-    disturbed_decorated_video_filepath = media_converter.convert_images_to_video(
-        image_paths=disturbed_decorated_image_file_paths,
-        output_dir=output_videos_dir,
-        file_name="disturbed_decorated_video.mp4",
-    )
+        print("Saving disturbed video")
 
-    print("Disturbed video saved to " + disturbed_video_filepath)
+        disturbed_video_filepath = media_converter.convert_images_to_video(
+            image_paths=disturbed_frames.get_paths(),
+            output_dir=output_videos_dir,
+            file_name=media_converter.get_video_file_name(
+                "disturbed_video", disturbed_video_codec
+            ),
+            video_codec=disturbed_video_codec,
+        )
+        disturbed_decorated_video_filepath = media_converter.convert_images_to_video(
+            image_paths=disturbed_decorated_image_file_paths,
+            output_dir=output_videos_dir,
+            file_name="disturbed_decorated_video.mp4",
+        )
+
+        print("Disturbed video saved to " + disturbed_video_filepath)
 
     end_time = time.time()
     elapsed_time = end_time - start_time
@@ -0,0 +1,404 @@
+import argparse
+import concurrent.futures
+import contextlib
+import csv
+import json
+import os
+import re
+import sys
+import time
+import traceback
+import cv2
+from attack_video import generate_disturbed_video_in_memory
+from helpers.AdversarialAttack import AdversarialAttack
+from helpers.AttackDetector import AttackDetector
+from helpers.AttackSchedule import AttackSchedule
+from helpers.DataVisualizer import DataVisualizer
+from helpers.DetectionReport import DetectionReport
+from helpers.MediaConverter import MediaConverter
+
+VIDEO_EXTENSIONS = (".avi", ".mkv", ".mov", ".mp4", ".m4v", ".mpg", ".mpeg", ".webm")
+
+# Written last in the output directory of a video, its presence marks the video as done
+REPORT_FILE_NAME = "report.json"
+
+
+def find_videos(input_path):
+    """
+    Lists the videos of a directory, recursively, or of a manifest file.
+
+    A manifest lists one video path per line, relative paths are relative to the manifest.
+    Empty lines and lines starting with # are ignored.
+
+    Args:
+        input_path (str): A directory or a manifest file.
+
+    Returns:
+        list: The video paths, in a stable order.
+    """
+    if os.path.isdir(input_path):
+        videos = []
+        for directory, _, file_names in os.walk(input_path):
+            videos.extend(
+                os.path.join(directory, file_name)
+                for file_name in file_names
+                if file_name.lower().endswith(VIDEO_EXTENSIONS)
+            )
+        return sorted(videos)
+
+    manifest_dir = os.path.dirname(os.path.abspath(input_path))
+    with open(input_path) as file:
+        lines = [line.strip() for line in file]
+    return [
+        os.path.normpath(os.path.join(manifest_dir, line))
+        for line in lines
+        if line and not line.startswith("#")
+    ]
+
+
+def get_job_dirs(videos, output_dir):
+    """
+    Maps every video to its own output directory, named after its path below the common
+    directory of all videos so videos with the same file name do not collide.
+
+    Args:
+        videos (list): The video paths.
+        output_dir (str): Directory holding the output directories of all videos.
+
+    Returns:
+        list: The output directory of each video.
+    """
+    if not videos:
+        return []
+
+    absolute_paths = [os.path.abspath(video) for video in videos]
+    root = os.path.commonpath([os.path.dirname(path) for path in absolute_paths])
+    job_dirs = []
+    for path in absolute_paths:
+        name = os.path.splitext(os.path.relpath(path, root))[0]
+        name = re.sub(r"[^A-Za-z0-9_-]", "_", name.replace(os.sep, "__"))
+        job_dirs.append(os.path.join(output_dir, name))
+    return job_dirs
+
+
+def initialize_worker():
+    """
+    Limits OpenCV to one thread, each worker process handles one video on one core.
+    """
+    cv2.setNumThreads(1)
+
+
+def run_job(video_filepath, job_dir, options):
+    """
+    Attacks, detects and reports one video in its own output directory.
+
+    The output of the stages goes to a log file in the output directory, a failure is logged
+    there and reported without stopping the batch.
+
+    Args:
+        video_filepath (str): Path of the video.
+        job_dir (str): Output directory of the video.
+        options (dict): The codec, contamination, seed, schedule, max_frames and pdf options of
+            the batch.
+
+    Returns:
+        dict: The video, its output directory, its status and, when completed, its metrics.
+    """
+    start_time = time.time()
+    os.makedirs(job_dir, exist_ok=True)
+    result = {"video_filepath": video_filepath, "job_dir": job_dir}
+
+    with open(os.path.join(job_dir, "log.txt"), "w") as log, contextlib.redirect_stdout(
+        log
+    ), contextlib.redirect_stderr(log):
+        try:
+            media_converter = MediaConverter(frame_format="png")
+            adversarial_attack = AdversarialAttack(
+                seed=options["seed"], image_format="png"
+            )
+            disturbed_video_filepath, actual_attack_indexes = (
+                generate_disturbed_video_in_memory(
+                    original_video_filepath=video_filepath,
+                    result_dir=job_dir,
+                    save_frames_to_disk=False,
+                    media_converter=media_converter,
+                    adversarial_attack=adversarial_attack,
+                    disturbed_video_codec=options["codec"],
+                    ground_truth_filepath=os.path.join(
+                        job_dir, "attacked_intervals.json"
+                    ),
+                    attack_schedule=AttackSchedule.from_spec(options["schedule"]),
+                    max_frames=options["max_frames"],
+                )
+            )
+
+            attack_detector = AttackDetector(contamination=options["contamination"])
+            detected, detected_attack_indexes, scores = (
+                attack_detector.detect_attack_from_video(
+                    disturbed_video_filepath, media_converter=media_converter
+                )
+            )
+            frame_count = attack_detector.current_frame_count
+            if frame_count == 0:
+                raise ValueError(f"No frames decoded from {video_filepath}")
+            report = DetectionReport(
+                detected_attack_indexes, actual_attack_indexes, frame_count, scores
+            )
+
+            if options["pdf"]:
+                DataVisualizer().visualize_data(
+                    detected_attack_indexes=detected_attack_indexes,
+                    actual_attack_indexes=actual_attack_indexes,
+                    length_of_all_indexes=frame_count,
+                    threshold_list=scores,
+                    score_threshold=0.0,
+                    output_dir=job_dir + os.sep,
+                    output_file_name="report.pdf",
+                )
+
+            report_path = os.path.join(job_dir, REPORT_FILE_NAME)
+            temporary_path = f"{report_path}.{os.getpid()}.tmp"
+            report.write_json(
+                temporary_path,
+                video_filepath=video_filepath,
+                detected=detected,
+                elapsed=time.time() - start_time,
+            )
+            os.replace(temporary_path, report_path)
+        except Exception as error:
+            traceback.print_exc()
+            return {**result, "status": "failed", "error": repr(error)}
+
+    return {
+        **result,
+        "status": "completed",
+        "elapsed": time.time() - start_time,
+        "metrics": report.to_dict()["metrics"],
+    }
+
+
+def run_batch(videos, output_dir, workers, options, resume=True):
+    """
+    Runs every video not completed yet on a pool of worker processes.
+
+    Videos are submitted largest first, so the longest jobs do not start last and leave the
+    other workers idle at the end. At most twice as many videos as workers are queued, so
+    a worker never waits for work and the queue does not grow with the batch.
+
+    Args:
+        videos (list): The video paths.
+        output_dir (str): Directory holding the output directories of all videos.
+        workers (int): Number of worker processes.
+        options (dict): Options passed to run_job.
+        resume (bool, optional): Skip the videos whose report already exists. Defaults to True.
+
+    Returns:
+        list: The result of each video, skipped videos have the "skipped" status.
+    """
+    jobs = list(zip(videos, get_job_dirs(videos, output_dir)))
+    results = []
+    pending = []
+    for video_filepath, job_dir in jobs:
+        if resume and os.path.exists(os.path.join(job_dir, REPORT_FILE_NAME)):
+            results.append(
+                {
+                    "video_filepath": video_filepath,
+                    "job_dir": job_dir,
+                    "status": "skipped",
+                }
+            )
+        else:
+            pending.append((video_filepath, job_dir))
+
+    print(
+        f"{len(jobs)} videos, {len(results)} already completed, "
+        f"{len(pending)} to run on {workers} workers"
+    )
+    pending.sort(key=lambda job: _get_file_size(job[0]), reverse=True)
+
+    with concurrent.futures.ProcessPoolExecutor(
+        workers, initializer=initialize_worker
+    ) as executor:
+        pending = iter(pending)
+        in_flight = {}
+        finished = 0
+        while True:
+            while len(in_flight) < 2 * workers:
+                job = next(pending, None)
+                if job is None:
+                    break
+                future = executor.submit(run_job, *job, options)
+                in_flight[future] = job
+
+            if not in_flight:
+                break
+
+            done, _ = concurrent.futures.wait(
+                in_flight, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in done:
+                video_filepath, job_dir = in_flight.pop(future)
+                try:
+                    result = future.result()
+                except Exception as error:
+                    # The worker itself died, e.g. killed by the system
+                    result = {
+                        "video_filepath": video_filepath,
+                        "job_dir": job_dir,
+                        "status": "failed",
+                        "error": repr(error),
+                    }
+                results.append(result)
+                finished += 1
+                print(f"[{finished}] {result['status']}: {video_filepath}")
+
+    return results
+
+
+def summarize(results, output_dir):
+    """
+    Aggregates the reports of all completed videos, including the ones of previous runs.
+
+    Writes summary.json with the totals and the failed videos, and summary.csv with the
+    metrics of every video.
+
+    Args:
+        results (list): The results of run_batch.
+        output_dir (str): Directory holding the output directories of all videos.
+
+    Returns:
+        dict: The summary.
+    """
+    counts = ("true_positives", "false_positives", "false_negatives", "true_negatives")
+    totals = dict.fromkeys(("frames",) + counts, 0)
+    rows = []
+    failures = []
+    for result in results:
+        if result["status"] == "failed":
+            failures.append(result)
+            continue
+
+        with open(os.path.join(result["job_dir"], REPORT_FILE_NAME)) as file:
+            metrics = json.load(file)["metrics"]
+        for name in totals:
+            totals[name] += metrics[name]
+        rows.append(
+            {
+                "video_filepath": result["video_filepath"],
+                **{name: metrics[name] for name in ("frames",) + counts},
+                "accuracy": metrics["accuracy"],
+            }
+        )
+
+    correct = totals["true_positives"] + totals["true_negatives"]
+    summary = {
+        "videos": len(results),
+        "completed": len(rows),
+        "failed": len(failures),
+        "skipped": sum(result["status"] == "skipped" for result in results),
+        **totals,
+        "accuracy": correct / totals["frames"] * 100 if totals["frames"] else 0.0,
+        "failures": failures,
+    }
+
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, "summary.json"), "w") as file:
+        json.dump(summary, file, indent=2)
+    with open(os.path.join(output_dir, "summary.csv"), "w", newline="") as file:
+        writer = csv.DictWriter(
+            file,
+            fieldnames=["video_filepath", "frames", *counts, "accuracy"],
+        )
+        writer.writeheader()
+        writer.writerows(rows)
+    return summary
+
+
+def _get_file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Attacks, detects and reports every video of a directory or manifest."
+    )
+    parser.add_argument(
+        "input", help="Directory of videos, or manifest file with one path per line"
+    )
+    parser.add_argument(
+        "--output-dir",
+        default="results/batch",
+        help="Directory for the output directory of each video and the summary",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count(),
+        help="Number of videos processed in parallel",
+    )
+    parser.add_argument(
+        "--no-resume",
+        action="store_true",
+        help="Process the videos that already have a report again",
+    )
+    parser.add_argument("--codec", default="FFV1", help="Codec of the disturbed videos")
+    parser.add_argument("--contamination", type=float, default=0.2)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--schedule",
+        help="JSON file of the AttackSchedule spec deciding which frames are attacked, "
+        "defaults to frames 20 to 30",
+    )
+    parser.add_argument(
+        "--max-frames",
+        type=int,
+        default=60,
+        help="Number of frames of each video to attack and detect, 0 for all frames",
+    )
+    parser.add_argument(
+        "--pdf", action="store_true", help="Also render the PDF report of each video"
+    )
+    args = parser.parse_args()
+
+    start_time = time.time()
+    videos = find_videos(args.input)
+    options = {
+        "codec": args.codec,
+        "contamination": args.contamination,
+        "seed": args.seed,
+        "schedule": (
+            AttackSchedule.from_spec(args.schedule).to_spec()
+            if args.schedule
+            else AttackSchedule.from_range(20, 31, epsilon=10).to_spec()
+        ),
+        "max_frames": args.max_frames or None,
+        "pdf": args.pdf,
+    }
+    results = run_batch(
+        videos,
+        args.output_dir,
+        max(args.workers, 1),
+        options,
+        resume=not args.no_resume,
+    )
+    summary = summarize(results, args.output_dir)
+
+    print(
+        f"\n{summary['completed']} completed ({summary['skipped']} from previous runs), "
+        f"{summary['failed']} failed, accuracy {summary['accuracy']:.2f}% "
+        f"over {summary['frames']} frames"
+    )
+    for failure in summary["failures"]:
+        print(f"Failed: {failure['video_filepath']}: {failure['error']}")
+    print(f"Summary saved to {os.path.join(args.output_dir, 'summary.json')}")
+    print(f"\nElapsed time for calculations: {time.time() - start_time} seconds")
+
+    if summary["failed"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
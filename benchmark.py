@@ -0,0 +1,502 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import cv2
+import numpy as np
+import sklearn
+from helpers.AdversarialAttack import AdversarialAttack
+from helpers.AttackDetector import AttackDetector
+from helpers.AttackSchedule import AttackSchedule
+from helpers.DataVisualizer import DataVisualizer
+from helpers.FrameExecutor import FrameExecutor
+from helpers.MediaConverter import MediaConverter
+from helpers.VideoWriterSink import VideoWriterSink
+from main import run_in_memory_pipeline
+
+
+def generate_synthetic_video(
+    output_dir, file_name, width=640, height=360, frame_count=120, fps=30, seed=0
+):
+    """
+    Writes a deterministic synthetic video: a smooth gradient with moving shapes and sensor-like noise.
+
+    Args:
+        output_dir (str): Directory to save the video.
+        file_name (str): Name of the video file.
+        width (int, optional): Width of the frames. Defaults to 640.
+        height (int, optional): Height of the frames. Defaults to 360.
+        frame_count (int, optional): Number of frames. Defaults to 120.
+        fps (int, optional): Frame rate of the video. Defaults to 30.
+        seed (int, optional): Seed of the noise and shape layout. Defaults to 0.
+
+    Returns:
+        str: Path to the video file.
+    """
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    background = np.stack(
+        [
+            96 + 64 * x / width,
+            96 + 64 * y / height,
+            128 + 32 * np.sin(x / width * np.pi) * np.cos(y / height * np.pi),
+        ],
+        axis=-1,
+    ).astype(np.float32)
+
+    centers = rng.uniform(0, 1, (4, 2)) * (width, height)
+    velocities = rng.uniform(-3, 3, (4, 2))
+    colors = rng.integers(0, 256, (4, 3)).tolist()
+    radius = max(4, min(width, height) // 10)
+
+    with VideoWriterSink(output_dir, file_name, fps=fps, fourcc="MJPG") as video:
+        for i in range(frame_count):
+            frame = background + rng.normal(0, 2, background.shape).astype(np.float32)
+            frame = np.clip(frame, 0, 255).astype(np.uint8)
+            for center, velocity, color in zip(centers, velocities, colors):
+                position = (center + velocity * i) % (width, height)
+                cv2.circle(frame, tuple(int(v) for v in position), radius, color, -1)
+            video.write(cv2.GaussianBlur(frame, (3, 3), 0))
+
+    return os.path.join(output_dir, file_name)
+
+
+def get_attack_indexes(frame_count, attack_ratio):
+    """
+    Returns the indexes of the attacked frames, a contiguous block in the middle of the video.
+
+    Args:
+        frame_count (int): Number of frames.
+        attack_ratio (float): Share of the frames to attack.
+
+    Returns:
+        list: Indexes of the attacked frames.
+    """
+    attack_count = int(round(frame_count * attack_ratio))
+    start = (frame_count - attack_count) // 2
+    return list(range(start, start + attack_count))
+
+
+def get_cpu_seconds():
+    """
+    Returns the CPU time of the process and of its finished child processes, e.g. the workers of
+    a process pool that was shut down.
+
+    Returns:
+        float: The user and system CPU time in seconds.
+    """
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+def get_peak_rss_mb():
+    """
+    Returns the peak resident set size of the process so far.
+
+    Returns:
+        float: The peak RSS in MiB.
+    """
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    if sys.platform == "darwin":
+        return peak_rss / (1 << 20)
+    return peak_rss / (1 << 10)
+
+
+class StageTimer:
+    """
+    A context manager to measure the wall time, CPU time and peak RSS of a benchmark stage.
+
+    The CPU time includes the child processes that finished during the stage.
+    """
+
+    def __init__(self, stages, name, frame_count) -> None:
+        """
+        Args:
+            stages (dict): Stage name to measurements, the stage is added on exit.
+            name (str): Name of the stage.
+            frame_count (int): Number of frames the stage processes.
+        """
+        self.stages = stages
+        self.name = name
+        self.frame_count = frame_count
+
+    def __enter__(self):
+        self.wall_start = time.perf_counter()
+        self.cpu_start = get_cpu_seconds()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        wall_seconds = time.perf_counter() - self.wall_start
+        self.stages[self.name] = {
+            "wall_seconds": wall_seconds,
+            "cpu_seconds": get_cpu_seconds() - self.cpu_start,
+            "frames": self.frame_count,
+            "frames_per_second": (
+                self.frame_count / wall_seconds if wall_seconds > 0 else None
+            ),
+            "peak_rss_mb": get_peak_rss_mb(),
+        }
+
+
+def run_benchmark(
+    work_dir,
+    width=640,
+    height=360,
+    frame_count=120,
+    attack_ratio=0.2,
+    seed=0,
+    executor_backend="processes",
+):
+    """
+    Runs every stage of the file based pipeline on a synthetic video and measures each stage,
+    then measures the in-memory pipeline of main.py end to end on the same video.
+
+    The stages and their total only cover the file based pipeline, so they compare with the
+    results of previous versions. The in-memory run is reported apart, under "end_to_end".
+
+    Args:
+        work_dir (str): Directory for the synthetic video and intermediate files.
+        width (int, optional): Width of the frames. Defaults to 640.
+        height (int, optional): Height of the frames. Defaults to 360.
+        frame_count (int, optional): Number of frames. Defaults to 120.
+        attack_ratio (float, optional): Share of the frames to attack. Defaults to 0.2.
+        seed (int, optional): Seed of the synthetic video and the attacks. Defaults to 0.
+        executor_backend (str, optional): FrameExecutor backend of the in-memory pipeline.
+            Defaults to "processes".
+
+    Returns:
+        dict: The configuration, environment, per-stage measurements and totals of the run.
+    """
+    original_frames_dir = os.path.join(work_dir, "original_frames")
+    disturbed_frames_dir = os.path.join(work_dir, "disturbed_frames")
+    decorated_frames_dir = os.path.join(work_dir, "decorated_frames")
+    output_videos_dir = os.path.join(work_dir, "output_videos")
+
+    video_filepath = generate_synthetic_video(
+        work_dir, "synthetic_video.avi", width, height, frame_count, seed=seed
+    )
+    actual_attack_indexes = get_attack_indexes(frame_count, attack_ratio)
+    attacked = set(actual_attack_indexes)
+
+    media_converter = MediaConverter()
+    adversarial_attack = AdversarialAttack(seed=seed)
+    attack_detector = AttackDetector()
+    data_visualizer = DataVisualizer()
+    stages = {}
+
+    with StageTimer(stages, "decode", frame_count):
+        frames = media_converter.convert_video_to_frames(video_filepath)
+
+    with StageTimer(stages, "save_frames_to_folder", len(frames)):
+        original_paths = media_converter.save_frames_to_folder(
+            frames=frames, output_dir=original_frames_dir
+        )
+    del frames
+
+    with StageTimer(stages, "fgsm_attack", len(attacked)):
+        disturbed_paths = [
+            (
+                adversarial_attack.fgsm_attack(
+                    image_path=path, epsilon=5, output_dir=disturbed_frames_dir
+                )
+                if i in attacked
+                else path
+            )
+            for i, path in enumerate(original_paths)
+        ]
+
+    with StageTimer(stages, "decorate_image", len(disturbed_paths)):
+        decorated_paths = [
+            media_converter.decorate_image(
+                image_path=path,
+                output_dir=decorated_frames_dir,
+                color=(0, 0, 255) if i in attacked else (0, 255, 0),
+                count=i,
+            )
+            for i, path in enumerate(disturbed_paths)
+        ]
+
+    # A clean frame is compared with a copy of itself, the detector returns early when both
+    # paths are the same file and would not compute anything
+    os.makedirs(disturbed_frames_dir, exist_ok=True)
+    compared_paths = [
+        (
+            path
+            if i in attacked
+            else shutil.copy(
+                path,
+                os.path.join(disturbed_frames_dir, f"clean_{os.path.basename(path)}"),
+            )
+        )
+        for i, path in enumerate(disturbed_paths)
+    ]
+
+    with StageTimer(stages, "detect_attack_given_two_paths", len(original_paths)):
+        differences = [
+            attack_detector.detect_attack_given_two_paths(original_path, compared_path)
+            for original_path, compared_path in zip(original_paths, compared_paths)
+        ]
+
+    with StageTimer(stages, "detect_attack_from_image_paths", len(disturbed_paths)):
+        _, detected_attack_indexes, _ = attack_detector.detect_attack_from_image_paths(
+            disturbed_paths
+        )
+
+    with StageTimer(stages, "convert_images_to_video", len(decorated_paths)):
+        media_converter.convert_images_to_video(
+            image_paths=decorated_paths,
+            output_dir=output_videos_dir,
+            file_name="decorated_video.mp4",
+        )
+
+    with StageTimer(stages, "visualize_data", frame_count):
+        data_visualizer.visualize_data(
+            detected_attack_indexes=detected_attack_indexes,
+            actual_attack_indexes=actual_attack_indexes,
+            length_of_all_indexes=frame_count,
+            threshold_list=differences,
+            output_dir=work_dir + os.sep,
+            output_file_name="benchmark_plots.pdf",
+        )
+
+    # Decoding, the attack, detection, the four videos and the report of main.py
+    end_to_end = {}
+    with StageTimer(end_to_end, "in_memory_pipeline", frame_count):
+        with FrameExecutor(
+            backend=executor_backend, chunk_size=4
+        ) as frame_executor, DataVisualizer() as pipeline_data_visualizer:
+            run_in_memory_pipeline(
+                original_video_filepath=video_filepath,
+                result_dir=os.path.join(work_dir, "in_memory"),
+                save_frames_to_disk=False,
+                media_converter=media_converter,
+                adversarial_attack=AdversarialAttack(seed=seed),
+                attack_detector=AttackDetector(),
+                data_visualizer=pipeline_data_visualizer,
+                frame_executor=frame_executor,
+                attack_schedule=AttackSchedule.from_range(
+                    actual_attack_indexes[0] if actual_attack_indexes else 0,
+                    actual_attack_indexes[-1] + 1 if actual_attack_indexes else 0,
+                    epsilon=5,
+                ),
+            )
+
+    total_seconds = sum(stage["wall_seconds"] for stage in stages.values())
+    for stage in stages.values():
+        stage["share"] = stage["wall_seconds"] / total_seconds if total_seconds else 0
+
+    return {
+        "config": {
+            "width": width,
+            "height": height,
+            "frame_count": frame_count,
+            "attack_ratio": attack_ratio,
+            "seed": seed,
+            "executor_backend": executor_backend,
+        },
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "numpy": np.__version__,
+            "opencv": cv2.__version__,
+            "sklearn": sklearn.__version__,
+        },
+        "stages": stages,
+        "total": {
+            "wall_seconds": total_seconds,
+            "frames_per_second": frame_count / total_seconds if total_seconds else None,
+            "peak_rss_mb": get_peak_rss_mb(),
+        },
+        "end_to_end": end_to_end,
+        "detection": {
+            "actual_attack_indexes": actual_attack_indexes,
+            "detected_attack_indexes": detected_attack_indexes,
+        },
+    }
+
+
+def merge_results(results):
+    """
+    Merges repeated runs of the same configuration, keeping the fastest run of each stage.
+
+    Args:
+        results (list): Results of run_benchmark.
+
+    Returns:
+        dict: The merged result.
+    """
+    merged = dict(results[0])
+    for section in ("stages", "end_to_end"):
+        merged[section] = {
+            name: dict(
+                min(
+                    (result[section][name] for result in results),
+                    key=lambda stage: stage["wall_seconds"],
+                )
+            )
+            for name in results[0][section]
+        }
+
+    total_seconds = sum(stage["wall_seconds"] for stage in merged["stages"].values())
+    for stage in merged["stages"].values():
+        stage["share"] = stage["wall_seconds"] / total_seconds if total_seconds else 0
+
+    frame_count = merged["config"]["frame_count"]
+    merged["total"] = {
+        "wall_seconds": total_seconds,
+        "frames_per_second": frame_count / total_seconds if total_seconds else None,
+        "peak_rss_mb": max(result["total"]["peak_rss_mb"] for result in results),
+    }
+    merged["config"] = dict(merged["config"], repeat=len(results))
+    return merged
+
+
+def print_report(result):
+    """
+    Prints the per-stage measurements of a run as a table.
+
+    Args:
+        result (dict): The result of run_benchmark.
+    """
+    config = result["config"]
+    print(
+        f"\n{config['width']}x{config['height']}, {config['frame_count']} frames, "
+        f"attack ratio {config['attack_ratio']}"
+    )
+    print(
+        f"{'stage':<32}{'seconds':>10}{'cpu':>10}{'frames/s':>12}{'share':>8}{'rss MiB':>10}"
+    )
+    for name, stage in result["stages"].items():
+        frames_per_second = stage["frames_per_second"] or 0
+        print(
+            f"{name:<32}{stage['wall_seconds']:>10.3f}{stage['cpu_seconds']:>10.3f}"
+            f"{frames_per_second:>12.1f}{stage['share']:>8.1%}{stage['peak_rss_mb']:>10.1f}"
+        )
+    total = result["total"]
+    print(
+        f"{'total':<32}{total['wall_seconds']:>10.3f}{'':>10}"
+        f"{total['frames_per_second'] or 0:>12.1f}{'':>8}{total['peak_rss_mb']:>10.1f}"
+    )
+    for name, stage in result.get("end_to_end", {}).items():
+        print(
+            f"{name:<32}{stage['wall_seconds']:>10.3f}{stage['cpu_seconds']:>10.3f}"
+            f"{stage['frames_per_second'] or 0:>12.1f}{'':>8}{stage['peak_rss_mb']:>10.1f}"
+        )
+
+
+def compare_results(result, baseline, tolerance=0.1):
+    """
+    Compares the throughput of each stage and of the end to end run with a baseline run.
+
+    Args:
+        result (dict): The result of run_benchmark.
+        baseline (dict): A previous result of run_benchmark, e.g. loaded from its JSON export.
+        tolerance (float, optional): Allowed relative throughput drop before a stage counts as
+            a regression. Defaults to 0.1.
+
+    Returns:
+        list: Names of the stages that regressed.
+    """
+    if result["config"] != baseline.get("config"):
+        print("\nWarning: the baseline was run with a different configuration")
+
+    regressions = []
+    print(f"\n{'stage':<32}{'baseline f/s':>14}{'current f/s':>14}{'change':>10}")
+    for section in ("stages", "end_to_end"):
+        for name, stage in result.get(section, {}).items():
+            baseline_stage = baseline.get(section, {}).get(name)
+            if not baseline_stage or not baseline_stage["frames_per_second"]:
+                continue
+
+            current = stage["frames_per_second"] or 0
+            previous = baseline_stage["frames_per_second"]
+            change = current / previous - 1
+            marker = ""
+            if change < -tolerance:
+                regressions.append(name)
+                marker = "  REGRESSION"
+            print(f"{name:<32}{previous:>14.1f}{current:>14.1f}{change:>10.1%}{marker}")
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmarks every pipeline stage on a deterministic synthetic video."
+    )
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=360)
+    parser.add_argument("--frames", type=int, default=120)
+    parser.add_argument("--attack-ratio", type=float, default=0.2)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--executor-backend",
+        choices=("processes", "threads", "sequential"),
+        default="processes",
+        help="FrameExecutor backend of the in-memory pipeline",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=1,
+        help="Number of runs, the fastest run of each stage is kept",
+    )
+    parser.add_argument(
+        "--output", default="benchmark_results.json", help="JSON file for the results"
+    )
+    parser.add_argument("--baseline", help="JSON results of a previous run to compare")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.1,
+        help="Allowed relative throughput drop against the baseline",
+    )
+    parser.add_argument(
+        "--work-dir", help="Directory for intermediate files, kept after the run"
+    )
+    args = parser.parse_args()
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="benchmark_")
+    try:
+        result = merge_results(
+            [
+                run_benchmark(
+                    work_dir,
+                    width=args.width,
+                    height=args.height,
+                    frame_count=args.frames,
+                    attack_ratio=args.attack_ratio,
+                    seed=args.seed,
+                    executor_backend=args.executor_backend,
+                )
+                for _ in range(max(args.repeat, 1))
+            ]
+        )
+    finally:
+        if args.work_dir is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    print_report(result)
+
+    with open(args.output, "w") as file:
+        json.dump(result, file, indent=2)
+    print(f"\nResults saved to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        regressions = compare_results(result, baseline, args.tolerance)
+        if regressions:
+            print(f"\nRegressed stages: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
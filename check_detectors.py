@@ -0,0 +1,70 @@
+import argparse
+import shutil
+import sys
+import tempfile
+from benchmark import generate_synthetic_video
+from helpers.MediaConverter import MediaConverter
+from helpers.MultiResolutionAttackDetector import MultiResolutionAttackDetector
+
+
+def find_clean_flags(video_filepath, media_converter):
+    """
+    Runs the MultiResolutionAttackDetector over a clean video and returns the flagged frames.
+
+    Args:
+        video_filepath (str): Path of a video without attacked frames.
+        media_converter (MediaConverter): Instance of the MediaConverter class.
+
+    Returns:
+        list: Indexes of the frames flagged as attacked, all of them false positives.
+    """
+    detections = MultiResolutionAttackDetector().detect_attack_from_stream(
+        frame for _, _, frame in media_converter.stream_video_frames(video_filepath)
+    )
+    return [i for i, attacked, _ in detections if attacked]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Checks that the streaming detectors flag no frame of clean synthetic "
+        "videos with moving content."
+    )
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=360)
+    parser.add_argument("--frames", type=int, default=120)
+    parser.add_argument(
+        "--seeds", type=int, default=3, help="Number of synthetic videos, one per seed"
+    )
+    args = parser.parse_args()
+
+    media_converter = MediaConverter()
+    work_dir = tempfile.mkdtemp(prefix="check_detectors_")
+    failures = 0
+    try:
+        for seed in range(args.seeds):
+            video_filepath = generate_synthetic_video(
+                work_dir,
+                f"clean_video_{seed}.avi",
+                args.width,
+                args.height,
+                args.frames,
+                seed=seed,
+            )
+            clean_flags = find_clean_flags(video_filepath, media_converter)
+            if clean_flags:
+                failures += 1
+                print(
+                    f"Seed {seed}: MultiResolutionAttackDetector flagged "
+                    f"{len(clean_flags)} clean frames: {clean_flags}"
+                )
+            else:
+                print(f"Seed {seed}: no clean frame flagged")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
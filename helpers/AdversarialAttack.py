@@ -1,6 +1,8 @@
 import os
+import cv2
 import numpy as np
 from PIL import Image
+from helpers.Instrumentation import Instrumentation
 
 
 class AdversarialAttack:
@@ -8,6 +10,32 @@ class AdversarialAttack:
     A class to perform adversarial attacks on images using the Fast Gradient Sign Method (FGSM).
     """
 
+    # Image format to the PIL save options, JPEG loses most of a small perturbation
+    IMAGE_FORMATS = {
+        "jpg": {},
+        "png": {"compress_level": 1},
+        "bmp": {},
+    }
+
+    def __init__(self, seed=None, instrumentation=None, image_format="jpg") -> None:
+        """
+        Initializes the AdversarialAttack with a seeded random generator.
+
+        Args:
+            seed (int, optional): Seed of the random generator drawing the perturbation signs. Defaults to None.
+            instrumentation (Instrumentation, optional): Records stage metrics. Defaults to the shared instance.
+            image_format (str, optional): Image format of perturbed images, one of IMAGE_FORMATS. Defaults to "jpg".
+        """
+        if image_format not in self.IMAGE_FORMATS:
+            raise ValueError(
+                f"Unknown image format {image_format!r}, "
+                f"expected one of {list(self.IMAGE_FORMATS)}"
+            )
+        self.image_format = image_format
+        self.seed_sequence = np.random.SeedSequence(seed)
+        self.rng = np.random.default_rng(self.seed_sequence)
+        self.instrumentation = instrumentation or Instrumentation.get_default()
+
     def log(self, message):
         """
         Logs a message with the class name.
@@ -23,7 +51,107 @@ class AdversarialAttack:
         """
         print("\n")
 
-    def fgsm_attack(self, image_path, epsilon=0.01, output_dir="."):
+    def get_frame_rng(self, index):
+        """
+        Returns a random generator dedicated to a frame, derived from the seed and the frame index.
+
+        The perturbation of a frame then does not depend on which worker, thread or process, draws it.
+
+        Args:
+            index (int): Index of the frame.
+
+        Returns:
+            numpy.random.Generator: The random generator of the frame.
+        """
+        return np.random.default_rng([self.seed_sequence.entropy, index])
+
+    def fgsm_attack_frame(self, frame, epsilon=0.01, rng=None):
+        """
+        Performs an FGSM attack on an in-memory frame without touching the disk.
+
+        Args:
+            frame (numpy.ndarray): The input frame as a uint8 array.
+            epsilon (float, optional): The attack strength parameter. Defaults to 0.01.
+            rng (numpy.random.Generator, optional): The random generator to draw the signs from.
+                Defaults to the generator seeded in the constructor.
+
+        Returns:
+            numpy.ndarray: The perturbed frame as a uint8 array.
+        """
+        return self.fgsm_attack_batch(np.asarray(frame)[np.newaxis], epsilon, rng=rng)[
+            0
+        ]
+
+    def fgsm_attack_batch(self, frames, epsilon=0.01, in_place=False, rng=None):
+        """
+        Performs an FGSM attack on a stack of frames, e.g. a chunk from a video stream.
+
+        The perturbation is computed in uint8 with saturating OpenCV arithmetic, adding
+        floor(epsilon) where the random sign is positive and subtracting ceil(epsilon) where it
+        is negative, which matches clipping and truncating the float result of the per-file attack.
+        The random signs are drawn as packed bits, one bit per pixel channel.
+
+        Args:
+            frames (numpy.ndarray): The input frames as a (N, H, W, C) uint8 array.
+            epsilon (float, optional): The attack strength parameter. Defaults to 0.01.
+            in_place (bool, optional): Whether to overwrite the input frames, which must then be a
+                C-contiguous uint8 array. Defaults to False.
+            rng (numpy.random.Generator, optional): The random generator to draw the signs from.
+                Defaults to the generator seeded in the constructor.
+
+        Returns:
+            numpy.ndarray: The perturbed frames as a (N, H, W, C) uint8 array.
+        """
+        if in_place and not (
+            isinstance(frames, np.ndarray)
+            and frames.dtype == np.uint8
+            and frames.flags.c_contiguous
+            and frames.flags.writeable
+        ):
+            raise ValueError(
+                "in_place needs a writeable C-contiguous uint8 array, "
+                "the frames would be perturbed in a copy"
+            )
+        frames = np.ascontiguousarray(frames, dtype=np.uint8)
+        perturbed_frames = frames if in_place else np.empty_like(frames)
+        rng = self.rng if rng is None else rng
+
+        step_up = min(int(np.floor(epsilon)), 255)
+        step_down = min(int(np.ceil(epsilon)), 255)
+
+        with self.instrumentation.span(
+            "AdversarialAttack.fgsm_attack_batch", emit=False
+        ) as span:
+            for frame, perturbed_frame in zip(frames, perturbed_frames):
+                # View each frame as a single channel 2D image so every channel gets its own sign
+                frame = frame.reshape(frame.shape[0], -1)
+                perturbed_frame = perturbed_frame.reshape(frame.shape)
+
+                positive_signs = self._draw_random_signs(frame.shape, rng)
+                negative_signs = positive_signs ^ 1
+
+                cv2.add(frame, step_up, dst=perturbed_frame, mask=positive_signs)
+                cv2.subtract(frame, step_down, dst=perturbed_frame, mask=negative_signs)
+            span.add(frames=len(frames))
+
+        return perturbed_frames
+
+    def _draw_random_signs(self, shape, rng):
+        """
+        Draws Rademacher signs as a 0/1 uint8 mask, 1 for a positive sign.
+
+        Args:
+            shape (tuple): Shape of the mask.
+            rng (numpy.random.Generator): The random generator to draw the signs from.
+
+        Returns:
+            numpy.ndarray: The sign mask.
+        """
+        size = int(np.prod(shape))
+        random_bytes = np.frombuffer(rng.bytes((size + 7) // 8), dtype=np.uint8)
+        return np.unpackbits(random_bytes, count=size).reshape(shape)
+
+    def fgsm_attack(self, image_path, epsilon=0.01, output_dir=".", rng=None):
         """
         Performs an FGSM attack on the given image and saves the perturbed image.
 
@@ -31,32 +159,43 @@ class AdversarialAttack:
             image_path (str): The path to the input image.
             epsilon (float, optional): The attack strength parameter. Defaults to 0.01.
             output_dir (str, optional): The directory to save the perturbed image. Defaults to the current directory.
+            rng (numpy.random.Generator, optional): The random generator to draw the signs from,
+                e.g. get_frame_rng when images are attacked concurrently. Defaults to the generator
+                seeded in the constructor.
 
         Returns:
             str: The path to the perturbed image.
         """
-        # Open the image and convert it to a NumPy array
-        image = Image.open(image_path)
-        image = np.asarray(image).astype(np.float32)
-
-        # Generate the perturbation
-        perturbation = epsilon * np.sign(np.random.randn(*image.shape))
+        with self.instrumentation.span(
+            "AdversarialAttack.fgsm_attack", emit=False
+        ) as span:
+            # Open the image and convert it to a NumPy array
+            image = np.asarray(Image.open(image_path))
 
-        # Apply the perturbation and clip the values to be in the valid range [0, 255]
-        perturbed_image = image + perturbation
-        perturbed_image = np.clip(perturbed_image, 0, 255)
+            # Generate and apply the perturbation
+            perturbed_image = self.fgsm_attack_frame(image, epsilon=epsilon, rng=rng)
 
-        # Construct the filename for the perturbed image
-        filename = os.path.basename(image_path).split(".")[0]
-        perturbed_path = os.path.join(output_dir, f"{filename}_perturbed.jpg")
+            # Construct the filename for the perturbed image
+            filename = os.path.basename(image_path).split(".")[0]
+            perturbed_path = os.path.join(
+                output_dir, f"{filename}_perturbed.{self.image_format}"
+            )
 
-        # Create the output directory if it doesn't exist
-        if not os.path.exists(output_dir):
-            os.makedirs(output_dir)
+            # Create the output directory if it doesn't exist
+            if not os.path.exists(output_dir):
+                os.makedirs(output_dir)
 
-        # Save the perturbed image
-        perturbed_image = Image.fromarray(perturbed_image.astype(np.uint8))
-        perturbed_image.save(perturbed_path)
+            # Save the perturbed image
+            perturbed_image = Image.fromarray(perturbed_image)
+            perturbed_image.save(
+                perturbed_path, **self.IMAGE_FORMATS[self.image_format]
+            )
+            if self.instrumentation.enabled:
+                span.add(
+                    frames=1,
+                    bytes_read=os.path.getsize(image_path),
+                    bytes_written=os.path.getsize(perturbed_path),
+                )
 
         self.log(f"Completed FGSM attack on {filename}")
         return perturbed_path
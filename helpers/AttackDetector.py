@@ -1,24 +1,68 @@
+import copy
+import os
 import numpy as np
 import cv2
 from sklearn.ensemble import IsolationForest
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_pdf import PdfPages
+from helpers.FeatureExtractor import CompositeFeatureExtractor
+from helpers.FrameComparator import FrameComparator
+from helpers.FrameStore import FrameStore
+from helpers.Instrumentation import Instrumentation
+from helpers.MediaConverter import MediaConverter
+from helpers.ScoreThresholder import ScoreThresholder
 
 
 class AttackDetector:
     """
     A class to detect adversarial attacks on images using Isolation Forest.
+
+    By default a model is fitted on every video and its outliers are flagged. A baseline model
+    fitted once on clean footage of a source, e.g. a camera, can be saved to a ModelRegistry and
+    loaded instead, new videos of the source are then only scored.
+
+    Every detection keeps the continuous decision scores of the frames, negative for outliers, so
+    the verdicts can be thresholded again with threshold_scores without refitting or decoding.
     """
 
-    def __init__(self, contamination=0.1) -> None:
+    def __init__(
+        self,
+        contamination=0.1,
+        warmup_frames=21,
+        min_frames=30,
+        feature_extractor=None,
+        batch_size=32,
+        instrumentation=None,
+        threshold_method="fixed",
+        threshold_parameters=None,
+    ) -> None:
         """
         Initializes the AttackDetector with a specified contamination level.
 
         Args:
             contamination (float, optional): The proportion of outliers in the data set. Defaults to 0.1.
+            warmup_frames (int, optional): Number of leading frames that are never flagged as attacked. Defaults to 21.
+            min_frames (int, optional): Minimum number of frames needed to detect outliers. Defaults to 30.
+            feature_extractor (FeatureExtractor, optional): Turns frames into feature vectors.
+                Defaults to a CompositeFeatureExtractor of compact noise sensitive descriptors.
+            batch_size (int, optional): Number of frames whose features are extracted together. Defaults to 32.
+            instrumentation (Instrumentation, optional): Records stage metrics. Defaults to the shared instance.
+            threshold_method (str, optional): ScoreThresholder method turning decision scores into
+                verdicts. Defaults to "fixed", the decision boundary of the model.
+            threshold_parameters (dict, optional): Parameters of the threshold method. Defaults to None.
         """
         self.contamination = contamination
-        self.model = IsolationForest(contamination=self.contamination, random_state=0)
+        self.warmup_frames = warmup_frames
+        self.min_frames = min_frames
+        self.feature_extractor = feature_extractor or CompositeFeatureExtractor()
+        self.batch_size = batch_size
+        self.current_frame_count = 0
+        self.frame_comparator = FrameComparator()
+        self.instrumentation = instrumentation or Instrumentation.get_default()
+        self.model = None
+        self.baseline_model = None
+        self.score_thresholder = ScoreThresholder()
+        self.threshold_method = threshold_method
+        self.threshold_parameters = threshold_parameters or {}
+        self.scores = np.empty(0)
 
     def log(self, message):
         """
@@ -39,6 +83,10 @@ class AttackDetector:
         """
         Detects the difference in image statistics between two images.
 
+        The statistics of the main image are cached by path, size and modification time, so it
+        is only read once even when compared against several images, and is read again once the
+        file changes.
+
         Args:
             main_image_path (str): The path to the main image.
             second_image_path (str): The path to the second image for comparison.
@@ -46,29 +94,117 @@ class AttackDetector:
         Returns:
             float: The difference in the sum of squared differences from the mean of the images.
         """
-        image_one = cv2.imread(main_image_path)
-        image_one_mean = np.mean(image_one)
-        image_one_ssq = np.sum((image_one - image_one_mean) ** 2)
+        # A frame that was not replaced resolves to the very same file
+        if os.path.abspath(main_image_path) == os.path.abspath(second_image_path):
+            return 0.0
 
+        stat = os.stat(main_image_path)
+        main_frame_key = (
+            os.path.abspath(main_image_path),
+            stat.st_size,
+            stat.st_mtime_ns,
+        )
         image_two = cv2.imread(second_image_path)
-        image_two_mean = np.mean(image_two)
-        image_two_ssq = np.sum((image_two - image_two_mean) ** 2)
+        return self.detect_attack_given_two_frames(
+            lambda: cv2.imread(main_image_path),
+            image_two,
+            main_frame_key=main_frame_key,
+        )
+
+    def detect_attack_given_two_frames(
+        self, main_frame, second_frame, main_frame_key=None
+    ):
+        """
+        Detects the difference in image statistics between two in-memory frames.
+
+        Args:
+            main_frame (np.ndarray or callable): The main frame, or a function loading it only
+                when its statistics are not cached.
+            second_frame (np.ndarray): The second frame for comparison.
+            main_frame_key (hashable, optional): Caches the statistics of the main frame under
+                this key, e.g. its frame index. Defaults to None.
 
-        difference = round(image_one_ssq - image_two_ssq, 14)
+        Returns:
+            float: The difference in the sum of squared differences from the mean of the frames.
+        """
+        with self.instrumentation.span(
+            "AttackDetector.detect_attack_given_two_frames", emit=False
+        ) as span:
+            difference = self.frame_comparator.compare(
+                main_frame, second_frame, main_key=main_frame_key
+            )
+            span.add(frames=1)
         return difference
 
     def extract_features(self, image_path):
         """
-        Extracts features from an image by flattening it into a 1D array.
+        Extracts features from an image with the configured feature extractor.
 
         Args:
             image_path (str): The path to the image.
 
         Returns:
-            np.ndarray: The flattened image as a feature vector.
+            np.ndarray: The feature vector of the image.
         """
         img = cv2.imread(image_path)
-        features = img.flatten()
+        return self.extract_features_from_frame(img)
+
+    def extract_features_from_frame(self, frame):
+        """
+        Extracts features from an in-memory frame with the configured feature extractor.
+
+        Args:
+            frame (np.ndarray): The frame.
+
+        Returns:
+            np.ndarray: The feature vector of the frame.
+        """
+        return self.feature_extractor.extract(frame)
+
+    def extract_features_from_frames(self, frames):
+        """
+        Extracts features from frames in batches of batch_size frames.
+
+        Args:
+            frames (iterable): Frames (as numpy arrays), e.g. a video stream, or a (N, H, W, C)
+                array or FrameStore whose batches are sliced without copies.
+
+        Returns:
+            np.ndarray: The feature vectors as a (N, D) float32 array.
+        """
+        if isinstance(frames, (np.ndarray, FrameStore)):
+            features = [
+                self._extract_batch(frames[start : start + self.batch_size])
+                for start in range(0, len(frames), self.batch_size)
+            ]
+            if not features:
+                return np.empty((0, 0), dtype=np.float32)
+            return np.concatenate(features)
+
+        features = []
+        batch = []
+        for frame in frames:
+            batch.append(frame)
+            if len(batch) == self.batch_size:
+                features.append(self._extract_batch(batch))
+                batch = []
+        if batch:
+            features.append(self._extract_batch(batch))
+
+        if not features:
+            return np.empty((0, 0), dtype=np.float32)
+        return np.concatenate(features)
+
+    def _extract_batch(self, batch):
+        """
+        Extracts the features of a batch, only this time counts as feature extraction, not the
+        time the frames take to arrive.
+        """
+        with self.instrumentation.span(
+            "AttackDetector.extract_features", emit=False
+        ) as span:
+            features = self.feature_extractor.extract_batch(np.asarray(batch))
+            span.add(frames=len(batch))
         return features
 
     def detect_attack_from_image_paths(self, image_paths: list):
@@ -80,25 +216,256 @@ class AttackDetector:
 
         Returns:
             tuple: A tuple containing a boolean indicating success, a list of indexes of attacked images,
-                   and a list of prediction scores.
+                   and an array of decision scores.
+        """
+        return self.detect_attack_from_frames(
+            cv2.imread(image_path) for image_path in image_paths
+        )
+
+    def detect_attack_from_frames(self, frames: list):
+        """
+        Detects adversarial attacks from a list of in-memory frames using Isolation Forest.
+
+        Args:
+            frames (iterable): Frames (as numpy arrays), e.g. a video stream.
+
+        Returns:
+            tuple: A tuple containing a boolean indicating success, a list of indexes of attacked frames,
+                   and an array of decision scores.
+        """
+        features = self.extract_features_from_frames(frames)
+        return self._detect_attack_from_features(features)
+
+    def detect_attack_from_video(
+        self, video_filepath, media_converter=None, feature_cache=None
+    ):
+        """
+        Detects adversarial attacks in a video, reusing cached features when available.
+
+        With a feature cache, repeated runs on the same video with the same feature extractor,
+        e.g. while tuning contamination, skip decoding entirely.
+
+        Args:
+            video_filepath (str): Path to the video file.
+            media_converter (MediaConverter, optional): Used to stream the frames. Defaults to a new MediaConverter.
+            feature_cache (FeatureCache, optional): Cache of previously extracted features. Defaults to None.
+
+        Returns:
+            tuple: A tuple containing a boolean indicating success, a list of indexes of attacked frames,
+                   and an array of decision scores.
+        """
+        features = self.extract_features_from_video(
+            video_filepath, media_converter=media_converter, feature_cache=feature_cache
+        )
+        return self._detect_attack_from_features(features)
+
+    def extract_features_from_video(
+        self, video_filepath, media_converter=None, feature_cache=None
+    ):
+        """
+        Extracts the features of every frame of a video, or loads them from the feature cache.
+
+        Args:
+            video_filepath (str): Path to the video file.
+            media_converter (MediaConverter, optional): Used to stream the frames. Defaults to a new MediaConverter.
+            feature_cache (FeatureCache, optional): Cache of previously extracted features. Defaults to None.
+
+        Returns:
+            np.ndarray: The feature vectors, one row per frame.
+        """
+        features = None
+        if feature_cache is not None:
+            features = feature_cache.load(video_filepath, self.feature_extractor)
+
+        if features is None:
+            media_converter = media_converter or MediaConverter()
+            features = self.extract_features_from_frames(
+                frame
+                for _, _, frame in media_converter.stream_video_frames(video_filepath)
+            )
+            if feature_cache is not None:
+                feature_cache.save(video_filepath, self.feature_extractor, features)
+
+        return features
+
+    def fit_baseline(self, frames, model=None, extra_estimators=50):
+        """
+        Fits a baseline model on clean frames, later detections only score frames against it.
+
+        Args:
+            frames (iterable): Clean frames (as numpy arrays), or their (N, D) features as a float32 array.
+            model (IsolationForest, optional): A baseline of the same source to extend, a copy of it
+                gets extra trees fitted on the new frames. Defaults to None, a new model is fitted.
+            extra_estimators (int, optional): Number of trees added to an extended model. Defaults to 50.
+
+        Returns:
+            IsolationForest: The baseline model.
+        """
+        if isinstance(frames, np.ndarray) and frames.ndim == 2:
+            features = frames
+        else:
+            features = self.extract_features_from_frames(frames)
+
+        with self.instrumentation.span("AttackDetector.fit_baseline") as span:
+            if model is None:
+                # Clean footage holds no outliers, the threshold comes from the score distribution
+                model = IsolationForest(contamination="auto", random_state=0)
+            else:
+                # Warm start keeps the trees of the known footage and only fits the new ones,
+                # on a copy so the model of the previous version is left as it was
+                model = copy.deepcopy(model)
+                model.set_params(
+                    warm_start=True, n_estimators=model.n_estimators + extra_estimators
+                )
+            model.fit(features)
+            span.add(frames=len(features))
+
+        self.baseline_model = model
+        self.log(
+            f"Fitted baseline on {len(features)} frames, {model.n_estimators} trees"
+        )
+        return model
+
+    def fit_baseline_from_video(
+        self, video_filepath, media_converter=None, feature_cache=None, model=None
+    ):
+        """
+        Fits a baseline model on a video of clean footage.
+
+        Args:
+            video_filepath (str): Path to the clean video file.
+            media_converter (MediaConverter, optional): Used to stream the frames. Defaults to a new MediaConverter.
+            feature_cache (FeatureCache, optional): Cache of previously extracted features. Defaults to None.
+            model (IsolationForest, optional): A baseline of the same source to extend. Defaults to None.
+
+        Returns:
+            IsolationForest: The baseline model.
+        """
+        features = self.extract_features_from_video(
+            video_filepath, media_converter=media_converter, feature_cache=feature_cache
+        )
+        return self.fit_baseline(features, model=model)
+
+    def save_baseline(self, model_registry, source, metadata=None):
+        """
+        Saves the baseline model as the new latest version of a source.
+
+        Args:
+            model_registry (ModelRegistry): The registry to save the model to.
+            source (str): The source, e.g. a camera identifier.
+            metadata (dict, optional): Additional information stored with the model. Defaults to None.
+
+        Returns:
+            int: The version of the saved model.
+        """
+        if self.baseline_model is None:
+            raise ValueError("No baseline model to save, fit one first")
+
+        return model_registry.save(
+            source,
+            self.baseline_model,
+            self.feature_extractor,
+            metadata=metadata,
+        )
+
+    def load_baseline(self, model_registry, source, version=None):
+        """
+        Loads the baseline model of a source, fitted on features of the configured extractor.
+
+        Args:
+            model_registry (ModelRegistry): The registry to load the model from.
+            source (str): The source, e.g. a camera identifier.
+            version (int, optional): The version. Defaults to the latest version.
+
+        Returns:
+            bool: Whether a model was found.
+        """
+        self.baseline_model = model_registry.load(
+            source, feature_extractor=self.feature_extractor, version=version
+        )
+        return self.baseline_model is not None
+
+    def _detect_attack_from_features(self, features: list):
+        """
+        Fits Isolation Forest on the given feature vectors and flags the outliers, or only
+        scores them against the baseline model when one is loaded.
+
+        Args:
+            features (np.ndarray): The feature vectors, one row per frame.
+
+        Returns:
+            tuple: A tuple containing a boolean indicating success, a list of indexes of attacked frames,
+                   and an array of decision scores.
         """
         self.log("Started detecting attacks...")
-        if len(image_paths) < 30:
+        self.current_frame_count = len(features)
+        if self.baseline_model is not None:
+            return self._detect_attack_with_baseline(features)
+
+        if len(features) < self.min_frames:
             self.log("Not enough images to detect outliers")
-            return False, [], []
+            self.scores = np.empty(0)
+            return False, [], self.scores
 
         self.model = IsolationForest(contamination=self.contamination, random_state=0)
 
-        features = [self.extract_features(path) for path in image_paths]
+        with self.instrumentation.span("AttackDetector.fit_predict") as span:
+            self.model.fit(features)
+            self.scores = self.model.decision_function(features)
+            span.add(frames=len(features))
 
-        self.model.fit(features)
-        predictions = self.model.predict(features)
+        attacked_images_indexes = self.threshold_scores()
+        self.log(f"Finished detection of outliers... {len(attacked_images_indexes)}")
+        return True, attacked_images_indexes, self.scores
 
-        # Identify attacked images based on predictions
-        threshold_list = predictions.tolist()
-        attacked_images_indexes = [
-            i for i in range(len(image_paths)) if predictions[i] == -1 and (i > 20)
-        ]
+    def _detect_attack_with_baseline(self, features):
+        """
+        Flags the frames the baseline model scores as outliers, without fitting anything.
+
+        Every frame is scored, the warm-up only applies to models fitted on the video itself.
+
+        Args:
+            features (np.ndarray): The feature vectors, one row per frame.
 
+        Returns:
+            tuple: A tuple containing a boolean indicating success, a list of indexes of attacked frames,
+                   and an array of decision scores.
+        """
+        if len(features) == 0:
+            self.scores = np.empty(0)
+            return True, [], self.scores
+
+        with self.instrumentation.span("AttackDetector.predict") as span:
+            self.scores = self.baseline_model.decision_function(features)
+            span.add(frames=len(features))
+
+        attacked_images_indexes = self.threshold_scores()
         self.log(f"Finished detection of outliers... {len(attacked_images_indexes)}")
-        return True, attacked_images_indexes, threshold_list
+        return True, attacked_images_indexes, self.scores
+
+    def threshold_scores(self, scores=None, method=None, **parameters):
+        """
+        Turns decision scores into attacked frame indexes, without refitting or reading frames.
+
+        The leading warm-up frames are never flagged, except when the scores come from a
+        baseline model.
+
+        Args:
+            scores (np.ndarray, optional): Decision scores, negative for outliers. Defaults to the
+                scores of the last detection.
+            method (str, optional): ScoreThresholder method. Defaults to threshold_method.
+            **parameters: Parameters of the method. Default to threshold_parameters when the
+                method is not given.
+
+        Returns:
+            list: Indexes of the attacked frames.
+        """
+        scores = self.scores if scores is None else np.asarray(scores)
+        if method is None:
+            method = self.threshold_method
+            parameters = {**self.threshold_parameters, **parameters}
+
+        attacked = self.score_thresholder.apply(scores, method, **parameters)
+        if self.baseline_model is None:
+            attacked[: self.warmup_frames] = False
+        return np.flatnonzero(attacked).tolist()
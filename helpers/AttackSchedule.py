@@ -0,0 +1,293 @@
+import base64
+import json
+import os
+import numpy as np
+from helpers.DetectionReport import DetectionReport
+
+
+class AttackSchedule:
+    """
+    A class to decide which frames of a video are attacked, from a compact JSON serializable spec.
+
+    A schedule is the union of patterns, each a dict with a "type":
+    - "range": frames start to end, end excluded, e.g. {"type": "range", "start": 20, "end": 31}.
+      Without an end, every frame from start on.
+    - "intervals": a list of [start, end) frame ranges, e.g. {"intervals": [[20, 31], [50, 60]]}.
+    - "bitmap": a base64 string of np.packbits bits, one bit per frame from frame 0.
+    - "rate": every frame independently with probability rate.
+    - "burst": runs of length frames starting at each frame with probability rate.
+    - "periodic": length frames every period frames, starting at offset.
+
+    Random patterns draw from generators seeded with the schedule seed, the index of the
+    pattern and the index of a block of BLOCK_SIZE frames. Whether a frame is attacked therefore
+    does not depend on the length of the video, so a stream can be scheduled frame by frame.
+    """
+
+    PATTERN_TYPES = ("range", "intervals", "bitmap", "rate", "burst", "periodic")
+
+    # Keys each pattern type needs besides "type", the others are optional
+    REQUIRED_KEYS = {
+        "range": ("start",),
+        "intervals": ("intervals",),
+        "bitmap": ("bits",),
+        "rate": ("rate",),
+        "burst": ("rate", "length"),
+        "periodic": ("period", "length"),
+    }
+
+    BLOCK_SIZE = 4096
+
+    # Version of the JSON ground truth files
+    FORMAT_VERSION = 1
+
+    def __init__(self, patterns, seed=0, epsilon=10) -> None:
+        """
+        Initializes the AttackSchedule.
+
+        Args:
+            patterns (list): The pattern dicts, frames matching any pattern are attacked.
+            seed (int, optional): Seed of the random patterns. Defaults to 0.
+            epsilon (float, optional): Strength of the attack on the scheduled frames. Defaults to 10.
+        """
+        for pattern in patterns:
+            self._check_pattern(pattern)
+
+        self.patterns = [dict(pattern) for pattern in patterns]
+        self.seed = seed
+        self.epsilon = epsilon
+        self.mask = np.zeros(0, dtype=bool)
+
+    def log(self, message):
+        """
+        Logs a message with the class name.
+
+        Args:
+            message (str): The message to log.
+        """
+        print(f"{self.__class__.__name__}: {message}")
+
+    @classmethod
+    def from_range(cls, start, end=None, epsilon=10):
+        """
+        Creates a schedule attacking the frames start to end, end excluded.
+
+        Args:
+            start (int): First attacked frame.
+            end (int, optional): Frame after the last attacked frame. Defaults to no end.
+            epsilon (float, optional): Strength of the attack. Defaults to 10.
+
+        Returns:
+            AttackSchedule: The schedule.
+        """
+        return cls([{"type": "range", "start": start, "end": end}], epsilon=epsilon)
+
+    @classmethod
+    def from_spec(cls, spec):
+        """
+        Creates a schedule from its spec.
+
+        Args:
+            spec (dict): The "patterns" list and optionally the "seed" and "epsilon", or a
+                path to a JSON file holding them.
+
+        Returns:
+            AttackSchedule: The schedule.
+        """
+        if isinstance(spec, str):
+            with open(spec) as file:
+                spec = json.load(file)
+        return cls(
+            spec["patterns"], seed=spec.get("seed", 0), epsilon=spec.get("epsilon", 10)
+        )
+
+    def to_spec(self):
+        """
+        Returns the JSON serializable spec of the schedule.
+
+        Returns:
+            dict: The patterns, the seed and the epsilon.
+        """
+        return {"patterns": self.patterns, "seed": self.seed, "epsilon": self.epsilon}
+
+    def get_mask(self, frame_count):
+        """
+        Computes which frames are attacked.
+
+        Args:
+            frame_count (int): Number of frames.
+
+        Returns:
+            np.ndarray: Whether each frame is attacked.
+        """
+        mask = np.zeros(frame_count, dtype=bool)
+        for pattern_index, pattern in enumerate(self.patterns):
+            mask |= self._get_pattern_mask(pattern_index, pattern, frame_count)
+        return mask
+
+    def is_attacked(self, index):
+        """
+        Returns whether a frame is attacked, e.g. while streaming a video of unknown length.
+
+        Args:
+            index (int): Index of the frame.
+
+        Returns:
+            bool: Whether the frame is attacked.
+        """
+        if index >= len(self.mask):
+            self.mask = self.get_mask(
+                max(2 * len(self.mask), index + 1, self.BLOCK_SIZE)
+            )
+        return bool(self.mask[index])
+
+    def get_intervals(self, frame_count):
+        """
+        Returns the attacked frames as [start, end) intervals.
+
+        Args:
+            frame_count (int): Number of frames.
+
+        Returns:
+            np.ndarray: (start, end) rows of the attacked runs.
+        """
+        return DetectionReport.get_intervals(self.get_mask(frame_count))
+
+    @classmethod
+    def save_ground_truth(cls, path, mask, **attributes):
+        """
+        Writes which frames were attacked as a JSON file of [start, end) intervals.
+
+        Args:
+            path (str): Path of the JSON file.
+            mask (np.ndarray): Whether each frame was attacked.
+            **attributes: Additional JSON serializable fields, e.g. the schedule spec.
+
+        Returns:
+            str: The path of the file.
+        """
+        mask = np.asarray(mask, dtype=bool)
+        ground_truth = {
+            "format_version": cls.FORMAT_VERSION,
+            "frame_count": len(mask),
+            "attacked_frames": int(np.count_nonzero(mask)),
+            "intervals": DetectionReport.get_intervals(mask).tolist(),
+            **attributes,
+        }
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        with open(path, "w") as file:
+            json.dump(ground_truth, file)
+        return path
+
+    @classmethod
+    def load_ground_truth(cls, path):
+        """
+        Reads the attacked frame indexes of a JSON ground truth file, or of a text file with one
+        index per line as written by previous versions.
+
+        Args:
+            path (str): Path of the file.
+
+        Returns:
+            list: The attacked frame indexes, in increasing order.
+        """
+        with open(path) as file:
+            if not path.endswith(".json"):
+                return sorted(int(line) for line in file if line.strip())
+            ground_truth = json.load(file)
+
+        if ground_truth.get("format_version") != cls.FORMAT_VERSION:
+            raise ValueError(
+                f"{path} has format version {ground_truth.get('format_version')}, "
+                f"expected {cls.FORMAT_VERSION}"
+            )
+        intervals = ground_truth["intervals"]
+        if not intervals:
+            return []
+        return np.concatenate(
+            [np.arange(start, end) for start, end in intervals]
+        ).tolist()
+
+    def _check_pattern(self, pattern):
+        """
+        Checks the type and the parameters of a pattern.
+        """
+        pattern_type = pattern.get("type")
+        if pattern_type not in self.PATTERN_TYPES:
+            raise ValueError(
+                f"Unknown pattern type {pattern_type!r}, expected one of {self.PATTERN_TYPES}"
+            )
+        for key in self.REQUIRED_KEYS[pattern_type]:
+            if key not in pattern:
+                raise ValueError(f"{pattern_type!r} pattern is missing the key {key!r}")
+        if pattern_type in ("rate", "burst") and not 0 <= pattern["rate"] <= 1:
+            raise ValueError("rate must be in [0, 1]")
+        if pattern_type == "burst" and not 1 <= pattern["length"] <= self.BLOCK_SIZE:
+            raise ValueError(f"length must be in [1, {self.BLOCK_SIZE}]")
+        if pattern_type == "periodic" and pattern["period"] < 1:
+            raise ValueError("period must be at least 1")
+
+    def _get_pattern_mask(self, pattern_index, pattern, frame_count):
+        """
+        Computes which frames a single pattern attacks.
+        """
+        pattern_type = pattern["type"]
+        mask = np.zeros(frame_count, dtype=bool)
+
+        if pattern_type == "range":
+            end = pattern.get("end")
+            mask[pattern["start"] : frame_count if end is None else end] = True
+        elif pattern_type == "intervals":
+            for start, end in pattern["intervals"]:
+                mask[start:end] = True
+        elif pattern_type == "bitmap":
+            bits = np.unpackbits(
+                np.frombuffer(base64.b64decode(pattern["bits"]), dtype=np.uint8)
+            ).astype(bool)
+            bits = bits[: pattern.get("length", len(bits))]
+            mask[: len(bits)] = bits[:frame_count]
+        elif pattern_type == "periodic":
+            offsets = np.arange(frame_count) - pattern.get("offset", 0)
+            mask = (offsets >= 0) & (offsets % pattern["period"] < pattern["length"])
+        else:
+            block_count = -(-frame_count // self.BLOCK_SIZE)
+            blocks = [
+                self._get_random_block(pattern_index, pattern, block)
+                for block in range(block_count)
+            ]
+            if blocks:
+                mask = np.concatenate(blocks)[:frame_count]
+        return mask
+
+    def _get_random_block(self, pattern_index, pattern, block):
+        """
+        Computes which frames of a block a random pattern attacks, bursts started in the
+        previous block can run into this one.
+        """
+        if pattern["type"] == "rate":
+            return (
+                self._get_rng(pattern_index, block).random(self.BLOCK_SIZE)
+                < pattern["rate"]
+            )
+
+        # Burst starts of the previous block and of this block, as a run of 2 blocks
+        starts = np.zeros(2 * self.BLOCK_SIZE, dtype=bool)
+        for position, start_block in enumerate((block - 1, block)):
+            if start_block >= 0:
+                rng = self._get_rng(pattern_index, start_block)
+                starts[
+                    position * self.BLOCK_SIZE : (position + 1) * self.BLOCK_SIZE
+                ] = (rng.random(self.BLOCK_SIZE) < pattern["rate"])
+
+        # A frame is attacked when a burst started less than length frames before it
+        events = np.zeros(len(starts) + pattern["length"], dtype=np.int32)
+        start_indexes = np.flatnonzero(starts)
+        np.add.at(events, start_indexes, 1)
+        np.add.at(events, start_indexes + pattern["length"], -1)
+        covered = np.cumsum(events)[: len(starts)] > 0
+        return covered[self.BLOCK_SIZE :]
+
+    def _get_rng(self, pattern_index, block):
+        return np.random.default_rng([self.seed, pattern_index, block])
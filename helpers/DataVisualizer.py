@@ -1,13 +1,45 @@
-import matplotlib.pyplot as plt
+import concurrent.futures
+import numpy as np
 from matplotlib.backends.backend_pdf import PdfPages
-from sklearn.metrics import confusion_matrix, ConfusionMatrixDisplay
+from matplotlib.figure import Figure
+from sklearn.metrics import ConfusionMatrixDisplay
+from helpers.DetectionReport import DetectionReport
+from helpers.Instrumentation import Instrumentation
 
 
 class DataVisualizer:
     """
     A class to visualize data for adversarial attack detection.
+
+    Detections are turned into a DetectionReport of boolean masks over the frames once, metrics
+    and plots are computed from the masks with numpy. Timelines longer than max_timeline_points
+    are drawn as bands of consecutive frames and binned score envelopes, so reports of long
+    videos stay small and fast.
+
+    Figures are built as matplotlib Figure objects without pyplot, so no GUI backend or global
+    figure state is involved. submit_visualize_data renders a report in a background worker
+    process, several reports then render in parallel while the pipeline goes on.
     """
 
+    def __init__(
+        self, instrumentation=None, max_timeline_points=2000, max_workers=None
+    ) -> None:
+        """
+        Initializes the DataVisualizer.
+
+        Args:
+            instrumentation (Instrumentation, optional): Records stage metrics. Defaults to the shared instance.
+            max_timeline_points (int, optional): Number of frames above which timelines are
+                aggregated instead of drawn point by point. Defaults to 2000.
+            max_workers (int, optional): Number of processes rendering submitted reports.
+                Defaults to the number of CPUs.
+        """
+        self.instrumentation = instrumentation or Instrumentation.get_default()
+        self.max_timeline_points = max_timeline_points
+        self.max_workers = max_workers
+        self.executor = None
+        self.futures = []
+
     def log(self, message):
         """
         Logs a message with the class name.
@@ -17,6 +49,52 @@ class DataVisualizer:
         """
         print(f"{self.__class__.__name__}: {message}")
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown()
+
+    def submit_visualize_data(self, **arguments):
+        """
+        Renders a report in a background worker process, see visualize_data for the arguments.
+
+        Returns:
+            concurrent.futures.Future: Resolves to the metrics of the report.
+        """
+        if self.executor is None:
+            self.executor = concurrent.futures.ProcessPoolExecutor(self.max_workers)
+
+        future = self.executor.submit(
+            _visualize_data, self.instrumentation, self.max_timeline_points, arguments
+        )
+        self.futures.append(future)
+        return future
+
+    def wait(self):
+        """
+        Waits for the submitted reports, raising the first rendering error.
+
+        Returns:
+            list: The metrics of each submitted report, in submission order.
+        """
+        with self.instrumentation.span(
+            "DataVisualizer.wait", reports=len(self.futures)
+        ):
+            futures, self.futures = self.futures, []
+            return [future.result() for future in futures]
+
+    def shutdown(self):
+        """
+        Waits for the submitted reports and stops the workers.
+        """
+        try:
+            self.wait()
+        finally:
+            if self.executor is not None:
+                self.executor.shutdown()
+                self.executor = None
+
     def visualize_data(
         self,
         detected_attack_indexes: list,
@@ -25,6 +103,8 @@ class DataVisualizer:
         threshold_list: list = [],
         output_dir: str = "./",
         output_file_name: str = "all_plots.pdf",
+        score_threshold: float = None,
+        warmup_frames: int = None,
     ):
         """
         Visualizes the attack detection results, including distribution plots, timeline plots, and metrics.
@@ -33,195 +113,260 @@ class DataVisualizer:
             detected_attack_indexes (list): List of indexes where attacks were detected.
             actual_attack_indexes (list): List of indexes where attacks actually occurred.
             length_of_all_indexes (int): Total number of frames/images.
-            threshold_list (list, optional): List of threshold values. Defaults to an empty list.
+            threshold_list (list, optional): Anomaly score of each frame, a list or a numpy array,
+                NaN for unscored frames. Defaults to an empty list.
             output_dir (str, optional): Directory to save the output PDF. Defaults to the current directory.
             output_file_name (str, optional): Name of the output PDF file. Defaults to "all_plots.pdf".
+            score_threshold (float, optional): Score threshold drawn over the scores. Defaults to None.
+            warmup_frames (int, optional): Number of leading frames the detector never flags while
+                it warms up, marked on the scores. Defaults to None.
+
+        Returns:
+            dict: The metrics of DetectionReport.compute_metrics.
         """
-        with PdfPages(output_dir + output_file_name) as pdf:
-            # Distribution plot
-            plt.figure(figsize=(12, 6))
-            plt.bar(
-                [
-                    "Actual\n Attack Frames",
-                    "Detected\n Attack Frames",
-                    "Undetected\n Attack Frames",
-                    "Non-Attacked Frames\n by Detection",
-                    "Non-Attacked Frames\n by Actual",
-                ],
-                [
-                    len(actual_attack_indexes),
-                    len(detected_attack_indexes),
-                    len(set(actual_attack_indexes) - set(detected_attack_indexes)),
-                    length_of_all_indexes - len(detected_attack_indexes),
-                    length_of_all_indexes - len(actual_attack_indexes),
-                ],
-                color=["blue", "red", "yellow", "green", "grey"],
-            )
-            for index, value in enumerate(
-                [
-                    len(actual_attack_indexes),
-                    len(detected_attack_indexes),
-                    len(set(actual_attack_indexes) - set(detected_attack_indexes)),
-                    length_of_all_indexes - len(detected_attack_indexes),
-                    length_of_all_indexes - len(actual_attack_indexes),
-                ]
-            ):
-                plt.text(index, value, str(value), ha="center")
-            plt.title("Distribution of Attack Detection Results")
-            plt.xlabel("Frames")
-            plt.ylabel("Count")
-            pdf.savefig()
-            plt.close()
-
-            # Timeline plot
-            plt.figure(figsize=(12, 6))
-            plt.scatter(
-                detected_attack_indexes,
-                [1] * len(detected_attack_indexes),
-                color="red",
-                label="Detected Attacks",
-                marker="x",
-            )
-            plt.scatter(
-                [
-                    i
-                    for i in range(length_of_all_indexes)
-                    if i not in detected_attack_indexes
-                ],
-                [0] * (length_of_all_indexes - len(detected_attack_indexes)),
-                color="green",
-                label="Non-Attacked Frames",
-                marker="o",
-            )
-            plt.title("Timeline of Detected Attacks")
-            plt.xlabel("Frame Index")
-            plt.yticks([0, 1], ["Detected\nNon-Attacked", "Detected Attacked"])
-            plt.legend()
-            pdf.savefig()
-            plt.close()
-
-            # Calculate metrics
-            true_positives = len(
-                set(detected_attack_indexes).intersection(set(actual_attack_indexes))
-            )
-            false_positives = len(
-                set(detected_attack_indexes) - set(actual_attack_indexes)
-            )
-            false_negatives = len(
-                set(actual_attack_indexes) - set(detected_attack_indexes)
-            )
+        with self.instrumentation.span(
+            "DataVisualizer.visualize_data", output_file_name=output_file_name
+        ) as span, PdfPages(output_dir + output_file_name) as pdf:
+            span.add(frames=length_of_all_indexes)
 
-            cm = confusion_matrix(
-                [
-                    -1 if i in actual_attack_indexes else 1
-                    for i in range(length_of_all_indexes)
-                ],
-                [
-                    -1 if i in detected_attack_indexes else 1
-                    for i in range(length_of_all_indexes)
-                ],
-                labels=[1, -1],
+            report = DetectionReport(
+                detected_attack_indexes, actual_attack_indexes, length_of_all_indexes
             )
+            metrics = report.metrics
+            self.log(f"Accuracy: {metrics['accuracy']:.2f}%")
 
-            accuracy = (cm[0][0] + cm[1][1]) / cm.sum() * 100
+            pdf.savefig(self._plot_distribution(metrics))
+            pdf.savefig(self._plot_detection_timeline(report))
+            pdf.savefig(self._plot_actual_vs_detected(report))
+            if len(threshold_list) > 0:
+                pdf.savefig(
+                    self._plot_anomaly_scores(
+                        report, threshold_list, score_threshold, warmup_frames
+                    )
+                )
+            pdf.savefig(self._plot_confusion_matrix(metrics))
 
-            self.log(f"Accuracy: {accuracy:.2f}%")
+        return metrics
 
-            # Actual vs detected attack plot with metrics
-            plt.figure(figsize=(12, 6))
-            plt.scatter(
-                actual_attack_indexes,
-                [1] * len(actual_attack_indexes),
-                color="blue",
-                label="Actual Attacks",
-                marker="x",
-            )
-            plt.scatter(
-                detected_attack_indexes,
-                [1] * len(detected_attack_indexes),
-                color="red",
-                label="Detected Attacks",
-                marker="o",
-                alpha=0.5,
-            )
-            plt.title("Actual vs Detected Attacks")
-            plt.xlabel("Frame Index")
-            plt.yticks([1], ["Actual Attack vs Detected Attack"])
-            plt.legend()
-
-            # Display metrics on the plot
-            plt.text(
-                0.02,
-                0.92,
-                f"Actual attacked frames: {len(actual_attack_indexes)}",
-                transform=plt.gca().transAxes,
-            )
-            plt.text(
-                0.02,
-                0.88,
-                f"Accurate detected frames: {true_positives}",
-                transform=plt.gca().transAxes,
-            )
-            plt.text(
-                0.02,
-                0.84,
-                f"False detected frames: {false_positives}",
-                transform=plt.gca().transAxes,
-            )
-            plt.text(
-                0.02,
-                0.80,
-                f"Undetected frames: {false_negatives}",
-                transform=plt.gca().transAxes,
-            )
-            plt.text(
-                0.02, 0.76, f"Accuracy: {accuracy:.2f}%", transform=plt.gca().transAxes
-            )
+    def _plot_distribution(self, metrics):
+        """
+        Draws the counts of actual, detected and undetected attacked frames.
+        """
+        figure = Figure(figsize=(12, 6))
+        ax = figure.subplots()
+        counts = [
+            metrics["actual_attacks"],
+            metrics["detected_attacks"],
+            metrics["false_negatives"],
+            metrics["frames"] - metrics["detected_attacks"],
+            metrics["frames"] - metrics["actual_attacks"],
+        ]
+        ax.bar(
+            [
+                "Actual\n Attack Frames",
+                "Detected\n Attack Frames",
+                "Undetected\n Attack Frames",
+                "Non-Attacked Frames\n by Detection",
+                "Non-Attacked Frames\n by Actual",
+            ],
+            counts,
+            color=["blue", "red", "yellow", "green", "grey"],
+        )
+        for index, value in enumerate(counts):
+            ax.text(index, value, str(value), ha="center")
+        ax.set_title("Distribution of Attack Detection Results")
+        ax.set_xlabel("Frames")
+        ax.set_ylabel("Count")
+        return figure
 
-            pdf.savefig()
-            plt.close()
+    def _plot_detection_timeline(self, report):
+        """
+        Draws the detected and non-attacked frames along the video.
+        """
+        figure = Figure(figsize=(12, 6))
+        ax = figure.subplots()
+        self._plot_timeline(
+            ax,
+            report.detected_mask,
+            1,
+            color="red",
+            label="Detected Attacks",
+            marker="x",
+        )
+        self._plot_timeline(
+            ax,
+            ~report.detected_mask,
+            0,
+            color="green",
+            label="Non-Attacked Frames",
+            marker="o",
+        )
+        ax.set_title("Timeline of Detected Attacks")
+        ax.set_xlabel("Frame Index")
+        ax.set_yticks([0, 1], ["Detected\nNon-Attacked", "Detected Attacked"])
+        ax.legend(loc="center right")
+        return figure
 
-            # Threshold values plot
-            if threshold_list:
-                plt.figure(figsize=(12, 6))
-                plt.plot(threshold_list)
+    def _plot_actual_vs_detected(self, report):
+        """
+        Draws the actual and detected attacked frames along the video, with the metrics.
+        """
+        metrics = report.metrics
+        figure = Figure(figsize=(12, 6))
+        ax = figure.subplots()
+        self._plot_timeline(
+            ax,
+            report.actual_mask,
+            1,
+            color="blue",
+            label="Actual Attacks",
+            marker="x",
+        )
+        self._plot_timeline(
+            ax,
+            report.detected_mask,
+            1,
+            color="red",
+            label="Detected Attacks",
+            marker="o",
+            alpha=0.5,
+        )
+        ax.set_title("Actual vs Detected Attacks")
+        ax.set_xlabel("Frame Index")
+        ax.set_yticks([1], ["Actual Attack vs Detected Attack"])
+        ax.legend(loc="upper right")
 
-                false_detect = plt.plot([], [], "ro", label="False Detection")[0]
-                accurate_detect = plt.plot([], [], "go", label="Accurate Detection")[0]
-                undetected = plt.plot([], [], "yo", label="Undetected")[0]
+        # Display metrics on the plot
+        for position, text in enumerate(
+            [
+                f"Actual attacked frames: {metrics['actual_attacks']}",
+                f"Accurate detected frames: {metrics['true_positives']}",
+                f"False detected frames: {metrics['false_positives']}",
+                f"Undetected frames: {metrics['false_negatives']}",
+                f"Accuracy: {metrics['accuracy']:.2f}%",
+            ]
+        ):
+            ax.text(0.02, 0.92 - 0.04 * position, text, transform=ax.transAxes)
+        return figure
 
-                for i in range(len(threshold_list)):
-                    if i in detected_attack_indexes:
-                        if i not in actual_attack_indexes:
-                            plt.plot(i, threshold_list[i], "ro")
-                        else:
-                            plt.plot(i, threshold_list[i], "go")
-                    if i not in detected_attack_indexes and i in actual_attack_indexes:
-                        plt.plot(i, threshold_list[i], "yo")
+    def _plot_anomaly_scores(
+        self, report, threshold_list, score_threshold, warmup_frames=None
+    ):
+        """
+        Draws the anomaly scores, highlighting the falsely detected, accurately detected and
+        undetected frames, and the end of the warm-up of the detector.
+        """
+        scores = np.asarray(threshold_list, dtype=np.float64)
+        scored_detected = report.detected_mask[: len(scores)]
+        scored_actual = report.actual_mask[: len(scores)]
 
-                plt.title("Threshold Values")
-                plt.xlabel("Image Index")
-                plt.ylabel("Threshold")
+        figure = Figure(figsize=(12, 6))
+        ax = figure.subplots()
+        self._plot_scores(ax, scores)
+        if score_threshold is not None:
+            ax.axhline(score_threshold, color="grey", linestyle="--")
 
-                plt.axvline(20, color="green")
+        rasterized = len(scores) > self.max_timeline_points
+        for mask, color, label in (
+            (scored_detected & ~scored_actual, "red", "False Detection"),
+            (scored_detected & scored_actual, "green", "Accurate Detection"),
+            (~scored_detected & scored_actual, "yellow", "Undetected"),
+        ):
+            indexes = np.flatnonzero(mask)
+            ax.scatter(
+                indexes,
+                scores[indexes],
+                color=color,
+                label=label,
+                zorder=3,
+                rasterized=rasterized,
+            )
 
-                plt.legend(
-                    handles=[false_detect, accurate_detect, undetected],
-                    loc="upper left",
-                )
+        ax.set_title("Anomaly Scores")
+        ax.set_xlabel("Image Index")
+        ax.set_ylabel("Score")
 
-                pdf.savefig()
-                plt.close()
+        if warmup_frames is not None:
+            ax.axvline(warmup_frames, color="green", label="End of Warm-up")
 
-            # Confusion matrix plot
-            plt.figure(figsize=(12, 6))
-            disp_cm = ConfusionMatrixDisplay(
-                cm, display_labels=["Non-Attacked", "Attacked"]
+        ax.legend(loc="upper left")
+        return figure
+
+    def _plot_confusion_matrix(self, metrics):
+        """
+        Draws the confusion matrix of the detections.
+        """
+        figure = Figure(figsize=(12, 6))
+        ax = figure.subplots()
+        disp_cm = ConfusionMatrixDisplay(
+            metrics["confusion_matrix"],
+            display_labels=["Non-Attacked", "Attacked"],
+        )
+        disp_cm.plot(ax=ax)
+        ax.set_title("Confusion Matrix")
+        ax.grid(False)
+        figure.tight_layout()
+        return figure
+
+    def _plot_timeline(self, ax, mask, y, color, label, marker, alpha=1.0):
+        """
+        Draws the frames of a mask on a timeline row, one marker per frame for short timelines
+        and one band per run of bins holding any frame of the mask for long ones.
+        """
+        if len(mask) <= self.max_timeline_points:
+            indexes = np.flatnonzero(mask)
+            ax.scatter(
+                indexes,
+                np.full(len(indexes), y),
+                color=color,
+                label=label,
+                marker=marker,
+                alpha=alpha,
             )
-            disp_cm.plot()
-            plt.title("Confusion Matrix")
-            plt.grid(False)
-            plt.tight_layout()
+            return
 
-            pdf.savefig()
-            plt.close()
+        # Runs are merged per bin of frames, so at most max_timeline_points bands are drawn
+        bin_size = -(-len(mask) // self.max_timeline_points)
+        padded = np.zeros(bin_size * self.max_timeline_points, dtype=bool)
+        padded[: len(mask)] = mask
+        intervals = DetectionReport.get_intervals(
+            padded.reshape(-1, bin_size).any(axis=1)
+        )
+        intervals = np.minimum(intervals * bin_size, len(mask))
+        ax.broken_barh(
+            np.column_stack((intervals[:, 0], intervals[:, 1] - intervals[:, 0])),
+            (y - 0.1, 0.2),
+            facecolors=color,
+            label=label,
+            alpha=alpha,
+        )
+
+    def _plot_scores(self, ax, scores):
+        """
+        Draws the score line, or for long timelines the band between the minimum and maximum
+        score of each bin of frames, so isolated peaks are kept.
+        """
+        if len(scores) <= self.max_timeline_points:
+            ax.plot(scores)
+            return
+
+        bin_size = -(-len(scores) // self.max_timeline_points)
+        padded = np.full(bin_size * self.max_timeline_points, np.nan)
+        padded[: len(scores)] = scores
+        bins = padded.reshape(self.max_timeline_points, bin_size)
+
+        # Bins holding only unscored frames stay empty, fmin and fmax skip NaN values
+        minimums = np.fmin.reduce(bins, axis=1)
+        maximums = np.fmax.reduce(bins, axis=1)
+        starts = np.arange(self.max_timeline_points) * bin_size
+        ax.fill_between(starts, minimums, maximums, step="post", linewidth=0.5)
+
+
+def _visualize_data(instrumentation, max_timeline_points, arguments):
+    """
+    Renders a report in a worker process with a visualizer of its own.
+    """
+    data_visualizer = DataVisualizer(
+        instrumentation=instrumentation, max_timeline_points=max_timeline_points
+    )
+    return data_visualizer.visualize_data(**arguments)
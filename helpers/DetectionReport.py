@@ -0,0 +1,216 @@
+import csv
+import json
+import os
+import numpy as np
+
+
+class DetectionReport:
+    """
+    A class to summarize the detections of a video as metrics and run-length attack intervals.
+
+    It only needs numpy, so batch jobs can write a JSON or CSV report of every video without
+    importing matplotlib. Intervals are [start, end) frame ranges of consecutive frames.
+    """
+
+    INTERVAL_KINDS = ("actual", "detected", "false_positives", "false_negatives")
+
+    def __init__(
+        self, detected_attack_indexes, actual_attack_indexes, frame_count, scores=None
+    ) -> None:
+        """
+        Initializes the DetectionReport.
+
+        Args:
+            detected_attack_indexes (list): Indexes of the frames detected as attacked.
+            actual_attack_indexes (list): Indexes of the frames actually attacked.
+            frame_count (int): Total number of frames, indexes out of range are ignored.
+            scores (np.ndarray, optional): Anomaly score of each frame. Defaults to None.
+        """
+        self.frame_count = frame_count
+        self.detected_mask = self.get_mask(detected_attack_indexes, frame_count)
+        self.actual_mask = self.get_mask(actual_attack_indexes, frame_count)
+        self.scores = None if scores is None else np.asarray(scores, dtype=np.float64)
+        self.metrics = self.compute_metrics(self.detected_mask, self.actual_mask)
+
+    def log(self, message):
+        """
+        Logs a message with the class name.
+
+        Args:
+            message (str): The message to log.
+        """
+        print(f"{self.__class__.__name__}: {message}")
+
+    @staticmethod
+    def get_mask(indexes, length):
+        """
+        Turns frame indexes into a boolean mask over the frames, indexes out of range are ignored.
+
+        Args:
+            indexes (list): Frame indexes.
+            length (int): Total number of frames.
+
+        Returns:
+            np.ndarray: Whether each frame is in indexes.
+        """
+        indexes = np.asarray(indexes, dtype=np.int64).ravel()
+        mask = np.zeros(length, dtype=bool)
+        mask[indexes[(indexes >= 0) & (indexes < length)]] = True
+        return mask
+
+    @staticmethod
+    def get_intervals(mask):
+        """
+        Run-length encodes a boolean mask.
+
+        Args:
+            mask (np.ndarray): Boolean mask over the frames.
+
+        Returns:
+            np.ndarray: (start, end) rows of the runs of True values, end excluded.
+        """
+        edges = np.flatnonzero(np.diff(np.concatenate(([0], mask.view(np.int8), [0]))))
+        return edges.reshape(-1, 2)
+
+    @staticmethod
+    def compute_metrics(detected_mask, actual_mask):
+        """
+        Computes the detection metrics from boolean masks.
+
+        Args:
+            detected_mask (np.ndarray): Whether each frame was detected as attacked.
+            actual_mask (np.ndarray): Whether each frame was actually attacked.
+
+        Returns:
+            dict: Counts of frames, the confusion matrix with rows of actual non-attacked and
+                  attacked frames, and the accuracy in percent.
+        """
+        true_positives = int(np.count_nonzero(detected_mask & actual_mask))
+        false_positives = int(np.count_nonzero(detected_mask & ~actual_mask))
+        false_negatives = int(np.count_nonzero(~detected_mask & actual_mask))
+        frames = len(detected_mask)
+        true_negatives = frames - true_positives - false_positives - false_negatives
+
+        return {
+            "frames": frames,
+            "actual_attacks": true_positives + false_negatives,
+            "detected_attacks": true_positives + false_positives,
+            "true_positives": true_positives,
+            "false_positives": false_positives,
+            "false_negatives": false_negatives,
+            "true_negatives": true_negatives,
+            "confusion_matrix": np.array(
+                [[true_negatives, false_positives], [false_negatives, true_positives]]
+            ),
+            "accuracy": (
+                (true_positives + true_negatives) / frames * 100 if frames else 0.0
+            ),
+        }
+
+    def get_attack_intervals(self):
+        """
+        Run-length encodes the actual, detected, falsely detected and undetected frames.
+
+        Returns:
+            dict: Kind to (start, end) array of the intervals of that kind.
+        """
+        masks = {
+            "actual": self.actual_mask,
+            "detected": self.detected_mask,
+            "false_positives": self.detected_mask & ~self.actual_mask,
+            "false_negatives": ~self.detected_mask & self.actual_mask,
+        }
+        return {kind: self.get_intervals(masks[kind]) for kind in self.INTERVAL_KINDS}
+
+    def to_dict(self):
+        """
+        Returns the report as JSON serializable data.
+
+        Returns:
+            dict: The metrics, the intervals and, when given, summary statistics of the scores.
+        """
+        metrics = dict(self.metrics)
+        metrics["confusion_matrix"] = metrics["confusion_matrix"].tolist()
+        report = {
+            "metrics": metrics,
+            "intervals": {
+                kind: intervals.tolist()
+                for kind, intervals in self.get_attack_intervals().items()
+            },
+        }
+
+        if self.scores is not None:
+            scored = self.scores[~np.isnan(self.scores)]
+            report["scores"] = {
+                "count": int(len(scored)),
+                "min": float(scored.min()) if len(scored) else None,
+                "max": float(scored.max()) if len(scored) else None,
+                "mean": float(scored.mean()) if len(scored) else None,
+            }
+        return report
+
+    def write_json(self, path, **attributes):
+        """
+        Writes the metrics and intervals to a JSON file.
+
+        Args:
+            path (str): Path of the JSON file.
+            **attributes: Additional JSON serializable fields, e.g. the video path.
+
+        Returns:
+            str: The path of the file.
+        """
+        self._make_parent_dir(path)
+        with open(path, "w") as file:
+            json.dump({**attributes, **self.to_dict()}, file, indent=2)
+        return path
+
+    def write_csv(self, path, append=False, **attributes):
+        """
+        Writes the metrics as a CSV row, so the reports of many videos can share one file.
+
+        Args:
+            path (str): Path of the CSV file.
+            append (bool, optional): Append a row to an existing file, the header is only written
+                to a new file. Defaults to False.
+            **attributes: Additional columns written first, e.g. the video path.
+
+        Returns:
+            str: The path of the file.
+        """
+        row = {**attributes, **self.metrics}
+        del row["confusion_matrix"]
+
+        self._make_parent_dir(path)
+        write_header = not (append and os.path.exists(path))
+        with open(path, "a" if append else "w", newline="") as file:
+            writer = csv.DictWriter(file, fieldnames=list(row))
+            if write_header:
+                writer.writeheader()
+            writer.writerow(row)
+        return path
+
+    def write_intervals_csv(self, path):
+        """
+        Writes the intervals as kind,start,end CSV rows, end excluded.
+
+        Args:
+            path (str): Path of the CSV file.
+
+        Returns:
+            str: The path of the file.
+        """
+        self._make_parent_dir(path)
+        with open(path, "w", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(["kind", "start", "end"])
+            for kind, intervals in self.get_attack_intervals().items():
+                writer.writerows(
+                    [kind, int(start), int(end)] for start, end in intervals
+                )
+        return path
+
+    def _make_parent_dir(self, path):
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
@@ -0,0 +1,83 @@
+import numpy as np
+
+
+class DetectionResults:
+    """
+    A class to collect per-frame detection results from parallel workers in frame order.
+
+    Results are stored in preallocated arrays indexed by frame, each worker only writes the slots
+    of its own frames so no lock is needed and the order never depends on completion order.
+    """
+
+    def __init__(self, frame_count=0) -> None:
+        """
+        Initializes the DetectionResults for a known number of frames.
+
+        Args:
+            frame_count (int, optional): Number of frames. Defaults to 0, the arrays then grow
+                with record_chunk.
+        """
+        self.verdicts = np.zeros(frame_count, dtype=bool)
+        self.scores = np.full(frame_count, np.nan)
+        self.paths = np.full(frame_count, None, dtype=object)
+
+    def __len__(self):
+        return len(self.verdicts)
+
+    def record(self, index, attacked, score=np.nan, path=None):
+        """
+        Records the result of a single frame, safe to call from worker threads.
+
+        Args:
+            index (int): Index of the frame.
+            attacked (bool): Whether an attack was detected.
+            score (float, optional): Detection score of the frame. Defaults to NaN.
+            path (str, optional): Path of the generated detection image. Defaults to None.
+        """
+        self.verdicts[index] = attacked
+        self.scores[index] = score
+        self.paths[index] = path
+
+    def record_chunk(self, indexes, verdicts, scores=None):
+        """
+        Records the results of a chunk of frames, growing the arrays when needed.
+
+        Growing replaces the arrays, so this must be called from a single thread.
+
+        Args:
+            indexes (np.ndarray): Indexes of the frames.
+            verdicts (np.ndarray): Whether an attack was detected, per frame.
+            scores (np.ndarray, optional): Detection scores, per frame. Defaults to None.
+        """
+        indexes = np.asarray(indexes)
+        if len(indexes) and indexes.max() >= len(self):
+            self._grow(int(indexes.max()) + 1)
+
+        self.verdicts[indexes] = verdicts
+        if scores is not None:
+            self.scores[indexes] = scores
+
+    @property
+    def attacked_indexes(self):
+        """
+        list: Indexes of the frames where an attack was detected, in increasing order.
+        """
+        return np.flatnonzero(self.verdicts).tolist()
+
+    def get_paths(self):
+        """
+        Returns the recorded image paths in frame order.
+
+        Returns:
+            list: The path of each frame.
+        """
+        return self.paths.tolist()
+
+    def _grow(self, frame_count):
+        """
+        Extends the result arrays to hold frame_count frames.
+        """
+        extra = frame_count - len(self)
+        self.verdicts = np.concatenate([self.verdicts, np.zeros(extra, dtype=bool)])
+        self.scores = np.concatenate([self.scores, np.full(extra, np.nan)])
+        self.paths = np.concatenate([self.paths, np.full(extra, None, dtype=object)])
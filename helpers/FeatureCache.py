@@ -0,0 +1,225 @@
+import contextlib
+import hashlib
+import json
+import os
+import time
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    # Without fcntl, e.g. on Windows, the index is not locked across processes
+    fcntl = None
+
+
+class FeatureCache:
+    """
+    A class to persist extracted frame features on disk, keyed by video content and extractor config.
+
+    Row i of a cached feature matrix holds the features of frame i. Features are stored as .npy
+    files and loaded memory-mapped, a small JSON index tracks their size and last access so the
+    least recently used entries are evicted once the cache grows past its size limit.
+    Updates of the index hold an exclusive lock on a lock file, so processes sharing a cache,
+    e.g. batch workers, do not drop each other's entries.
+    """
+
+    def __init__(self, cache_dir=".feature_cache", max_size_bytes=1 << 30) -> None:
+        """
+        Initializes the FeatureCache.
+
+        Args:
+            cache_dir (str, optional): Directory holding the cached features. Defaults to ".feature_cache".
+            max_size_bytes (int, optional): Maximum total size of the cached features. Defaults to 1 GiB.
+        """
+        self.cache_dir = cache_dir
+        self.max_size_bytes = max_size_bytes
+        self.index_path = os.path.join(cache_dir, "index.json")
+        self.lock_path = os.path.join(cache_dir, "index.lock")
+        self.video_hashes = {}
+
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def log(self, message):
+        """
+        Logs a message with the class name.
+
+        Args:
+            message (str): The message to log.
+        """
+        print(f"{self.__class__.__name__}: {message}")
+
+    def hash_video(self, video_filepath):
+        """
+        Hashes the content of a video file, the hash is remembered while the file is unchanged.
+
+        Args:
+            video_filepath (str): Path to the video file.
+
+        Returns:
+            str: The SHA-256 hex digest of the file.
+        """
+        stat = os.stat(video_filepath)
+        signature = (os.path.abspath(video_filepath), stat.st_size, stat.st_mtime_ns)
+        if signature not in self.video_hashes:
+            digest = hashlib.sha256()
+            with open(video_filepath, "rb") as file:
+                for block in iter(lambda: file.read(1 << 20), b""):
+                    digest.update(block)
+            self.video_hashes[signature] = digest.hexdigest()
+
+        return self.video_hashes[signature]
+
+    def get_key(self, video_filepath, feature_extractor):
+        """
+        Builds the cache key of the features of a video.
+
+        Args:
+            video_filepath (str): Path to the video file.
+            feature_extractor (FeatureExtractor): The extractor the features come from.
+
+        Returns:
+            str: The cache key.
+        """
+        config = json.dumps(feature_extractor.get_config(), sort_keys=True)
+        key_source = f"{self.hash_video(video_filepath)}:{config}"
+        return hashlib.sha256(key_source.encode()).hexdigest()
+
+    def load(self, video_filepath, feature_extractor):
+        """
+        Loads the cached features of a video.
+
+        Args:
+            video_filepath (str): Path to the video file.
+            feature_extractor (FeatureExtractor): The extractor the features come from.
+
+        Returns:
+            np.ndarray: The read-only memory-mapped (N, D) features, or None on a cache miss.
+        """
+        key = self.get_key(video_filepath, feature_extractor)
+        features_path = self._get_features_path(key)
+        with self._lock_index():
+            index = self._read_index()
+            if key not in index:
+                return None
+
+            # Mapped while the lock keeps other processes from evicting the file, the mapping
+            # stays valid after the file is removed
+            try:
+                features = np.load(features_path, mmap_mode="r")
+            except OSError:
+                return None
+
+            index[key]["last_access"] = time.time()
+            self._write_index(index)
+
+        self.log(f"Loaded cached features of {video_filepath}")
+        return features
+
+    def save(self, video_filepath, feature_extractor, features):
+        """
+        Stores the features of a video, evicting least recently used entries when needed.
+
+        Args:
+            video_filepath (str): Path to the video file.
+            feature_extractor (FeatureExtractor): The extractor the features come from.
+            features (np.ndarray): The (N, D) features, row i being frame i.
+
+        Returns:
+            str: The cache key.
+        """
+        key = self.get_key(video_filepath, feature_extractor)
+        features_path = self._get_features_path(key)
+
+        # Write to a temporary file first so readers never see a partial entry
+        temporary_path = f"{features_path}.{os.getpid()}.tmp"
+        with open(temporary_path, "wb") as file:
+            np.save(file, np.asarray(features))
+        os.replace(temporary_path, features_path)
+
+        with self._lock_index():
+            index = self._read_index()
+            index[key] = {
+                "video_filepath": video_filepath,
+                "video_hash": self.hash_video(video_filepath),
+                "extractor": feature_extractor.get_config(),
+                "frame_count": int(len(features)),
+                "size_bytes": os.path.getsize(features_path),
+                "last_access": time.time(),
+            }
+            self._evict(index, keep_key=key)
+            self._write_index(index)
+
+        return key
+
+    def clear(self):
+        """
+        Removes every cached entry.
+        """
+        with self._lock_index():
+            index = self._read_index()
+            for key in list(index):
+                self._remove(index, key)
+            self._write_index(index)
+
+    def _evict(self, index, keep_key=None):
+        """
+        Removes least recently used entries until the cache fits in max_size_bytes.
+
+        Args:
+            index (dict): The cache index, updated in place.
+            keep_key (str, optional): A key that is never evicted. Defaults to None.
+        """
+        total_size = sum(entry["size_bytes"] for entry in index.values())
+        for key in sorted(index, key=lambda key: index[key]["last_access"]):
+            if total_size <= self.max_size_bytes:
+                break
+            if key == keep_key:
+                continue
+
+            total_size -= index[key]["size_bytes"]
+            self._remove(index, key)
+            self.log(f"Evicted cached features {key[:12]}")
+
+    def _remove(self, index, key):
+        """
+        Deletes the features of an entry and drops it from the index.
+        """
+        try:
+            os.remove(self._get_features_path(key))
+        except FileNotFoundError:
+            pass
+        index.pop(key, None)
+
+    @contextlib.contextmanager
+    def _lock_index(self):
+        """
+        Holds an exclusive lock on the index across processes while it is read and written back.
+        """
+        with open(self.lock_path, "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _get_features_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.npy")
+
+    def _read_index(self):
+        if not os.path.exists(self.index_path):
+            return {}
+        try:
+            with open(self.index_path) as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            self.log("Unreadable cache index, starting a new one")
+            return {}
+
+    def _write_index(self, index):
+        temporary_path = f"{self.index_path}.{os.getpid()}.tmp"
+        with open(temporary_path, "w") as file:
+            json.dump(index, file, indent=2)
+        os.replace(temporary_path, self.index_path)
@@ -0,0 +1,255 @@
+import cv2
+import numpy as np
+
+
+class FeatureExtractor:
+    """
+    A base class to turn frames into compact feature vectors for attack detection.
+
+    Subclasses implement extract_batch, which maps a (N, H, W, C) uint8 frame stack to a
+    (N, D) float32 feature matrix.
+    """
+
+    def log(self, message):
+        """
+        Logs a message with the class name.
+
+        Args:
+            message (str): The message to log.
+        """
+        print(f"{self.__class__.__name__}: {message}")
+
+    def get_config(self):
+        """
+        Returns the configuration of the extractor, used to tell apart features of different extractors.
+
+        Returns:
+            dict: The name of the extractor and its parameters.
+        """
+        return {"name": self.__class__.__name__}
+
+    def extract(self, frame):
+        """
+        Extracts the feature vector of a single frame.
+
+        Args:
+            frame (np.ndarray): The frame.
+
+        Returns:
+            np.ndarray: The feature vector.
+        """
+        return self.extract_batch(np.asarray(frame)[np.newaxis])[0]
+
+    def extract_batch(self, frames):
+        """
+        Extracts the feature vectors of a stack of frames.
+
+        Args:
+            frames (np.ndarray): The frames as a (N, H, W, C) uint8 array.
+
+        Returns:
+            np.ndarray: The feature vectors as a (N, D) float32 array.
+        """
+        raise NotImplementedError
+
+    def _to_grayscale(self, frame):
+        """
+        Converts a BGR frame to grayscale, grayscale frames are returned as is.
+        """
+        if frame.ndim == 3 and frame.shape[2] == 3:
+            return cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        return frame.reshape(frame.shape[:2])
+
+
+class RawPixelFeatureExtractor(FeatureExtractor):
+    """
+    Uses every raw pixel value as a feature, as the detector originally did.
+    """
+
+    def extract_batch(self, frames):
+        frames = np.asarray(frames)
+        return frames.reshape(len(frames), -1).astype(np.float32)
+
+
+class ThumbnailFeatureExtractor(FeatureExtractor):
+    """
+    Uses a small grayscale thumbnail of the frame as features.
+    """
+
+    def __init__(self, size=(16, 9)):
+        """
+        Args:
+            size (tuple, optional): Size (width, height) of the thumbnail. Defaults to (16, 9).
+        """
+        self.size = tuple(size)
+
+    def get_config(self):
+        return {"name": self.__class__.__name__, "size": list(self.size)}
+
+    def extract_batch(self, frames):
+        thumbnails = [
+            cv2.resize(
+                self._to_grayscale(frame), self.size, interpolation=cv2.INTER_AREA
+            )
+            for frame in frames
+        ]
+        thumbnails = np.stack(thumbnails).astype(np.float32) / 255
+        return thumbnails.reshape(len(thumbnails), -1)
+
+
+class HighFrequencyResidualFeatureExtractor(FeatureExtractor):
+    """
+    Measures the energy of the high frequency residual left after a small blur, per channel.
+
+    Sign noise perturbations barely change the blurred frame but add directly to the residual.
+    """
+
+    def __init__(self, kernel_size=3):
+        """
+        Args:
+            kernel_size (int, optional): Size of the box blur kernel. Defaults to 3.
+        """
+        self.kernel_size = kernel_size
+
+    def get_config(self):
+        return {"name": self.__class__.__name__, "kernel_size": self.kernel_size}
+
+    def extract_batch(self, frames):
+        kernel = (self.kernel_size, self.kernel_size)
+        features = []
+        for frame in frames:
+            blurred = cv2.blur(frame, kernel)
+            residual = cv2.subtract(frame, blurred, dtype=cv2.CV_16S)
+
+            # Residual energy E[r^2] = var(r) + mean(r)^2, computed in one pass per channel
+            mean, std = cv2.meanStdDev(residual)
+            energy = std.ravel() ** 2 + mean.ravel() ** 2
+            magnitude = cv2.mean(cv2.absdiff(frame, blurred))[: len(energy)]
+            features.append(np.concatenate([energy, magnitude]))
+        return np.stack(features).astype(np.float32)
+
+
+class LaplacianVarianceFeatureExtractor(FeatureExtractor):
+    """
+    Uses the variance of the Laplacian of each channel, a classic sharpness and noise measure.
+    """
+
+    def extract_batch(self, frames):
+        features = []
+        for frame in frames:
+            laplacian = cv2.Laplacian(frame, cv2.CV_32F)
+            _, std = cv2.meanStdDev(laplacian)
+            features.append(std.ravel() ** 2)
+        return np.stack(features).astype(np.float32)
+
+
+class ChannelNoiseFeatureExtractor(FeatureExtractor):
+    """
+    Uses per-channel intensity statistics and a median filter based noise level estimate.
+    """
+
+    def extract_batch(self, frames):
+        features = []
+        for frame in frames:
+            mean, std = cv2.meanStdDev(frame)
+            noise = cv2.absdiff(frame, cv2.medianBlur(frame, 3))
+            noise_mean, noise_std = cv2.meanStdDev(noise)
+            features.append(
+                np.concatenate(
+                    [mean.ravel(), std.ravel(), noise_mean.ravel(), noise_std.ravel()]
+                )
+            )
+        return np.stack(features).astype(np.float32)
+
+
+class BlockDCTFeatureExtractor(FeatureExtractor):
+    """
+    Uses a histogram of the block DCT AC coefficients of the grayscale frame, as in JPEG.
+
+    Noise perturbations spread energy into the high frequency coefficients that natural
+    frames and compression leave mostly empty.
+    """
+
+    def __init__(self, block_size=8, bins=16, max_log_coefficient=8.0):
+        """
+        Args:
+            block_size (int, optional): Size of the square DCT blocks. Defaults to 8.
+            bins (int, optional): Number of histogram bins. Defaults to 16.
+            max_log_coefficient (float, optional): Upper edge of the histogram of log(1 + |coefficient|). Defaults to 8.0.
+        """
+        self.block_size = block_size
+        self.bins = bins
+        self.max_log_coefficient = max_log_coefficient
+        self.bin_edges = np.linspace(0, max_log_coefficient, bins + 1)
+
+        # Orthonormal DCT-II basis, applied to every block at once with matrix products
+        n = np.arange(block_size)
+        basis = np.cos(
+            np.pi * (2 * n[np.newaxis] + 1) * n[:, np.newaxis] / (2 * block_size)
+        )
+        basis[0] /= np.sqrt(2)
+        self.dct_matrix = (basis * np.sqrt(2 / block_size)).astype(np.float32)
+
+    def get_config(self):
+        return {
+            "name": self.__class__.__name__,
+            "block_size": self.block_size,
+            "bins": self.bins,
+            "max_log_coefficient": self.max_log_coefficient,
+        }
+
+    def extract_batch(self, frames):
+        size = self.block_size
+        features = []
+        for frame in frames:
+            gray = self._to_grayscale(frame)
+            height = gray.shape[0] - gray.shape[0] % size
+            width = gray.shape[1] - gray.shape[1] % size
+            blocks = (
+                gray[:height, :width]
+                .astype(np.float32)
+                .reshape(height // size, size, width // size, size)
+                .transpose(0, 2, 1, 3)
+            )
+            coefficients = self.dct_matrix @ blocks @ self.dct_matrix.T
+
+            # Drop the DC coefficient of every block, keep the AC ones
+            coefficients = coefficients.reshape(-1, size * size)[:, 1:]
+            histogram, _ = np.histogram(np.log1p(np.abs(coefficients)), self.bin_edges)
+            features.append(histogram / max(coefficients.size, 1))
+        return np.stack(features).astype(np.float32)
+
+
+class CompositeFeatureExtractor(FeatureExtractor):
+    """
+    Concatenates the features of several extractors.
+    """
+
+    def __init__(self, extractors=None):
+        """
+        Args:
+            extractors (list, optional): The feature extractors to combine. Defaults to the
+                high frequency residual, Laplacian variance, channel noise, block DCT and
+                thumbnail extractors.
+        """
+        if extractors is None:
+            extractors = [
+                HighFrequencyResidualFeatureExtractor(),
+                LaplacianVarianceFeatureExtractor(),
+                ChannelNoiseFeatureExtractor(),
+                BlockDCTFeatureExtractor(),
+                ThumbnailFeatureExtractor(),
+            ]
+        self.extractors = extractors
+
+    def get_config(self):
+        return {
+            "name": self.__class__.__name__,
+            "extractors": [extractor.get_config() for extractor in self.extractors],
+        }
+
+    def extract_batch(self, frames):
+        frames = np.asarray(frames)
+        return np.hstack(
+            [extractor.extract_batch(frames) for extractor in self.extractors]
+        )
@@ -0,0 +1,151 @@
+import collections
+import threading
+import cv2
+import numpy as np
+
+
+class FrameComparator:
+    """
+    A class to compare the pixel statistics of two frames.
+
+    The statistics of a frame, its value count, sum and sum of squares, come from a single
+    exact integer histogram pass over the uint8 data. Statistics of reference frames can be
+    cached under a key, e.g. the frame index, so they are computed once per video. The cache
+    keeps the most recently used max_cache_entries statistics.
+    """
+
+    # calcHist counts in float32, which is exact up to 2**24 per bin
+    MAX_HISTOGRAM_VALUES = 1 << 24
+
+    def __init__(self, max_cache_entries=4096) -> None:
+        """
+        Initializes the FrameComparator with an empty statistics cache.
+
+        Args:
+            max_cache_entries (int, optional): Number of frame statistics kept in the cache.
+                Defaults to 4096.
+        """
+        self.max_cache_entries = max_cache_entries
+        self.statistics_cache = collections.OrderedDict()
+        self.cache_lock = threading.Lock()
+        self.values = np.arange(256, dtype=np.int64)
+
+    def log(self, message):
+        """
+        Logs a message with the class name.
+
+        Args:
+            message (str): The message to log.
+        """
+        print(f"{self.__class__.__name__}: {message}")
+
+    def compute_statistics(self, frame):
+        """
+        Computes the value count, sum and sum of squares of a uint8 frame in one pass.
+
+        Args:
+            frame (np.ndarray): The frame.
+
+        Returns:
+            tuple: The value count, the sum and the sum of squares, as exact integers.
+        """
+        frame = np.ascontiguousarray(frame, dtype=np.uint8)
+        values = frame.reshape(frame.shape[0], -1)
+
+        # Histogram the rows in slabs small enough for the float32 counts to stay exact
+        rows_per_slab = max(1, self.MAX_HISTOGRAM_VALUES // max(values.shape[1], 1))
+        histogram = np.zeros(256, dtype=np.int64)
+        for start in range(0, values.shape[0], rows_per_slab):
+            slab = values[start : start + rows_per_slab]
+            histogram += (
+                cv2.calcHist([slab], [0], None, [256], [0, 256])
+                .ravel()
+                .astype(np.int64)
+            )
+
+        total = int(histogram @ self.values)
+        total_of_squares = int(histogram @ (self.values * self.values))
+        return int(values.size), total, total_of_squares
+
+    def get_statistics(self, frame, key=None):
+        """
+        Returns the statistics of a frame, from the cache when a key is given.
+
+        Args:
+            frame (np.ndarray or callable): The frame, or a function loading it, only used on a
+                cache miss.
+            key (hashable, optional): Cache key of the frame. Defaults to None, no caching.
+
+        Returns:
+            tuple: The value count, the sum and the sum of squares.
+        """
+        if key is not None:
+            with self.cache_lock:
+                statistics = self.statistics_cache.get(key)
+                if statistics is not None:
+                    self.statistics_cache.move_to_end(key)
+                    return statistics
+
+        statistics = self.compute_statistics(frame() if callable(frame) else frame)
+        if key is not None:
+            with self.cache_lock:
+                self.statistics_cache[key] = statistics
+                while len(self.statistics_cache) > self.max_cache_entries:
+                    self.statistics_cache.popitem(last=False)
+        return statistics
+
+    def get_sum_of_squared_deviations(self, statistics):
+        """
+        Returns the sum of squared differences from the mean, sum((x - mean) ** 2).
+
+        Args:
+            statistics (tuple): The value count, the sum and the sum of squares.
+
+        Returns:
+            float: The sum of squared deviations.
+        """
+        count, total, total_of_squares = statistics
+        if count == 0:
+            return 0.0
+        return float(total_of_squares - total * total / count)
+
+    def compare(self, main_frame, second_frame, main_key=None, second_key=None):
+        """
+        Compares the sum of squared deviations from the mean of two frames.
+
+        Args:
+            main_frame (np.ndarray or callable): The main frame, or a function loading it only
+                when its statistics are not cached.
+            second_frame (np.ndarray): The second frame for comparison.
+            main_key (hashable, optional): Cache key of the main frame. Defaults to None.
+            second_key (hashable, optional): Cache key of the second frame. Defaults to None.
+
+        Returns:
+            float: The difference in the sum of squared differences from the mean of the frames.
+        """
+        main_ssq = self.get_sum_of_squared_deviations(
+            self.get_statistics(main_frame, main_key)
+        )
+        second_ssq = self.get_sum_of_squared_deviations(
+            self.get_statistics(second_frame, second_key)
+        )
+        return round(main_ssq - second_ssq, 14)
+
+    def is_cached(self, key):
+        """
+        Tells whether the statistics of a frame are cached.
+
+        Args:
+            key (hashable): Cache key of the frame.
+
+        Returns:
+            bool: Whether the statistics are cached.
+        """
+        return key in self.statistics_cache
+
+    def clear(self):
+        """
+        Empties the statistics cache, e.g. before moving on to another video.
+        """
+        with self.cache_lock:
+            self.statistics_cache.clear()
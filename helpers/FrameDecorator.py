@@ -0,0 +1,223 @@
+import cv2
+import numpy as np
+
+
+class FrameDecorator:
+    """
+    A class to draw borders and text overlays on frames in place.
+
+    Borders are drawn by assigning the color to the edge slices of the frame, so the frame content
+    is neither copied nor resized, and a whole (N, H, W, C) stack can be decorated at once.
+    """
+
+    ATTACKED_COLOR = (0, 0, 255)
+    CLEAN_COLOR = (0, 255, 0)
+
+    # Weights of the B, G and R channels turning a color into a gray level, as cv2.cvtColor
+    GRAY_WEIGHTS = np.array([0.114, 0.587, 0.299])
+
+    def __init__(
+        self,
+        border_thickness=10,
+        font_scale=0.5,
+        text_color=(255, 255, 255),
+        label_background=(0, 0, 0),
+    ) -> None:
+        """
+        Initializes the FrameDecorator.
+
+        Args:
+            border_thickness (int, optional): Width of the border in pixels. Defaults to 10.
+            font_scale (float, optional): Scale of the overlay text. Defaults to 0.5.
+            text_color (tuple, optional): Color of the overlay text (B, G, R). Defaults to white.
+            label_background (tuple, optional): Color of the box behind the text (B, G, R). Defaults to black.
+        """
+        self.border_thickness = border_thickness
+        self.font_scale = font_scale
+        self.text_color = text_color
+        self.label_background = label_background
+        self.font = cv2.FONT_HERSHEY_SIMPLEX
+
+    def log(self, message):
+        """
+        Logs a message with the class name.
+
+        Args:
+            message (str): The message to log.
+        """
+        print(f"{self.__class__.__name__}: {message}")
+
+    def get_color(self, attacked):
+        """
+        Returns the border color of a frame, red when attacked and green otherwise.
+
+        Args:
+            attacked (bool): Whether the frame is attacked.
+
+        Returns:
+            tuple: Color of the border (B, G, R).
+        """
+        return self.ATTACKED_COLOR if attacked else self.CLEAN_COLOR
+
+    def draw_border(self, frame, color):
+        """
+        Draws a border along the edges of a frame, in place.
+
+        Args:
+            frame (numpy.ndarray): The (H, W, C) or grayscale (H, W) frame, modified in place.
+            color (tuple): Color of the border (B, G, R).
+
+        Returns:
+            numpy.ndarray: The same frame.
+        """
+        self.draw_border_batch(frame[np.newaxis], color)
+        return frame
+
+    def draw_border_batch(self, frames, colors):
+        """
+        Draws a border along the edges of every frame of a stack, in place.
+
+        Args:
+            frames (numpy.ndarray): The (N, H, W, C) frames, or grayscale (N, H, W) frames,
+                modified in place. Single channel frames get the gray level of the colors.
+            colors (tuple or numpy.ndarray): One color (B, G, R) for all frames, or one color per frame as a (N, 3) array.
+
+        Returns:
+            numpy.ndarray: The same frames.
+        """
+        if frames.ndim not in (3, 4) or (
+            frames.ndim == 4 and frames.shape[3] not in (1, 3)
+        ):
+            raise ValueError(
+                f"Expected (N, H, W), (N, H, W, 1) or (N, H, W, 3) frames, got {frames.shape}"
+            )
+
+        # Grayscale frames are decorated through a single channel view
+        stack = frames if frames.ndim == 4 else frames[..., np.newaxis]
+        frame_count, height, width, channels = stack.shape
+        thickness = min(self.border_thickness, height // 2, width // 2)
+        if thickness <= 0:
+            return frames
+
+        colors = np.asarray(colors, dtype=np.float64)
+        if channels == 1:
+            colors = np.rint(colors @ self.GRAY_WEIGHTS)[..., np.newaxis]
+        colors = np.broadcast_to(colors.astype(frames.dtype), (frame_count, channels))[
+            :, np.newaxis, np.newaxis, :
+        ]
+
+        stack[:, :thickness] = colors
+        stack[:, height - thickness :] = colors
+        stack[:, :, :thickness] = colors
+        stack[:, :, width - thickness :] = colors
+        return frames
+
+    def format_label(self, index=None, score=None):
+        """
+        Builds the overlay text of a frame.
+
+        Args:
+            index (int, optional): Index of the frame. Defaults to None.
+            score (float, optional): Detection score of the frame. Defaults to None.
+
+        Returns:
+            str: The text, empty when there is nothing to show.
+        """
+        parts = []
+        if index is not None:
+            parts.append(f"#{int(index)}")
+        if score is not None:
+            parts.append(f"score {score:.4g}")
+        return "  ".join(parts)
+
+    def draw_label(self, frame, text):
+        """
+        Draws text on a box in the top left corner of a frame, inside the border, in place.
+
+        Args:
+            frame (numpy.ndarray): The (H, W, C) or grayscale (H, W) frame, modified in place.
+            text (str): The text to draw.
+
+        Returns:
+            numpy.ndarray: The same frame.
+        """
+        if not text:
+            return frame
+
+        (text_width, text_height), baseline = cv2.getTextSize(
+            text, self.font, self.font_scale, 1
+        )
+        padding = 3
+        left = top = self.border_thickness + 2
+        right = min(left + text_width + 2 * padding, frame.shape[1])
+        bottom = min(top + text_height + baseline + 2 * padding, frame.shape[0])
+        if right <= left or bottom <= top:
+            return frame
+
+        # Draw on the label region view only, text rendering cost then does not grow with the frame
+        label = frame[top:bottom, left:right]
+        background = np.asarray(self.label_background, dtype=np.float64)
+        if frame.ndim == 2 or frame.shape[2] == 1:
+            background = np.rint(background @ self.GRAY_WEIGHTS)
+        else:
+            background = background[: frame.shape[2]]
+        label[...] = background.astype(frame.dtype)
+        cv2.putText(
+            label,
+            text,
+            (padding, padding + text_height),
+            self.font,
+            self.font_scale,
+            self.text_color,
+            1,
+            cv2.LINE_AA,
+        )
+        return frame
+
+    def decorate(self, frame, color, index=None, score=None, in_place=False):
+        """
+        Draws the border and the optional frame index and score overlay on a frame.
+
+        Args:
+            frame (numpy.ndarray): The (H, W, C) frame.
+            color (tuple): Color of the border (B, G, R).
+            index (int, optional): Frame index to show. Defaults to None.
+            score (float, optional): Detection score to show. Defaults to None.
+            in_place (bool, optional): Whether to draw on the frame itself instead of a copy. Defaults to False.
+
+        Returns:
+            numpy.ndarray: The decorated frame.
+        """
+        if not in_place:
+            frame = frame.copy()
+        self.draw_border(frame, color)
+        return self.draw_label(frame, self.format_label(index, score))
+
+    def decorate_batch(self, frames, colors, indexes=None, scores=None, in_place=False):
+        """
+        Draws the borders and the optional overlays on a stack of frames.
+
+        Args:
+            frames (numpy.ndarray): The (N, H, W, C) frames.
+            colors (tuple or numpy.ndarray): One color for all frames, or a (N, 3) array of colors.
+            indexes (list, optional): Frame index to show on each frame. Defaults to None.
+            scores (list, optional): Detection score to show on each frame. Defaults to None.
+            in_place (bool, optional): Whether to draw on the frames themselves instead of a copy. Defaults to False.
+
+        Returns:
+            numpy.ndarray: The decorated frames.
+        """
+        if not in_place:
+            frames = frames.copy()
+        self.draw_border_batch(frames, colors)
+
+        if indexes is not None or scores is not None:
+            for position, frame in enumerate(frames):
+                self.draw_label(
+                    frame,
+                    self.format_label(
+                        None if indexes is None else indexes[position],
+                        None if scores is None else scores[position],
+                    ),
+                )
+        return frames
@@ -0,0 +1,461 @@
+import concurrent.futures
+import os
+import threading
+import weakref
+from multiprocessing import shared_memory, util
+import numpy as np
+from helpers.FrameStore import FrameStore
+from helpers.Instrumentation import Instrumentation
+
+
+class SharedFrameBuffer:
+    """
+    A class to hold a stack of frames in shared memory so worker processes can use it without copies.
+    """
+
+    def __init__(self, shape, dtype=np.uint8, name=None) -> None:
+        """
+        Creates a new shared buffer, or attaches to an existing one when a name is given.
+
+        Args:
+            shape (tuple): Shape of the frame stack.
+            dtype (numpy.dtype, optional): Type of the frame values. Defaults to np.uint8.
+            name (str, optional): Name of an existing shared buffer to attach to. Defaults to None.
+        """
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.owner = name is None
+
+        size = max(int(np.prod(self.shape)) * self.dtype.itemsize, 1)
+        if self.owner:
+            self.shared_memory = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            self.shared_memory = shared_memory.SharedMemory(name=name)
+
+        self.array = np.ndarray(
+            self.shape, dtype=self.dtype, buffer=self.shared_memory.buf
+        )
+
+    @property
+    def size(self):
+        """
+        int: Size of the buffer in bytes.
+        """
+        return self.array.nbytes
+
+    @property
+    def name(self):
+        """
+        str: Name other processes use to attach to the buffer.
+        """
+        return self.shared_memory.name
+
+    def get_spec(self):
+        """
+        Returns what a worker process needs to attach to the buffer.
+
+        Returns:
+            tuple: The name, shape and dtype of the buffer.
+        """
+        return self.name, self.shape, self.dtype.str
+
+    def close(self):
+        """
+        Detaches from the buffer, the owner also frees it.
+        """
+        self.array = None
+        self.shared_memory.close()
+        if self.owner:
+            self.shared_memory.unlink()
+
+
+class FrameExecutor:
+    """
+    A class to run a per-frame stage function over a stack of frames with a configurable backend.
+
+    The "threads" and "processes" backends split the frames into chunks of chunk_size frames and
+    submit one task per chunk, "sequential" runs everything in the calling thread.
+
+    With the "processes" backend, input and output frames live in shared buffers that are reused
+    across calls, and only their names, the frame indexes and the small per-frame results are
+    pickled. Arguments registered with register_args, e.g. the helper instances of a stage, are
+    sent to every worker once by the pool initializer instead of with every chunk. Output stacks
+    are returned as views of their shared buffer, which goes back to the pool once the returned
+    array is freed, and passing such an array, or one returned by share, as an input of a later
+    call does not copy it.
+    """
+
+    BACKENDS = ("threads", "processes", "sequential")
+
+    def __init__(
+        self, backend="threads", max_workers=None, chunk_size=16, instrumentation=None
+    ) -> None:
+        """
+        Initializes the FrameExecutor.
+
+        Args:
+            backend (str, optional): One of "threads", "processes" or "sequential". Defaults to "threads".
+            max_workers (int, optional): Number of workers. Defaults to the number of CPUs.
+            chunk_size (int, optional): Number of frames handled by each submitted task. Defaults to 16.
+            instrumentation (Instrumentation, optional): Records stage times and the number of
+                queued chunks. Defaults to the shared instance.
+        """
+        if backend not in self.BACKENDS:
+            raise ValueError(
+                f"Unknown backend {backend}, expected one of {self.BACKENDS}"
+            )
+
+        self.backend = backend
+        self.max_workers = max_workers or os.cpu_count()
+        self.chunk_size = chunk_size
+        self.executor = None
+        self.instrumentation = instrumentation or Instrumentation.get_default()
+        self.registered_args = {}
+
+        # Shared buffers not in use, and the buffer behind each leased array by array id
+        self.lock = threading.RLock()
+        self.free_buffers = []
+        self.leased_arrays = weakref.WeakValueDictionary()
+        self.leased_buffers = {}
+        self.closed = False
+
+        if backend == "threads":
+            self.executor = concurrent.futures.ThreadPoolExecutor(self.max_workers)
+
+    def log(self, message):
+        """
+        Logs a message with the class name.
+
+        Args:
+            message (str): The message to log.
+        """
+        print(f"{self.__class__.__name__}: {message}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown()
+
+    def shutdown(self):
+        """
+        Stops the workers and frees the shared buffers, buffers of arrays still in use are freed
+        once the arrays are.
+        """
+        with self.lock:
+            if self.executor is not None:
+                self.executor.shutdown()
+                self.executor = None
+
+            self.closed = True
+            for buffer in self.free_buffers:
+                buffer.close()
+            self.free_buffers = []
+            for buffer in self.leased_buffers.values():
+                # The name goes away now, the memory once the last array using it is freed
+                buffer.shared_memory.unlink()
+                buffer.owner = False
+
+    def register_args(self, name, args):
+        """
+        Registers arguments passed to a stage function by name, e.g. the helper instances it uses.
+
+        With the "processes" backend they are pickled once per worker when the pool starts, so
+        they must not change afterwards. Registering arguments after the pool started restarts
+        it, which must not happen while map_frames runs.
+
+        Args:
+            name (str): Name given to map_frames as registered_args.
+            args (tuple): The arguments.
+        """
+        with self.lock:
+            self.registered_args[name] = tuple(args)
+            if self.backend == "processes" and self.executor is not None:
+                self.executor.shutdown()
+                self.executor = None
+
+    def share(self, frames):
+        """
+        Copies frames into a shared buffer, so several map_frames calls can use them without
+        copying them again. Other backends return the frames as they are.
+
+        Args:
+            frames (np.ndarray): The (N, ...) frame stack.
+
+        Returns:
+            np.ndarray: The frames in a shared buffer, which goes back to the pool once freed.
+        """
+        frames = np.asarray(frames)
+        if self.backend != "processes" or self._get_buffer_spec(frames) is not None:
+            return frames
+
+        shared_frames = self._lease_array(frames.shape, frames.dtype)
+        shared_frames[...] = frames
+        return shared_frames
+
+    def map_frames(
+        self,
+        function,
+        inputs,
+        outputs=None,
+        indexes=None,
+        args=(),
+        registered_args=None,
+    ):
+        """
+        Runs function(index, input_frames, output_frames, *registered, *args) for every frame.
+
+        Input stacks that are FrameStores are not copied to shared memory, worker processes
+        map the store file themselves.
+
+        The function reads its frames from the input_frames dict and writes its output frames in
+        place into the output_frames dict, both holding the views of the current frame. Its return
+        value should be small, e.g. a verdict or a score.
+
+        Args:
+            function (callable): The stage function, a module level function for the "processes" backend.
+            inputs (dict): Name to (N, ...) array of the input frame stacks, at least one.
+            outputs (dict, optional): Name to (frame shape, dtype) of the output frame stacks to allocate. Defaults to None.
+            indexes (list, optional): Frame index passed to the function for each frame. Defaults to 0..N-1.
+            args (tuple, optional): Extra arguments passed to the function with every chunk. Defaults to ().
+            registered_args (str, optional): Name of arguments registered with register_args,
+                passed before args. Defaults to None.
+
+        Returns:
+            tuple: The list of results in frame order and the dict of (N, ...) output arrays.
+        """
+        if not inputs:
+            raise ValueError("map_frames needs at least one input frame stack")
+        if registered_args is not None and registered_args not in self.registered_args:
+            raise ValueError(f"No arguments registered as {registered_args!r}")
+
+        outputs = outputs or {}
+        frame_count = len(next(iter(inputs.values())))
+        indexes = list(range(frame_count)) if indexes is None else list(indexes)
+
+        with self.instrumentation.span(
+            f"FrameExecutor.map_frames.{function.__name__}", backend=self.backend
+        ) as span:
+            span.add(frames=frame_count)
+            return self._map_frames(
+                function, inputs, outputs, frame_count, indexes, args, registered_args
+            )
+
+    def _map_frames(
+        self, function, inputs, outputs, frame_count, indexes, args, registered_args
+    ):
+        """
+        Runs the stage function over the frames, through shared buffers for the "processes" backend.
+        """
+        if self.backend != "processes":
+            if registered_args is not None:
+                args = self.registered_args[registered_args] + tuple(args)
+            input_arrays = dict(inputs)
+            output_arrays = {
+                name: np.empty((frame_count, *shape), dtype=dtype)
+                for name, (shape, dtype) in outputs.items()
+            }
+            results = self._run_chunks(
+                function, input_arrays, output_arrays, indexes, args, None
+            )
+            return results, output_arrays
+
+        # Inputs not in a shared buffer yet are copied once, workers attach to them by name
+        input_arrays = {}
+        input_specs = {}
+        for name, frames in inputs.items():
+            if isinstance(frames, FrameStore):
+                input_specs[name] = frames
+                continue
+
+            input_arrays[name] = self.share(frames)
+            input_specs[name] = self._get_buffer_spec(input_arrays[name])
+
+        output_arrays = {
+            name: self._lease_array((frame_count, *shape), dtype)
+            for name, (shape, dtype) in outputs.items()
+        }
+        output_specs = {
+            name: self._get_buffer_spec(array) for name, array in output_arrays.items()
+        }
+        results = self._run_chunks(
+            function, input_specs, output_specs, indexes, args, registered_args
+        )
+        return results, output_arrays
+
+    def _run_chunks(self, function, inputs, outputs, indexes, args, registered_args):
+        """
+        Splits the frames into chunks and runs them on the backend, keeping the results in frame order.
+        """
+        bounds = [
+            (start, min(start + self.chunk_size, len(indexes)))
+            for start in range(0, len(indexes), self.chunk_size)
+        ]
+
+        executor = self._get_executor()
+        if executor is None:
+            chunk_results = [
+                _run_frame_chunk(
+                    function, inputs, outputs, indexes[start:end], start, args
+                )
+                for start, end in bounds
+            ]
+        else:
+            futures = [
+                executor.submit(
+                    _run_frame_chunk,
+                    function,
+                    inputs,
+                    outputs,
+                    indexes[start:end],
+                    start,
+                    args,
+                    registered_args,
+                )
+                for start, end in bounds
+            ]
+            chunk_results = []
+            for position, future in enumerate(futures):
+                chunk_results.append(future.result())
+                self.instrumentation.gauge(
+                    "FrameExecutor.queued_chunks",
+                    sum(not future.done() for future in futures[position + 1 :]),
+                )
+
+        return [result for chunk in chunk_results for result in chunk]
+
+    def _get_executor(self):
+        """
+        Returns the executor, starting the process pool with the registered arguments if needed.
+        """
+        with self.lock:
+            if self.backend == "processes" and self.executor is None:
+                self.executor = concurrent.futures.ProcessPoolExecutor(
+                    self.max_workers,
+                    initializer=_initialize_worker,
+                    initargs=(self.registered_args,),
+                )
+            return self.executor
+
+    def _lease_array(self, shape, dtype):
+        """
+        Returns an array over the smallest free shared buffer that fits, or a new one. The
+        buffer is put back in the pool when the array and every view of it are freed.
+        """
+        dtype = np.dtype(dtype)
+        size = max(int(np.prod(shape)) * dtype.itemsize, 1)
+        with self.lock:
+            if self.closed:
+                raise RuntimeError("The FrameExecutor was shut down")
+
+            fitting = [buffer for buffer in self.free_buffers if buffer.size >= size]
+            if fitting:
+                buffer = min(fitting, key=lambda buffer: buffer.size)
+                self.free_buffers.remove(buffer)
+            else:
+                buffer = SharedFrameBuffer((size,), np.uint8)
+
+            array = np.ndarray(shape, dtype=dtype, buffer=buffer.shared_memory.buf)
+            self.leased_arrays[id(array)] = array
+            self.leased_buffers[id(array)] = buffer
+        weakref.finalize(array, self._release_buffer, id(array))
+        return array
+
+    def _release_buffer(self, array_id):
+        """
+        Puts the buffer of a freed leased array back in the pool.
+        """
+        with self.lock:
+            buffer = self.leased_buffers.pop(array_id)
+            # After shutdown the buffer was unlinked, its memory goes with the buffer object
+            if not self.closed:
+                self.free_buffers.append(buffer)
+
+    def _get_buffer_spec(self, array):
+        """
+        Returns the (name, shape, dtype) workers attach to for a leased array, or None for other
+        arrays, including views of leased arrays.
+        """
+        with self.lock:
+            if self.leased_arrays.get(id(array)) is not array:
+                return None
+            return (
+                self.leased_buffers[id(array)].name,
+                array.shape,
+                array.dtype.str,
+            )
+
+
+# Arguments registered with the FrameExecutor and shared buffers attached by a worker process
+_worker_registered_args = {}
+_worker_shared_memories = {}
+
+
+def _initialize_worker(registered_args):
+    """
+    Receives the registered arguments once when a worker process starts, and detaches it from
+    the shared buffers when it exits.
+    """
+    _worker_registered_args.update(registered_args)
+    util.Finalize(None, _close_worker_shared_memories, exitpriority=0)
+
+
+def _close_worker_shared_memories():
+    """
+    Closes the shared buffers a worker process attached to.
+    """
+    for memory in _worker_shared_memories.values():
+        try:
+            memory.close()
+        except BufferError:
+            # A stage function kept a view of the buffer, the mapping goes with the process
+            pass
+    _worker_shared_memories.clear()
+
+
+def _run_frame_chunk(
+    function, inputs, outputs, indexes, start, args, registered_args=None
+):
+    """
+    Runs the stage function over the frames of a chunk, starting at position start of the stacks.
+
+    Stacks are either arrays, frame stores or (name, shape, dtype) specs of shared buffers to attach to.
+    """
+    if registered_args is not None:
+        args = _worker_registered_args[registered_args] + tuple(args)
+    return _apply_to_frames(
+        function, _attach_arrays(inputs), _attach_arrays(outputs), indexes, start, args
+    )
+
+
+def _apply_to_frames(function, input_arrays, output_arrays, indexes, start, args):
+    """
+    Calls the stage function with the views of each frame of the chunk.
+    """
+    results = []
+    for position, index in enumerate(indexes, start):
+        input_frames = {name: array[position] for name, array in input_arrays.items()}
+        output_frames = {name: array[position] for name, array in output_arrays.items()}
+        results.append(function(index, input_frames, output_frames, *args))
+    return results
+
+
+def _attach_arrays(stacks):
+    """
+    Resolves shared buffer specs to arrays. The shared buffers are reused by later calls, so a
+    worker stays attached to them.
+    """
+    arrays = {}
+    for name, stack in stacks.items():
+        if isinstance(stack, tuple):
+            buffer_name, shape, dtype = stack
+            if buffer_name not in _worker_shared_memories:
+                _worker_shared_memories[buffer_name] = shared_memory.SharedMemory(
+                    name=buffer_name
+                )
+            arrays[name] = np.ndarray(
+                shape, dtype=dtype, buffer=_worker_shared_memories[buffer_name].buf
+            )
+        else:
+            arrays[name] = stack
+    return arrays
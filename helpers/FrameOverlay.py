@@ -0,0 +1,184 @@
+import json
+import os
+import shutil
+
+
+class FrameOverlay:
+    """
+    A class to represent a set of frames as base frames plus a sparse map of replaced frames.
+
+    The disturbed frames of a video are the original frames except for the few attacked ones,
+    so only the attacked frames are stored and every other frame resolves to its original.
+    The overlay can be saved as a JSON manifest, or materialized as a folder of hardlinks for
+    tools that need one file per frame.
+    """
+
+    MANIFEST_NAME = "manifest.json"
+
+    def __init__(self, base_paths, overlay_paths=None) -> None:
+        """
+        Initializes the FrameOverlay.
+
+        Args:
+            base_paths (list): Path of each base frame, e.g. the original frames.
+            overlay_paths (dict, optional): Frame index to path of the frames replacing a base frame. Defaults to None.
+        """
+        self.base_paths = list(base_paths)
+        self.overlay_paths = dict(overlay_paths or {})
+
+    def log(self, message):
+        """
+        Logs a message with the class name.
+
+        Args:
+            message (str): The message to log.
+        """
+        print(f"{self.__class__.__name__}: {message}")
+
+    def __len__(self):
+        return len(self.base_paths)
+
+    def __getitem__(self, index):
+        return self.resolve(index)
+
+    def __iter__(self):
+        return (self.resolve(index) for index in range(len(self)))
+
+    def set_frame(self, index, path):
+        """
+        Replaces a base frame, safe to call from worker threads.
+
+        Args:
+            index (int): Index of the frame.
+            path (str): Path of the replacing frame.
+        """
+        if not 0 <= index < len(self.base_paths):
+            raise IndexError(f"Frame {index} is outside the {len(self)} base frames")
+        self.overlay_paths[index] = path
+
+    def resolve(self, index):
+        """
+        Returns the path of a frame, the replacing frame if there is one, else the base frame.
+
+        Args:
+            index (int): Index of the frame.
+
+        Returns:
+            str: Path of the frame.
+        """
+        return self.overlay_paths.get(index, self.base_paths[index])
+
+    def is_replaced(self, index):
+        """
+        Tells whether a frame is replaced.
+
+        Args:
+            index (int): Index of the frame.
+
+        Returns:
+            bool: Whether the frame is replaced.
+        """
+        return index in self.overlay_paths
+
+    @property
+    def replaced_indexes(self):
+        """
+        list: Indexes of the replaced frames, in increasing order.
+        """
+        return sorted(self.overlay_paths)
+
+    def get_paths(self):
+        """
+        Returns the resolved path of every frame in order.
+
+        Returns:
+            list: Path of each frame.
+        """
+        return list(self)
+
+    def save_manifest(self, output_dir):
+        """
+        Saves the overlay as a JSON manifest, paths are stored relative to the manifest.
+
+        Args:
+            output_dir (str): Directory to save the manifest to.
+
+        Returns:
+            str: Path to the manifest.
+        """
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir, exist_ok=True)
+
+        manifest = {
+            "frame_count": len(self),
+            "base_paths": [
+                os.path.relpath(path, output_dir) for path in self.base_paths
+            ],
+            "overlay_paths": {
+                str(index): os.path.relpath(path, output_dir)
+                for index, path in sorted(self.overlay_paths.items())
+            },
+        }
+        manifest_path = os.path.join(output_dir, self.MANIFEST_NAME)
+        with open(manifest_path, "w") as file:
+            json.dump(manifest, file, indent=2)
+
+        return manifest_path
+
+    @classmethod
+    def load_manifest(cls, manifest_path):
+        """
+        Loads an overlay from a JSON manifest.
+
+        Args:
+            manifest_path (str): Path to the manifest, or to the directory holding it.
+
+        Returns:
+            FrameOverlay: The overlay.
+        """
+        if os.path.isdir(manifest_path):
+            manifest_path = os.path.join(manifest_path, cls.MANIFEST_NAME)
+
+        manifest_dir = os.path.dirname(manifest_path)
+        with open(manifest_path) as file:
+            manifest = json.load(file)
+
+        return cls(
+            [os.path.join(manifest_dir, path) for path in manifest["base_paths"]],
+            {
+                int(index): os.path.join(manifest_dir, path)
+                for index, path in manifest["overlay_paths"].items()
+            },
+        )
+
+    def materialize(self, output_dir):
+        """
+        Makes one file per frame in a directory, hardlinking the frames not already there.
+
+        Frames are copied when hardlinks are not supported, e.g. across file systems.
+
+        Args:
+            output_dir (str): Directory to hold the frames.
+
+        Returns:
+            list: Path of each frame in the directory.
+        """
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir, exist_ok=True)
+
+        paths = []
+        for path in self:
+            if os.path.dirname(os.path.abspath(path)) == os.path.abspath(output_dir):
+                paths.append(path)
+                continue
+
+            link_path = os.path.join(output_dir, os.path.basename(path))
+            if os.path.lexists(link_path):
+                os.remove(link_path)
+            try:
+                os.link(path, link_path)
+            except OSError:
+                shutil.copy2(path, link_path)
+            paths.append(link_path)
+
+        return paths
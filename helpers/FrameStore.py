@@ -0,0 +1,283 @@
+import json
+import os
+import numpy as np
+
+
+class FrameStore:
+    """
+    A class to keep decoded frames in a single raw file that is memory-mapped for reading.
+
+    The file starts with a fixed size header, the magic bytes then a JSON document giving the
+    frame count, frame shape, dtype and FPS, followed by the frames as one contiguous uint8 array.
+    Frame i is a view at a fixed offset, so random access needs neither decoding nor a copy,
+    and worker processes opening the same file share its pages through the OS page cache.
+    """
+
+    MAGIC = b"FRAMESTORE\x00\x01"
+    HEADER_SIZE = 4096
+    EXTENSION = ".frames"
+
+    def __init__(self, path, mode="r") -> None:
+        """
+        Opens an existing frame store.
+
+        Args:
+            path (str): Path to the frame store file.
+            mode (str, optional): "r" to map the frames read-only, "r+" to allow writing them in place. Defaults to "r".
+        """
+        self.path = path
+        self.mode = mode
+        self.header = self.read_header(path)
+        self.fps = self.header["fps"]
+        self.frame_shape = tuple(self.header["frame_shape"])
+        self.dtype = np.dtype(self.header["dtype"])
+
+        frame_count = self.header["frame_count"]
+        if frame_count == 0:
+            self.frames = np.empty((0, *self.frame_shape), dtype=self.dtype)
+        else:
+            self.frames = np.memmap(
+                path,
+                dtype=self.dtype,
+                mode=mode,
+                offset=self.HEADER_SIZE,
+                shape=(frame_count, *self.frame_shape),
+            )
+
+    def log(self, message):
+        """
+        Logs a message with the class name.
+
+        Args:
+            message (str): The message to log.
+        """
+        print(f"{self.__class__.__name__}: {message}")
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __getitem__(self, index):
+        return self.frames[index]
+
+    def __iter__(self):
+        return iter(self.frames)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __reduce__(self):
+        # Worker processes map the same file again instead of receiving a copy of the frames
+        return (self.__class__, (self.path, self.mode))
+
+    @property
+    def frame_count(self):
+        """
+        int: Number of frames in the store.
+        """
+        return len(self.frames)
+
+    def close(self):
+        """
+        Flushes pending writes and releases the mapping.
+        """
+        if isinstance(self.frames, np.memmap) and self.mode != "r":
+            self.frames.flush()
+        self.frames = None
+
+    @classmethod
+    def is_frame_store(cls, path):
+        """
+        Tells whether a file is a frame store, from its magic bytes.
+
+        Args:
+            path (str): Path to the file.
+
+        Returns:
+            bool: Whether the file is a frame store.
+        """
+        try:
+            with open(path, "rb") as file:
+                return file.read(len(cls.MAGIC)) == cls.MAGIC
+        except OSError:
+            return False
+
+    @classmethod
+    def read_header(cls, path):
+        """
+        Reads the header of a frame store.
+
+        Args:
+            path (str): Path to the frame store file.
+
+        Returns:
+            dict: The frame count, frame shape, dtype and FPS.
+        """
+        with open(path, "rb") as file:
+            block = file.read(cls.HEADER_SIZE)
+
+        if not block.startswith(cls.MAGIC):
+            raise ValueError(f"{path} is not a frame store")
+        return json.loads(block[len(cls.MAGIC) :].rstrip(b"\x00"))
+
+    @classmethod
+    def _pack_header(cls, header):
+        block = cls.MAGIC + json.dumps(header).encode()
+        if len(block) > cls.HEADER_SIZE:
+            raise ValueError("Frame store header is too large")
+        return block.ljust(cls.HEADER_SIZE, b"\x00")
+
+    @classmethod
+    def create(cls, path, frame_count, frame_shape, fps=30, dtype=np.uint8):
+        """
+        Creates a frame store of a known size, its frames are then filled in place.
+
+        Args:
+            path (str): Path to the frame store file.
+            frame_count (int): Number of frames.
+            frame_shape (tuple): Shape (H, W, C) of each frame.
+            fps (float, optional): Frame rate of the video. Defaults to 30.
+            dtype (numpy.dtype, optional): Type of the frame values. Defaults to np.uint8.
+
+        Returns:
+            FrameStore: The store, opened for writing.
+        """
+        header = {
+            "frame_count": int(frame_count),
+            "frame_shape": [int(size) for size in frame_shape],
+            "dtype": np.dtype(dtype).str,
+            "fps": float(fps),
+        }
+        cls._make_parent_dir(path)
+        with open(path, "wb") as file:
+            file.write(cls._pack_header(header))
+            file.truncate(
+                cls.HEADER_SIZE
+                + int(frame_count)
+                * int(np.prod(frame_shape))
+                * np.dtype(dtype).itemsize
+            )
+
+        return cls(path, mode="r+")
+
+    @classmethod
+    def write_frames(cls, path, frames, fps=30):
+        """
+        Writes a stream of frames of unknown length to a new frame store.
+
+        Frames are appended one at a time, so the stream is never held in memory.
+
+        Args:
+            path (str): Path to the frame store file.
+            frames (iterable): Frames (as numpy arrays) of the same shape, e.g. a video stream.
+            fps (float, optional): Frame rate of the video. Defaults to 30.
+
+        Returns:
+            str: Path to the frame store file.
+        """
+        with FrameStoreWriter(path, fps=fps) as writer:
+            for frame in frames:
+                writer.write(frame)
+
+        return path
+
+    @classmethod
+    def _make_parent_dir(cls, path):
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+
+
+class FrameStoreWriter:
+    """
+    A class to append frames one at a time to a new frame store, e.g. from a video sink.
+
+    Frames go to a temporary file that replaces the store on close, so readers never see a
+    partial store.
+    """
+
+    def __init__(self, path, fps=30) -> None:
+        """
+        Opens the writer, the frame shape and dtype are taken from the first frame.
+
+        Args:
+            path (str): Path to the frame store file.
+            fps (float, optional): Frame rate of the video. Defaults to 30.
+        """
+        self.path = path
+        self.header = {
+            "frame_count": 0,
+            "frame_shape": [],
+            "dtype": "|u1",
+            "fps": float(fps),
+        }
+        FrameStore._make_parent_dir(path)
+        self.temporary_path = f"{path}.{os.getpid()}.tmp"
+        self.file = open(self.temporary_path, "wb")
+        self.file.write(FrameStore._pack_header(self.header))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+    @property
+    def frame_count(self):
+        """
+        int: Number of frames written so far.
+        """
+        return self.header["frame_count"]
+
+    def write(self, frame):
+        """
+        Appends a frame to the store.
+
+        Args:
+            frame (numpy.ndarray): The frame, of the same shape and type as the first one.
+        """
+        frame = np.ascontiguousarray(frame)
+        header = self.header
+        if header["frame_count"] == 0:
+            header["frame_shape"] = list(frame.shape)
+            header["dtype"] = frame.dtype.str
+        elif (
+            list(frame.shape) != header["frame_shape"]
+            or frame.dtype.str != header["dtype"]
+        ):
+            raise ValueError(
+                f"Frame {header['frame_count']} has shape {frame.shape} and type "
+                f"{frame.dtype}, expected {tuple(header['frame_shape'])} and "
+                f"{np.dtype(header['dtype'])}"
+            )
+        self.file.write(frame.data)
+        header["frame_count"] += 1
+
+    def close(self):
+        """
+        Writes the final header and moves the store in place.
+
+        Returns:
+            str: Path to the frame store file.
+        """
+        if self.file is not None:
+            self.file.seek(0)
+            self.file.write(FrameStore._pack_header(self.header))
+            self.file.close()
+            self.file = None
+            os.replace(self.temporary_path, self.path)
+        return self.path
+
+    def discard(self):
+        """
+        Removes the temporary file without touching the store, e.g. after an error.
+        """
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+            os.remove(self.temporary_path)
@@ -0,0 +1,378 @@
+import atexit
+import cProfile
+import json
+import multiprocessing.util
+import os
+import threading
+import time
+import tracemalloc
+
+
+class Span:
+    """
+    A timed section of work, e.g. a pipeline stage, with the amount of data it processed.
+
+    Counts are added while the span is open and recorded when it closes.
+    """
+
+    def __init__(self, instrumentation, name, emit, attributes) -> None:
+        """
+        Args:
+            instrumentation (Instrumentation): Records the span when it closes.
+            name (str): Name of the span, e.g. "MediaConverter.save_frames_to_folder".
+            emit (bool): Whether the span is written as its own metrics line, otherwise it only
+                adds to the totals of its name.
+            attributes (dict): Extra values written with the span.
+        """
+        self.instrumentation = instrumentation
+        self.name = name
+        self.emit = emit
+        self.attributes = attributes
+        self.frames = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.profiler = None
+
+    def add(self, frames=0, bytes_read=0, bytes_written=0):
+        """
+        Adds processed frames and bytes to the span.
+
+        Args:
+            frames (int, optional): Number of frames processed. Defaults to 0.
+            bytes_read (int, optional): Number of bytes read. Defaults to 0.
+            bytes_written (int, optional): Number of bytes written. Defaults to 0.
+        """
+        self.frames += frames
+        self.bytes_read += bytes_read
+        self.bytes_written += bytes_written
+
+    def __enter__(self):
+        if self.emit:
+            self.profiler = self.instrumentation._start_profiler(self.name)
+        self.wall_start = time.perf_counter()
+        self.cpu_start = time.thread_time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        wall_seconds = time.perf_counter() - self.wall_start
+        cpu_seconds = time.thread_time() - self.cpu_start
+
+        attributes = dict(self.attributes)
+        if self.profiler is not None:
+            attributes["profile_path"] = self.instrumentation._stop_profiler(
+                self.profiler, self.name
+            )
+        if exc_type is not None:
+            attributes["error"] = exc_type.__name__
+
+        self.instrumentation.record_span(
+            self.name,
+            wall_seconds,
+            cpu_seconds,
+            frames=self.frames,
+            bytes_read=self.bytes_read,
+            bytes_written=self.bytes_written,
+            emit=self.emit,
+            **attributes,
+        )
+
+
+class Instrumentation:
+    """
+    A class to record stage timings, counters and queue depths as JSON lines.
+
+    Nothing is recorded unless a metrics file is configured, either in the constructor or with
+    the VIDEO_METRICS_FILE environment variable, so the helpers can stay instrumented in
+    production at the cost of a few attribute lookups per call. Per-frame spans only add to
+    the totals of their name, which are written as summary lines when the process exits.
+
+    Optional hooks, also enabled from the environment:
+    - VIDEO_METRICS_PROFILE: comma separated span names, or "all", to run under cProfile.
+      Each profiled span dumps its stats next to the metrics file.
+    - VIDEO_METRICS_TRACEMALLOC=1: traces Python allocations and adds the traced current and
+      peak memory to every span line.
+    """
+
+    _default = None
+    _process_instances = {}
+
+    def __init__(self, metrics_path=None, profile_spans=None, trace_memory=None):
+        """
+        Initializes the Instrumentation, the arguments default to the environment variables.
+
+        Args:
+            metrics_path (str, optional): JSON lines file to append the metrics to. Defaults to
+                VIDEO_METRICS_FILE, nothing is recorded when neither is set.
+            profile_spans (str, optional): Comma separated span names to profile, or "all".
+                Defaults to VIDEO_METRICS_PROFILE.
+            trace_memory (bool, optional): Whether to trace Python allocations. Defaults to
+                VIDEO_METRICS_TRACEMALLOC.
+        """
+        if metrics_path is None:
+            metrics_path = os.environ.get("VIDEO_METRICS_FILE") or None
+        if profile_spans is None:
+            profile_spans = os.environ.get("VIDEO_METRICS_PROFILE", "")
+        if trace_memory is None:
+            trace_memory = os.environ.get("VIDEO_METRICS_TRACEMALLOC", "") not in (
+                "",
+                "0",
+            )
+
+        self.metrics_path = metrics_path
+        self.profile_spans = {name for name in profile_spans.split(",") if name}
+        self.trace_memory = trace_memory and self.enabled
+        self.totals = {}
+        self.gauges = {}
+        self.profile_count = 0
+        self.owner_pid = os.getpid()
+        self.lock = threading.Lock()
+        self.file = None
+        self.profiling = threading.local()
+
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        if self.enabled:
+            # Worker processes skip atexit but run the multiprocessing finalizers
+            atexit.register(self.close)
+            multiprocessing.util.Finalize(None, self.close, exitpriority=10)
+
+    @classmethod
+    def get_default(cls):
+        """
+        Returns the instance shared by the helper classes, configured from the environment.
+
+        Returns:
+            Instrumentation: The shared instance.
+        """
+        if cls._default is None or cls._default.owner_pid != os.getpid():
+            cls._default = cls()
+        return cls._default
+
+    @classmethod
+    def _get_process_instance(cls, metrics_path, profile_spans, trace_memory):
+        """
+        Returns the instance of the current process with the given configuration.
+
+        Unpickling resolves to it, so helpers sent to a worker process share one instance
+        per process instead of creating one per task.
+        """
+        key = (os.getpid(), metrics_path, profile_spans, trace_memory)
+        if key not in cls._process_instances:
+            cls._process_instances[key] = cls(metrics_path, profile_spans, trace_memory)
+        return cls._process_instances[key]
+
+    @property
+    def enabled(self):
+        """
+        bool: Whether metrics are recorded.
+        """
+        return self.metrics_path is not None
+
+    def log(self, message):
+        """
+        Logs a message with the class name.
+
+        Args:
+            message (str): The message to log.
+        """
+        print(f"{self.__class__.__name__}: {message}")
+
+    def __reduce__(self):
+        # Locks and files do not cross processes, workers get their own instance
+        return (
+            Instrumentation._get_process_instance,
+            (
+                self.metrics_path,
+                ",".join(sorted(self.profile_spans)),
+                self.trace_memory,
+            ),
+        )
+
+    def span(self, name, emit=True, **attributes):
+        """
+        Opens a timed span, to be used as a context manager.
+
+        Args:
+            name (str): Name of the span, by convention "Class.method".
+            emit (bool, optional): Whether to write the span as its own line, per-frame spans
+                should pass False and only add to the totals. Defaults to True.
+            **attributes: Extra values written with the span.
+
+        Returns:
+            Span: The span, its add method counts the processed frames and bytes.
+        """
+        return Span(self, name, emit and self.enabled, attributes)
+
+    def record_span(
+        self,
+        name,
+        wall_seconds,
+        cpu_seconds,
+        frames=0,
+        bytes_read=0,
+        bytes_written=0,
+        emit=True,
+        **attributes,
+    ):
+        """
+        Records a span that was timed by the caller, e.g. work spread over a generator.
+
+        Args:
+            name (str): Name of the span.
+            wall_seconds (float): Wall time of the span.
+            cpu_seconds (float): CPU time of the span.
+            frames (int, optional): Number of frames processed. Defaults to 0.
+            bytes_read (int, optional): Number of bytes read. Defaults to 0.
+            bytes_written (int, optional): Number of bytes written. Defaults to 0.
+            emit (bool, optional): Whether to write the span as its own line. Defaults to True.
+            **attributes: Extra values written with the span.
+        """
+        if not self.enabled:
+            return
+
+        with self.lock:
+            totals = self.totals.setdefault(
+                name,
+                {
+                    "calls": 0,
+                    "wall_seconds": 0.0,
+                    "cpu_seconds": 0.0,
+                    "frames": 0,
+                    "bytes_read": 0,
+                    "bytes_written": 0,
+                },
+            )
+            totals["calls"] += 1
+            totals["wall_seconds"] += wall_seconds
+            totals["cpu_seconds"] += cpu_seconds
+            totals["frames"] += frames
+            totals["bytes_read"] += bytes_read
+            totals["bytes_written"] += bytes_written
+
+        if not emit:
+            return
+
+        record = {
+            "type": "span",
+            "name": name,
+            "wall_seconds": wall_seconds,
+            "cpu_seconds": cpu_seconds,
+            "frames": frames,
+            "frames_per_second": frames / wall_seconds if wall_seconds > 0 else None,
+            "bytes_read": bytes_read,
+            "bytes_written": bytes_written,
+        }
+        if self.trace_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            record["traced_memory_bytes"] = current
+            record["traced_peak_bytes"] = peak
+        record.update(attributes)
+        self._write(record)
+
+    def count(self, name, frames=0, bytes_read=0, bytes_written=0):
+        """
+        Adds to the totals of a name without timing, e.g. bytes written by a helper.
+
+        Args:
+            name (str): Name of the counter.
+            frames (int, optional): Number of frames processed. Defaults to 0.
+            bytes_read (int, optional): Number of bytes read. Defaults to 0.
+            bytes_written (int, optional): Number of bytes written. Defaults to 0.
+        """
+        self.record_span(name, 0.0, 0.0, frames, bytes_read, bytes_written, emit=False)
+
+    def gauge(self, name, value):
+        """
+        Samples a level, e.g. the depth of a queue, keeping its last and maximum value.
+
+        Args:
+            name (str): Name of the gauge.
+            value (float): The sampled value.
+        """
+        if not self.enabled:
+            return
+
+        with self.lock:
+            gauge = self.gauges.setdefault(
+                name, {"samples": 0, "last": value, "max": value, "total": 0}
+            )
+            gauge["samples"] += 1
+            gauge["last"] = value
+            gauge["max"] = max(gauge["max"], value)
+            gauge["total"] += value
+
+    def flush(self):
+        """
+        Writes the totals of every span name and gauge as summary lines and resets them.
+        """
+        if not self.enabled:
+            return
+
+        with self.lock:
+            totals, self.totals = self.totals, {}
+            gauges, self.gauges = self.gauges, {}
+
+        for name, total in totals.items():
+            self._write({"type": "summary", "name": name, **total})
+        for name, gauge in gauges.items():
+            mean = gauge.pop("total") / gauge["samples"]
+            self._write({"type": "gauge", "name": name, "mean": mean, **gauge})
+
+    def close(self):
+        """
+        Flushes the totals and closes the metrics file.
+        """
+        self.flush()
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+    def _write(self, record):
+        """
+        Appends a record to the metrics file, lines of concurrent processes do not interleave.
+        """
+        record["time"] = time.time()
+        record["pid"] = os.getpid()
+        record["thread"] = threading.current_thread().name
+        line = json.dumps(record, default=str) + "\n"
+
+        with self.lock:
+            if self.file is None:
+                directory = os.path.dirname(self.metrics_path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                self.file = open(self.metrics_path, "a", buffering=1)
+            self.file.write(line)
+
+    def _start_profiler(self, name):
+        """
+        Starts cProfile for a span when requested, nested spans of the same thread are not profiled.
+        """
+        if not self.profile_spans or getattr(self.profiling, "active", False):
+            return None
+        if "all" not in self.profile_spans and name not in self.profile_spans:
+            return None
+
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler is already running, e.g. in another thread
+            return None
+        self.profiling.active = True
+        return profiler
+
+    def _stop_profiler(self, profiler, name):
+        """
+        Stops a span's profiler and dumps its stats next to the metrics file.
+        """
+        profiler.disable()
+        self.profiling.active = False
+
+        with self.lock:
+            self.profile_count += 1
+            profile_count = self.profile_count
+        profile_path = f"{self.metrics_path}.{name}.{os.getpid()}.{profile_count}.prof"
+        profiler.dump_stats(profile_path)
+        return profile_path
@@ -1,17 +1,73 @@
 import cv2
 import os
+import time
+import numpy as np
 import shutil
 from natsort import natsorted
+from helpers.FrameDecorator import FrameDecorator
+from helpers.FrameStore import FrameStore
+from helpers.Instrumentation import Instrumentation
+from helpers.VideoWriterSink import VideoWriterSink
 
 
 class MediaConverter:
     """
     A class to handle various media conversion tasks such as converting videos to frames,
     converting images to videos, adding borders to images, and copying files.
+
+    Frames are saved as JPEG and videos encoded with mp4v by default, both lossy. Lossless
+    formats keep the attack perturbation intact for detection: PNG or BMP frames, and FFV1,
+    HFYU or raw videos. A raw video is a frame store, frames are neither encoded nor decoded.
     """
 
-    def __init__(self):
+    # Image format to the cv2.imwrite parameters, PNG uses a low compression level for speed
+    FRAME_FORMATS = {
+        "jpg": [],
+        "png": [cv2.IMWRITE_PNG_COMPRESSION, 1],
+        "bmp": [],
+    }
+    LOSSLESS_FRAME_FORMATS = ("png", "bmp")
+
+    # Video codec to the extension of its container
+    VIDEO_CODECS = {
+        "mp4v": ".mp4",
+        "MJPG": ".avi",
+        "XVID": ".avi",
+        "FFV1": ".mkv",
+        "HFYU": ".avi",
+        VideoWriterSink.RAW_FOURCC: FrameStore.EXTENSION,
+    }
+    LOSSLESS_VIDEO_CODECS = ("FFV1", "HFYU", VideoWriterSink.RAW_FOURCC)
+
+    def __init__(
+        self,
+        instrumentation=None,
+        frame_decorator=None,
+        frame_format="jpg",
+        video_codec="mp4v",
+    ):
+        """
+        Initializes the MediaConverter.
+
+        Args:
+            instrumentation (Instrumentation, optional): Records stage metrics. Defaults to the shared instance.
+            frame_decorator (FrameDecorator, optional): Draws borders and overlays. Defaults to a 10 px border.
+            frame_format (str, optional): Image format of saved frames, one of FRAME_FORMATS. Defaults to "jpg".
+            video_codec (str, optional): Codec of written videos, one of VIDEO_CODECS. Defaults to "mp4v".
+        """
+        if frame_format not in self.FRAME_FORMATS:
+            raise ValueError(
+                f"Unknown frame format {frame_format!r}, "
+                f"expected one of {list(self.FRAME_FORMATS)}"
+            )
+        self.check_video_codec(video_codec)
+
         self.current_fps = 30
+        self.current_frame_count = 0
+        self.instrumentation = instrumentation or Instrumentation.get_default()
+        self.frame_decorator = frame_decorator or FrameDecorator()
+        self.frame_format = frame_format
+        self.video_codec = video_codec
 
     def log(self, message):
         """
@@ -28,6 +84,34 @@ class MediaConverter:
         """
         print("\n")
 
+    def check_video_codec(self, video_codec):
+        """
+        Checks that a video codec is supported.
+
+        Args:
+            video_codec (str): The video codec.
+        """
+        if video_codec not in self.VIDEO_CODECS:
+            raise ValueError(
+                f"Unknown video codec {video_codec!r}, "
+                f"expected one of {list(self.VIDEO_CODECS)}"
+            )
+
+    def get_video_file_name(self, name, video_codec=None):
+        """
+        Returns a video file name with the extension of the container of a codec.
+
+        Args:
+            name (str): File name, with or without an extension.
+            video_codec (str, optional): The video codec. Defaults to the configured codec.
+
+        Returns:
+            str: The file name, e.g. "video.mkv" for FFV1.
+        """
+        video_codec = video_codec or self.video_codec
+        self.check_video_codec(video_codec)
+        return os.path.splitext(name)[0] + self.VIDEO_CODECS[video_codec]
+
     def convert_video_to_frames(self, video_filepath):
         """
         Converts a video to individual frames.
@@ -38,61 +122,293 @@ class MediaConverter:
         Returns:
             list: A list of frames (as numpy arrays) extracted from the video.
         """
-        cam = cv2.VideoCapture(video_filepath)
-        fps = cam.get(cv2.CAP_PROP_FPS)
-        self.current_fps = fps
+        return [frame for _, _, frame in self.stream_video_frames(video_filepath)]
+
+    def stream_video_frames(
+        self, video_filepath, start_frame=0, end_frame=None, stride=1, chunk_size=None
+    ):
+        """
+        Lazily reads frames from a video so that only the current frame or chunk is held in memory.
+
+        The video is opened and current_fps is updated right away, frames are decoded on iteration.
+        Frame stores are read the same way, their frames are copied out of the mapping without decoding.
+
+        Args:
+            video_filepath (str): Path to the input video file, or to a frame store.
+            start_frame (int, optional): Index of the first frame to read. Defaults to 0.
+            end_frame (int, optional): Index after the last frame to read. Defaults to the end of the video.
+            stride (int, optional): Only every stride-th frame is decoded, the others are skipped. Defaults to 1.
+            chunk_size (int, optional): When set, frames are grouped into stacks of this many frames. Defaults to None.
+
+        Returns:
+            generator: Yields (index, timestamp in seconds, frame) for each frame, or
+                       (indexes, timestamps, frames) numpy arrays for each chunk when chunk_size is set.
+        """
+        if stride < 1:
+            raise ValueError("stride must be at least 1")
+
+        if FrameStore.is_frame_store(video_filepath):
+            store = self.open_frame_store(video_filepath)
+            frames = self._read_store_frames(store, start_frame, end_frame, stride)
+        else:
+            cam = cv2.VideoCapture(video_filepath)
+            fps = cam.get(cv2.CAP_PROP_FPS)
+            self.current_fps = fps
+            self.log(f"Current video FPS: {self.current_fps}")
+
+            if start_frame > 0:
+                cam.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+
+            frames = self._read_frames(
+                cam, start_frame, end_frame, stride, fps, video_filepath
+            )
+        if chunk_size is None:
+            return frames
+        return self._chunk_frames(frames, chunk_size)
+
+    def _read_frames(self, cam, start_frame, end_frame, stride, fps, video_filepath):
+        """
+        Reads (index, timestamp, frame) tuples from an opened video capture and releases it at the end.
+
+        Skipped frames are only grabbed, not decoded. Only the time spent decoding is recorded,
+        not the time the consumer spends between frames.
+        """
+        index = start_frame
+        self.current_frame_count = 0
+        wall_seconds = 0.0
+        cpu_seconds = 0.0
+        decoded_bytes = 0
+        try:
+            while end_frame is None or index < end_frame:
+                wall_start = time.perf_counter()
+                cpu_start = time.thread_time()
+                if (index - start_frame) % stride:
+                    grabbed = cam.grab()
+                    wall_seconds += time.perf_counter() - wall_start
+                    cpu_seconds += time.thread_time() - cpu_start
+                    if not grabbed:
+                        break
+                    index += 1
+                    continue
+
+                ret, frame = cam.read()
+                wall_seconds += time.perf_counter() - wall_start
+                cpu_seconds += time.thread_time() - cpu_start
+                if not ret:
+                    break
+                decoded_bytes += frame.nbytes
+
+                timestamp = index / fps if fps > 0 else 0.0
+                self.current_frame_count += 1
+                yield index, timestamp, frame
+                index += 1
+        finally:
+            cam.release()
+            if self.instrumentation.enabled:
+                self.instrumentation.record_span(
+                    "MediaConverter.stream_video_frames",
+                    wall_seconds,
+                    cpu_seconds,
+                    frames=self.current_frame_count,
+                    bytes_read=self._get_file_size(video_filepath),
+                    decoded_bytes=decoded_bytes,
+                    video_filepath=video_filepath,
+                )
+
+    def _read_store_frames(self, store, start_frame, end_frame, stride):
+        """
+        Reads (index, timestamp, frame) tuples from a frame store, each frame a writable copy.
+        """
+        self.current_frame_count = 0
+        end_frame = len(store) if end_frame is None else min(end_frame, len(store))
+        wall_seconds = 0.0
+        try:
+            for index in range(start_frame, end_frame, stride):
+                wall_start = time.perf_counter()
+                frame = np.array(store[index])
+                wall_seconds += time.perf_counter() - wall_start
+
+                self.current_frame_count += 1
+                yield index, index / store.fps if store.fps > 0 else 0.0, frame
+        finally:
+            self.instrumentation.record_span(
+                "MediaConverter.read_frame_store",
+                wall_seconds,
+                wall_seconds,
+                frames=self.current_frame_count,
+                bytes_read=self.current_frame_count
+                * int(np.prod(store.frame_shape))
+                * store.dtype.itemsize,
+                video_filepath=store.path,
+            )
+            store.close()
+
+    def _chunk_frames(self, frames, chunk_size):
+        """
+        Groups (index, timestamp, frame) tuples into stacked numpy chunks of at most chunk_size frames.
+        """
+        indexes, timestamps, chunk = [], [], []
+        for index, timestamp, frame in frames:
+            indexes.append(index)
+            timestamps.append(timestamp)
+            chunk.append(frame)
+            if len(chunk) == chunk_size:
+                yield np.array(indexes), np.array(timestamps), np.stack(chunk)
+                indexes, timestamps, chunk = [], [], []
+
+        if chunk:
+            yield np.array(indexes), np.array(timestamps), np.stack(chunk)
+
+    def open_frame_store(self, store_path):
+        """
+        Opens a frame store for random access and updates current_fps and current_frame_count.
+
+        Args:
+            store_path (str): Path to the frame store file.
+
+        Returns:
+            FrameStore: The read-only store, store[i] is a view of frame i.
+        """
+        store = FrameStore(store_path)
+        self.current_fps = store.fps
+        self.current_frame_count = len(store)
         self.log(f"Current video FPS: {self.current_fps}")
-        frames = []
+        return store
+
+    def save_frames_to_store(self, frames, store_path, fps=None):
+        """
+        Saves frames to a single memory-mappable frame store instead of one image per frame.
 
-        while True:
-            ret, frame = cam.read()
-            if ret:
-                frames.append(frame)
-            else:
-                break
+        Frames are stored raw, so the store is lossless and frames are read back without decoding.
 
-        cam.release()
-        return frames
+        Args:
+            frames (iterable): Frames (as numpy arrays) to save, a generator is consumed lazily.
+            store_path (str): Path to the frame store file, by convention ending in ".frames".
+            fps (float, optional): Frame rate stored in the header. Defaults to the FPS of the last read video.
 
-    def convert_images_to_video(self, image_paths, output_dir, file_name):
+        Returns:
+            str: Path to the frame store file.
+        """
+        with self.instrumentation.span("MediaConverter.save_frames_to_store") as span:
+            frame_count = 0
+
+            def count_frames():
+                nonlocal frame_count
+                for frame in frames:
+                    frame_count += 1
+                    yield frame
+
+            FrameStore.write_frames(
+                store_path,
+                count_frames(),
+                fps=self.current_fps if fps is None else fps,
+            )
+            span.add(frames=frame_count, bytes_written=self._get_file_size(store_path))
+
+        return store_path
+
+    def convert_video_to_store(self, video_filepath, store_path):
+        """
+        Decodes a video once into a frame store.
+
+        Args:
+            video_filepath (str): Path to the input video file.
+            store_path (str): Path to the frame store file.
+
+        Returns:
+            str: Path to the frame store file.
+        """
+        frames = self.stream_video_frames(video_filepath)
+        return self.save_frames_to_store(
+            (frame for _, _, frame in frames), store_path, fps=self.current_fps
+        )
+
+    def convert_images_to_video(
+        self, image_paths, output_dir, file_name, video_codec=None
+    ):
         """
         Converts a list of images to a video.
 
+        Images are read one at a time while the video is written, they are never all held in memory.
+
         Args:
             image_paths (list): List of paths to the input images.
             output_dir (str): Directory to save the output video.
             file_name (str): Name of the output video file.
+            video_codec (str, optional): Codec of the video. Defaults to the configured codec.
 
         Returns:
             str: The name of the output video file.
         """
-        if not os.path.exists(output_dir):
-            os.makedirs(output_dir)
+        with self.instrumentation.span(
+            "MediaConverter.convert_images_to_video", file_name=file_name
+        ) as span:
+            with self.open_video_sink(output_dir, file_name, video_codec) as video:
+                for image_path in image_paths:
+                    video.write_path(image_path)
+            span.add(
+                frames=video.frames_written,
+                bytes_written=self._get_file_size(os.path.join(output_dir, file_name)),
+            )
 
-        images = [cv2.imread(img_path) for img_path in image_paths]
-        height, width, _ = images[0].shape
-        fourcc = cv2.VideoWriter_fourcc(*"mp4v")
-        video = cv2.VideoWriter(
-            os.path.join(output_dir, file_name),
-            fourcc,
-            self.current_fps,
-            (width, height),
-        )
+        return file_name
+
+    def convert_frames_to_video(self, frames, output_dir, file_name, video_codec=None):
+        """
+        Converts in-memory frames to a video without writing intermediate images.
 
-        for image in images:
-            video.write(image)
+        Args:
+            frames (iterable): Frames (as numpy arrays) to write, in order.
+            output_dir (str): Directory to save the output video.
+            file_name (str): Name of the output video file.
+            video_codec (str, optional): Codec of the video. Defaults to the configured codec.
 
-        cv2.destroyAllWindows()
-        video.release()
+        Returns:
+            str: The name of the output video file.
+        """
+        with self.instrumentation.span(
+            "MediaConverter.convert_frames_to_video", file_name=file_name
+        ) as span:
+            with self.open_video_sink(output_dir, file_name, video_codec) as video:
+                for frame in frames:
+                    video.write(frame)
+            span.add(
+                frames=video.frames_written,
+                bytes_written=self._get_file_size(os.path.join(output_dir, file_name)),
+            )
 
         return file_name
 
+    def open_video_sink(self, output_dir, file_name, video_codec=None):
+        """
+        Opens an incremental video writer using the FPS of the last read video.
+
+        Frames can be appended as they arrive, in any order when their index is given.
+
+        Args:
+            output_dir (str): Directory to save the output video.
+            file_name (str): Name of the output video file.
+            video_codec (str, optional): Codec of the video. Defaults to the configured codec.
+
+        Returns:
+            VideoWriterSink: The video sink, to be closed once all frames are written.
+        """
+        video_codec = video_codec or self.video_codec
+        self.check_video_codec(video_codec)
+        return VideoWriterSink(
+            output_dir,
+            file_name,
+            fps=self.current_fps,
+            fourcc=video_codec,
+            instrumentation=self.instrumentation,
+        )
+
     def save_frames_to_folder(self, frames, output_dir):
         """
         Saves a list of frames to a specified directory.
 
         Args:
-            frames (list): List of frames (as numpy arrays) to save.
+            frames (iterable): Frames (as numpy arrays) to save, a generator is consumed lazily.
             output_dir (str): Directory to save the frames.
 
         Returns:
@@ -101,15 +417,38 @@ class MediaConverter:
         if not os.path.exists(output_dir):
             os.makedirs(output_dir)
 
-        file_paths = [
-            os.path.join(output_dir, f"frame{i+1}.jpg") for i in range(len(frames))
-        ]
-
-        for i in range(len(frames)):
-            cv2.imwrite(file_paths[i], frames[i])
+        with self.instrumentation.span("MediaConverter.save_frames_to_folder") as span:
+            file_paths = [
+                self.save_frame(frame, output_dir, i) for i, frame in enumerate(frames)
+            ]
+            span.add(
+                frames=len(file_paths),
+                bytes_written=sum(self._get_file_size(path) for path in file_paths),
+            )
 
         return file_paths
 
+    def save_frame(self, frame, output_dir, index):
+        """
+        Saves a single frame to a specified directory, named after its index.
+
+        Args:
+            frame (numpy.ndarray): The frame to save.
+            output_dir (str): Directory to save the frame.
+            index (int): Index of the frame in the video.
+
+        Returns:
+            str: Path to the saved frame.
+        """
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir, exist_ok=True)
+
+        file_path = os.path.join(output_dir, f"frame{index+1}.{self.frame_format}")
+        with self.instrumentation.span("MediaConverter.save_frame", emit=False) as span:
+            cv2.imwrite(file_path, frame, self.FRAME_FORMATS[self.frame_format])
+            span.add(frames=1, bytes_written=self._get_file_size(file_path))
+        return file_path
+
     def add_border(self, image_filepath, border_color):
         """
         Adds a border to an image.
@@ -122,22 +461,22 @@ class MediaConverter:
             numpy.ndarray: Image with the added border.
         """
         image = cv2.imread(image_filepath)
-        original_height, original_width = image.shape[:2]
-        border_thickness = 10
-
-        image_with_border = cv2.copyMakeBorder(
-            image,
-            top=border_thickness,
-            bottom=border_thickness,
-            left=border_thickness,
-            right=border_thickness,
-            borderType=cv2.BORDER_CONSTANT,
-            value=border_color,
-        )
+        return self.frame_decorator.draw_border(image, border_color)
+
+    def add_border_to_frame(self, frame, border_color):
+        """
+        Adds a border to an in-memory frame.
 
-        resized_image = cv2.resize(image_with_border, (original_width, original_height))
+        The border is drawn over the outer pixels of a copy of the frame, the frame is not resized.
 
-        return resized_image
+        Args:
+            frame (numpy.ndarray): The input frame.
+            border_color (tuple): Color of the border (B, G, R).
+
+        Returns:
+            numpy.ndarray: Frame with the added border.
+        """
+        return self.frame_decorator.draw_border(frame.copy(), border_color)
 
     def decorate_image(self, image_path, output_dir, color, count):
         """
@@ -158,12 +497,60 @@ class MediaConverter:
             except OSError:
                 pass
 
-        updated_image = self.add_border(image_path, color)
-        file_path = os.path.join(output_dir, f"decorated_frame{count + 1}.jpg")
-        cv2.imwrite(file_path, updated_image)
+        file_path = os.path.join(
+            output_dir, f"decorated_frame{count + 1}.{self.frame_format}"
+        )
+        with self.instrumentation.span(
+            "MediaConverter.decorate_image", emit=False
+        ) as span:
+            updated_image = self.add_border(image_path, color)
+            cv2.imwrite(file_path, updated_image, self.FRAME_FORMATS[self.frame_format])
+            span.add(
+                frames=1,
+                bytes_read=self._get_file_size(image_path),
+                bytes_written=self._get_file_size(file_path),
+            )
 
         return file_path
 
+    def decorate_frame(self, frame, color, index=None, score=None, in_place=False):
+        """
+        Adds a border, and optionally the frame index and score, to an in-memory frame without saving it.
+
+        Args:
+            frame (numpy.ndarray): The input frame.
+            color (tuple): Color of the border (B, G, R).
+            index (int, optional): Frame index to show on the frame. Defaults to None.
+            score (float, optional): Detection score to show on the frame. Defaults to None.
+            in_place (bool, optional): Whether to draw on the frame itself instead of a copy. Defaults to False.
+
+        Returns:
+            numpy.ndarray: The decorated frame.
+        """
+        return self.frame_decorator.decorate(
+            frame, color, index=index, score=score, in_place=in_place
+        )
+
+    def decorate_frames(
+        self, frames, colors, indexes=None, scores=None, in_place=False
+    ):
+        """
+        Adds borders, and optionally frame indexes and scores, to a stack of in-memory frames.
+
+        Args:
+            frames (numpy.ndarray): The (N, H, W, C) frames.
+            colors (tuple or numpy.ndarray): One color (B, G, R) for all frames, or a (N, 3) array of colors.
+            indexes (list, optional): Frame index to show on each frame. Defaults to None.
+            scores (list, optional): Detection score to show on each frame. Defaults to None.
+            in_place (bool, optional): Whether to draw on the frames themselves instead of a copy. Defaults to False.
+
+        Returns:
+            numpy.ndarray: The decorated frames.
+        """
+        return self.frame_decorator.decorate_batch(
+            frames, colors, indexes=indexes, scores=scores, in_place=in_place
+        )
+
     def copy_and_paste_file(self, original_filepath, destination_directory):
         """
         Copies a file to a specified directory.
@@ -185,6 +572,13 @@ class MediaConverter:
             filename = os.path.basename(original_filepath)
             new_filepath = os.path.join(destination_directory, filename)
             shutil.copy(original_filepath, destination_directory)
+            size = self._get_file_size(new_filepath)
+            self.instrumentation.count(
+                "MediaConverter.copy_and_paste_file",
+                frames=1,
+                bytes_read=size,
+                bytes_written=size,
+            )
             return new_filepath
         except FileNotFoundError:
             self.log(f"Error: File not found at {original_filepath}")
@@ -194,7 +588,7 @@ class MediaConverter:
 
     def list_image_paths(self, folder_path):
         """
-        Lists the paths of all .jpg images in a specified folder, sorted naturally.
+        Lists the paths of all images of the supported frame formats in a folder, sorted naturally.
 
         Args:
             folder_path (str): Path to the folder.
@@ -203,10 +597,22 @@ class MediaConverter:
             list: List of image file paths.
         """
         image_paths = []
+        extensions = tuple(f".{frame_format}" for frame_format in self.FRAME_FORMATS)
         if os.path.exists(folder_path):
             for filename in natsorted(os.listdir(folder_path)):
-                if filename.lower().endswith(".jpg"):
+                if filename.lower().endswith(extensions):
                     image_path = os.path.join(folder_path, filename)
                     image_paths.append(image_path)
 
         return image_paths
+
+    def _get_file_size(self, file_path):
+        """
+        Returns the size of a file for the metrics, 0 when metrics are disabled or the file is missing.
+        """
+        if not self.instrumentation.enabled:
+            return 0
+        try:
+            return os.path.getsize(file_path)
+        except OSError:
+            return 0
@@ -0,0 +1,236 @@
+import collections
+import json
+import os
+import pickle
+import re
+import time
+import sklearn
+
+
+class ModelRegistry:
+    """
+    A class to persist fitted detection models per source, e.g. per camera, in versioned files.
+
+    Every save of a source writes a new version, a pickled model next to a small JSON file holding
+    the feature extractor config it was fitted with. The JSON file is checked before the model is
+    unpickled, so a model is never used on features of another extractor. Loaded models are kept
+    in memory, the least recently used ones are dropped past max_models_in_memory.
+    """
+
+    FORMAT_VERSION = 1
+
+    def __init__(self, model_dir="models", max_models_in_memory=16) -> None:
+        """
+        Initializes the ModelRegistry.
+
+        Args:
+            model_dir (str, optional): Directory holding one subdirectory of model versions per source. Defaults to "models".
+            max_models_in_memory (int, optional): Maximum number of loaded models kept in memory. Defaults to 16.
+        """
+        self.model_dir = model_dir
+        self.max_models_in_memory = max_models_in_memory
+        self.models = collections.OrderedDict()
+
+        if not os.path.exists(model_dir):
+            os.makedirs(model_dir, exist_ok=True)
+
+    def log(self, message):
+        """
+        Logs a message with the class name.
+
+        Args:
+            message (str): The message to log.
+        """
+        print(f"{self.__class__.__name__}: {message}")
+
+    def get_versions(self, source):
+        """
+        Lists the saved versions of the model of a source.
+
+        Args:
+            source (str): The source, e.g. a camera identifier.
+
+        Returns:
+            list: The version numbers, in increasing order.
+        """
+        source_dir = self._get_source_dir(source)
+        if not os.path.isdir(source_dir):
+            return []
+
+        versions = []
+        for filename in os.listdir(source_dir):
+            match = re.fullmatch(r"v(\d+)\.json", filename)
+            if match:
+                versions.append(int(match.group(1)))
+        return sorted(versions)
+
+    def get_latest_version(self, source):
+        """
+        Returns the latest saved version of the model of a source.
+
+        Args:
+            source (str): The source.
+
+        Returns:
+            int: The version number, None when no model was saved.
+        """
+        versions = self.get_versions(source)
+        return versions[-1] if versions else None
+
+    def get_metadata(self, source, version=None):
+        """
+        Reads the metadata of a saved model.
+
+        Args:
+            source (str): The source.
+            version (int, optional): The version. Defaults to the latest version.
+
+        Returns:
+            dict: The metadata, None when there is no such model.
+        """
+        version = self.get_latest_version(source) if version is None else version
+        if version is None:
+            return None
+
+        try:
+            with open(self._get_metadata_path(source, version)) as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return None
+
+    def save(self, source, model, feature_extractor, metadata=None):
+        """
+        Saves a fitted model as the new latest version of a source.
+
+        Args:
+            source (str): The source.
+            model (object): The fitted model, e.g. an IsolationForest.
+            feature_extractor (FeatureExtractor): The extractor of the features the model was fitted on.
+            metadata (dict, optional): Additional JSON serializable information, e.g. the frame count. Defaults to None.
+
+        Returns:
+            int: The version of the saved model.
+        """
+        source_dir = self._get_source_dir(source)
+        if not os.path.exists(source_dir):
+            os.makedirs(source_dir, exist_ok=True)
+
+        version = (self.get_latest_version(source) or 0) + 1
+        model_path = self._get_model_path(source, version)
+
+        # The model is written first, a version only exists once its metadata is in place
+        temporary_path = f"{model_path}.{os.getpid()}.tmp"
+        with open(temporary_path, "wb") as file:
+            pickle.dump(model, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary_path, model_path)
+
+        model_metadata = {
+            "format_version": self.FORMAT_VERSION,
+            "source": source,
+            "version": version,
+            "model": model.__class__.__name__,
+            "extractor": feature_extractor.get_config(),
+            "sklearn_version": sklearn.__version__,
+            "created": time.time(),
+            **(metadata or {}),
+        }
+        metadata_path = self._get_metadata_path(source, version)
+        temporary_path = f"{metadata_path}.{os.getpid()}.tmp"
+        with open(temporary_path, "w") as file:
+            json.dump(model_metadata, file, indent=2)
+        os.replace(temporary_path, metadata_path)
+
+        self._remember(source, version, model, model_metadata)
+        self.log(f"Saved model {source} v{version}")
+        return version
+
+    def load(self, source, feature_extractor=None, version=None):
+        """
+        Loads the model of a source, from memory when it was loaded or saved before.
+
+        Models are shared, a model must be copied before it is changed, e.g. by a warm start.
+
+        Args:
+            source (str): The source.
+            feature_extractor (FeatureExtractor, optional): The extractor of the features to score,
+                checked against the one the model was fitted with. Defaults to None, no check.
+            version (int, optional): The version. Defaults to the latest version.
+
+        Returns:
+            object: The model, None when no model was saved for the source.
+        """
+        version = self.get_latest_version(source) if version is None else version
+        if version is None:
+            return None
+
+        key = (source, version)
+        if key in self.models:
+            self.models.move_to_end(key)
+            model, metadata = self.models[key]
+            self._check_extractor(metadata, feature_extractor)
+            return model
+
+        metadata = self.get_metadata(source, version)
+        if metadata is None:
+            raise FileNotFoundError(f"No model {source} v{version}")
+        if metadata.get("format_version") != self.FORMAT_VERSION:
+            raise ValueError(
+                f"Model {source} v{version} has format version "
+                f"{metadata.get('format_version')}, expected {self.FORMAT_VERSION}"
+            )
+        self._check_extractor(metadata, feature_extractor)
+
+        if metadata["sklearn_version"] != sklearn.__version__:
+            self.log(
+                f"Model {source} v{version} was saved with scikit-learn "
+                f"{metadata['sklearn_version']}, running {sklearn.__version__}"
+            )
+        with open(self._get_model_path(source, version), "rb") as file:
+            model = pickle.load(file)
+
+        self._remember(source, version, model, metadata)
+        self.log(f"Loaded model {source} v{version}")
+        return model
+
+    def forget(self, source=None):
+        """
+        Drops loaded models from memory, the saved files are kept.
+
+        Args:
+            source (str, optional): Only drop the models of this source. Defaults to all sources.
+        """
+        for key in list(self.models):
+            if source is None or key[0] == source:
+                del self.models[key]
+
+    def _check_extractor(self, metadata, feature_extractor):
+        """
+        Checks that a model was fitted on features of the given extractor, when there is one.
+        """
+        if (
+            feature_extractor is not None
+            and metadata["extractor"] != feature_extractor.get_config()
+        ):
+            raise ValueError(
+                f"Model {metadata['source']} v{metadata['version']} was fitted on features "
+                f"of {metadata['extractor']}, not {feature_extractor.get_config()}"
+            )
+
+    def _remember(self, source, version, model, metadata):
+        """
+        Keeps a model and its metadata in memory, dropping the least recently used ones past the limit.
+        """
+        self.models[(source, version)] = (model, metadata)
+        self.models.move_to_end((source, version))
+        while len(self.models) > self.max_models_in_memory:
+            self.models.popitem(last=False)
+
+    def _get_source_dir(self, source):
+        # Any character that could escape the model directory is replaced
+        return os.path.join(self.model_dir, re.sub(r"[^A-Za-z0-9_-]", "_", source))
+
+    def _get_model_path(self, source, version):
+        return os.path.join(self._get_source_dir(source), f"v{version:04d}.pkl")
+
+    def _get_metadata_path(self, source, version):
+        return os.path.join(self._get_source_dir(source), f"v{version:04d}.json")
@@ -0,0 +1,427 @@
+import cv2
+import numpy as np
+from helpers.Instrumentation import Instrumentation
+
+
+class MultiResolutionAttackDetector:
+    """
+    A class to triage a stream of frames on a decimated tile grid and escalate suspicious tiles.
+
+    The frame is split into square tiles and every tile is scored by its high-frequency energy,
+    a low quantile of the absolute Laplacian, against a running mean and deviation of that tile
+    in clean frames. Edges of moving objects only cover a small part of a tile and leave the
+    quantile alone, while the per-pixel noise of an attack raises it. Each level of the
+    resolution pyramid is a decimation factor: the first level only reads every factor-th pixel
+    of every factor-th row, and only the tiles scoring above its escalation threshold are scored
+    again at the next, finer level. A tile is attacked when its score at the last level is above
+    the attack threshold, so localized attacks are found and located without scanning every
+    pixel of every frame.
+
+    Frames are decimated rather than averaged, averaging would cancel the per-pixel noise of an
+    attack. Every reference_interval-th frame is scored at every level on every tile to keep the
+    statistics of the finer levels up to date. A tile staying above its threshold for
+    adaptation_frames frames in a row is taken as a lasting change of the scene and followed.
+    """
+
+    def __init__(
+        self,
+        pyramid=(4, 1),
+        escalation_thresholds=(2.0,),
+        attack_threshold=4.0,
+        tile_size=64,
+        warmup_frames=10,
+        reference_interval=10,
+        smoothing=0.05,
+        min_deviation_ratio=0.05,
+        min_deviation=2.0,
+        energy_quantile=0.1,
+        adaptation_frames=30,
+        instrumentation=None,
+    ) -> None:
+        """
+        Initializes the MultiResolutionAttackDetector.
+
+        Args:
+            pyramid (tuple, optional): Decimation factors from the coarsest to the finest level,
+                1 is full resolution. Defaults to (4, 1).
+            escalation_thresholds (tuple, optional): Score above which a tile of a level is scored
+                again at the next level, one per level but the last. Defaults to (2.0,).
+            attack_threshold (float, optional): Score above which a tile of the last level is
+                attacked. Defaults to 4.0.
+            tile_size (int, optional): Side of the tiles in full resolution pixels, a multiple of
+                every decimation factor. Defaults to 64.
+            warmup_frames (int, optional): Number of frames scored at every level to build the
+                statistics, these frames are never flagged. Defaults to 10.
+            reference_interval (int, optional): Number of frames between two frames scored at
+                every level on every tile. Defaults to 10.
+            smoothing (float, optional): Weight of a new clean frame in the running statistics. Defaults to 0.05.
+            min_deviation_ratio (float, optional): Lower bound of the deviation relative to the mean
+                energy of a tile. Defaults to 0.05.
+            min_deviation (float, optional): Lower bound of the deviation, flat tiles have an energy
+                close to 0. Defaults to 2.0.
+            energy_quantile (float, optional): Quantile of the absolute Laplacian of a tile taken as
+                its energy. Defaults to 0.1.
+            adaptation_frames (int, optional): Number of frames in a row a tile is above its
+                threshold before its statistics follow it. Defaults to 30.
+            instrumentation (Instrumentation, optional): Records the number of escalated tiles.
+                Defaults to the shared instance.
+        """
+        pyramid = tuple(int(factor) for factor in pyramid)
+        escalation_thresholds = tuple(escalation_thresholds)
+        if not pyramid or min(pyramid) < 1:
+            raise ValueError("pyramid must hold decimation factors of at least 1")
+        if len(escalation_thresholds) != len(pyramid) - 1:
+            raise ValueError(
+                f"{len(pyramid)} pyramid levels need {len(pyramid) - 1} escalation "
+                f"thresholds, got {len(escalation_thresholds)}"
+            )
+        if not 0 <= energy_quantile <= 1:
+            raise ValueError("energy_quantile must be in [0, 1]")
+        if any(tile_size % factor for factor in pyramid):
+            raise ValueError(
+                f"tile_size {tile_size} must be a multiple of every factor of {pyramid}"
+            )
+
+        self.pyramid = pyramid
+        self.thresholds = escalation_thresholds + (attack_threshold,)
+        self.attack_threshold = attack_threshold
+        self.tile_size = tile_size
+        self.warmup_frames = warmup_frames
+        self.reference_interval = reference_interval
+        self.smoothing = smoothing
+        self.min_deviation_ratio = min_deviation_ratio
+        self.min_deviation = min_deviation
+        self.energy_quantile = energy_quantile
+        self.adaptation_frames = adaptation_frames
+        self.instrumentation = instrumentation or Instrumentation.get_default()
+        self.reset()
+
+    def log(self, message):
+        """
+        Logs a message with the class name.
+
+        Args:
+            message (str): The message to log.
+        """
+        print(f"{self.__class__.__name__}: {message}")
+
+    def newLine(self):
+        """
+        Prints a new line.
+        """
+        print("\n")
+
+    def reset(self):
+        """
+        Forgets the tile statistics, e.g. before a new video.
+        """
+        self.frame_shape = None
+        self.energy_means = None
+        self.energy_variances = None
+        self.energy_counts = None
+        self.exceedances = None
+        self.frames_seen = 0
+        self.tile_scores = None
+        self.attacked_tiles = []
+
+    @property
+    def grid_shape(self):
+        """
+        tuple: Number of tile rows and columns, None before the first frame.
+        """
+        if self.frame_shape is None:
+            return None
+        height, width = self.frame_shape[:2]
+        return -(-height // self.tile_size), -(-width // self.tile_size)
+
+    def get_tile_rectangle(self, tile):
+        """
+        Returns the region of a tile in full resolution pixels.
+
+        Args:
+            tile (tuple): Row and column of the tile.
+
+        Returns:
+            tuple: (x, y, width, height) of the tile, clipped to the frame.
+        """
+        row, column = tile
+        height, width = self.frame_shape[:2]
+        top, left = row * self.tile_size, column * self.tile_size
+        return (
+            left,
+            top,
+            min(self.tile_size, width - left),
+            min(self.tile_size, height - top),
+        )
+
+    def get_tile_energies(self, frame, factor, tiles=None):
+        """
+        Computes the energy quantile of the absolute Laplacian of tiles of a decimated frame.
+
+        Args:
+            frame (np.ndarray): The (H, W) or (H, W, C) uint8 frame.
+            factor (int): Decimation factor, only every factor-th pixel is read.
+            tiles (np.ndarray, optional): Boolean (rows, columns) mask of the tiles to compute. Defaults to all tiles.
+
+        Returns:
+            np.ndarray: Energy of each tile as a (rows, columns) array, NaN for tiles not computed.
+        """
+        if tiles is None:
+            laplacian = self._get_absolute_laplacian(frame[::factor, ::factor])
+            step = self.tile_size // factor
+            row_starts = np.arange(0, laplacian.shape[0], step)
+            column_starts = np.arange(0, laplacian.shape[1], step)
+            energies = np.empty((len(row_starts), len(column_starts)))
+
+            # Whole tiles are computed at once, the clipped ones of the last row and column one by one
+            full_rows = laplacian.shape[0] // step
+            full_columns = laplacian.shape[1] // step
+            if full_rows and full_columns:
+                blocks = (
+                    laplacian[: full_rows * step, : full_columns * step]
+                    .reshape(full_rows, step, full_columns, step)
+                    .swapaxes(1, 2)
+                    .reshape(full_rows, full_columns, step * step)
+                )
+                energies[:full_rows, :full_columns] = self._get_quantile(blocks)
+            for row, row_start in enumerate(row_starts):
+                for column, column_start in enumerate(column_starts):
+                    if row >= full_rows or column >= full_columns:
+                        energies[row, column] = self._get_quantile(
+                            laplacian[
+                                row_start : row_start + step,
+                                column_start : column_start + step,
+                            ].ravel()
+                        )
+            return energies
+
+        energies = np.full(self.grid_shape, np.nan)
+        height, width = frame.shape[:2]
+        for row, column in zip(*np.nonzero(tiles)):
+            left, top, tile_width, tile_height = self.get_tile_rectangle((row, column))
+
+            # One decimated pixel of margin keeps the Laplacian of the tile edges identical
+            # to the one of the whole frame
+            margin_top = factor if top > 0 else 0
+            margin_left = factor if left > 0 else 0
+            region = frame[
+                top - margin_top : min(top + tile_height + factor, height) : factor,
+                left - margin_left : min(left + tile_width + factor, width) : factor,
+            ]
+            rows = -(-tile_height // factor)
+            columns = -(-tile_width // factor)
+            laplacian = self._get_absolute_laplacian(region)[
+                margin_top // factor : margin_top // factor + rows,
+                margin_left // factor : margin_left // factor + columns,
+            ]
+            energies[row, column] = self._get_quantile(laplacian.ravel())
+        return energies
+
+    def get_tile_scores(self, energies, level):
+        """
+        Returns how many deviations tile energies are above the running mean of their tile.
+
+        Args:
+            energies (np.ndarray): Energy of each tile, NaN for tiles not computed.
+            level (int): Index of the pyramid level of the energies.
+
+        Returns:
+            np.ndarray: Score of each tile, NaN for tiles not computed.
+        """
+        return (energies - self.energy_means[level]) / self._get_deviations(level)
+
+    def update(self, frame):
+        """
+        Scores a new frame, escalating its suspicious tiles through the pyramid.
+
+        The scores of the tiles, at the finest level each of them reached, are kept in
+        tile_scores and the attacked tiles in attacked_tiles.
+
+        Args:
+            frame (np.ndarray): The new frame.
+
+        Returns:
+            tuple: A tuple containing a boolean indicating whether the frame is attacked and its
+                   score, the highest tile score, None while warming up.
+        """
+        frame = np.asarray(frame)
+        if self.frame_shape is None:
+            self._start(frame.shape)
+        elif frame.shape != self.frame_shape:
+            raise ValueError(
+                f"Frame {self.frames_seen} has shape {frame.shape}, "
+                f"expected {self.frame_shape}"
+            )
+        self.frames_seen += 1
+
+        warming_up = self.frames_seen <= self.warmup_frames
+        reference = warming_up or self.frames_seen % self.reference_interval == 0
+
+        level_energies = []
+        tile_scores = None
+        suspicious = None
+        escalated_tiles = 0
+        for level, factor in enumerate(self.pyramid):
+            if level > 0 and not reference:
+                if not suspicious.any():
+                    break
+                escalated_tiles += int(suspicious.sum())
+                energies = self.get_tile_energies(frame, factor, tiles=suspicious)
+            else:
+                energies = self.get_tile_energies(frame, factor)
+            level_energies.append(energies)
+
+            scores = self.get_tile_scores(energies, level)
+            computed = ~np.isnan(scores)
+            tile_scores = (
+                scores
+                if tile_scores is None
+                else np.where(computed, scores, tile_scores)
+            )
+
+            above = computed & (scores > self.thresholds[level])
+            suspicious = above if suspicious is None else suspicious & above
+
+        if escalated_tiles:
+            self.instrumentation.gauge(
+                "MultiResolutionAttackDetector.escalated_tiles", escalated_tiles
+            )
+
+        reached_last_level = len(level_energies) == len(self.pyramid)
+        if warming_up or not reached_last_level:
+            attacked_tiles = np.zeros(self.grid_shape, dtype=bool)
+        else:
+            attacked_tiles = suspicious
+
+        self.tile_scores = tile_scores
+        self.attacked_tiles = [
+            (int(row), int(column)) for row, column in np.argwhere(attacked_tiles)
+        ]
+        attacked = bool(attacked_tiles.any())
+
+        self._update_statistics(level_energies, warming_up)
+
+        if warming_up:
+            return False, None
+        return attacked, float(np.max(tile_scores))
+
+    def detect_attack_from_stream(self, frames):
+        """
+        Scores every frame of a stream as it arrives.
+
+        Args:
+            frames (iterable): Frames (as numpy arrays), e.g. a video stream or a live feed.
+
+        Yields:
+            tuple: (index, attacked, score) for each frame.
+        """
+        self.reset()
+        for index, frame in enumerate(frames):
+            attacked, score = self.update(frame)
+            yield index, attacked, score
+
+    def detect_tiles_from_stream(self, frames):
+        """
+        Scores every frame of a stream as it arrives and locates the attacked regions.
+
+        Args:
+            frames (iterable): Frames (as numpy arrays), e.g. a video stream or a live feed.
+
+        Yields:
+            tuple: (index, attacked, score, rectangles) for each frame, rectangles being the
+                   (x, y, width, height) of the attacked tiles.
+        """
+        self.reset()
+        for index, frame in enumerate(frames):
+            attacked, score = self.update(frame)
+            rectangles = [self.get_tile_rectangle(tile) for tile in self.attacked_tiles]
+            yield index, attacked, score, rectangles
+
+    def close(self):
+        """
+        Releases the tile statistics, the detector holds no other resources.
+        """
+        self.reset()
+
+    def _start(self, frame_shape):
+        """
+        Allocates the tile statistics of every level for frames of the given shape.
+        """
+        self.frame_shape = frame_shape
+        shape = (len(self.pyramid), *self.grid_shape)
+        self.energy_means = np.zeros(shape)
+        self.energy_variances = np.zeros(shape)
+        self.energy_counts = np.zeros(shape, dtype=np.int64)
+        self.exceedances = np.zeros(shape, dtype=np.int64)
+
+    def _get_deviations(self, level):
+        """
+        Returns the deviation of the energy of every tile of a level, bounded away from zero.
+        """
+        deviations = np.maximum(
+            np.sqrt(self.energy_variances[level]),
+            self.min_deviation_ratio * self.energy_means[level],
+        )
+        return np.maximum(deviations, max(self.min_deviation, np.finfo(np.float64).eps))
+
+    def _get_quantile(self, values):
+        """
+        Returns the energy quantile of the last axis of the values.
+        """
+        position = int(self.energy_quantile * (values.shape[-1] - 1))
+        return np.partition(values, position, axis=-1)[..., position]
+
+    def _get_absolute_laplacian(self, frame):
+        """
+        Computes the absolute Laplacian of a frame summed over its channels.
+        """
+        laplacian = np.abs(cv2.Laplacian(frame, cv2.CV_16S, ksize=1))
+        if laplacian.ndim == 2:
+            return laplacian
+
+        # At most 4 * 255 per channel, the sum of a few channels still fits in 16 bits
+        absolute_sum = laplacian[..., 0].copy()
+        for channel in range(1, laplacian.shape[2]):
+            absolute_sum += laplacian[..., channel]
+        return absolute_sum
+
+    def _update_statistics(self, level_energies, warming_up):
+        """
+        Adds the energies of the tiles of a frame to the exponentially weighted statistics.
+
+        After the warm-up, tiles above the threshold of their level only move the mean by as much
+        as a tile at the threshold and leave the variance alone, so an attack barely raises its
+        own baseline while slow changes of the scene are still followed. Once a tile has been
+        above its threshold for adaptation_frames frames in a row, it is updated in full again
+        so that a lasting change of the scene becomes the new baseline.
+        """
+        for level, energies in enumerate(level_energies):
+            tiles = ~np.isnan(energies)
+            if not tiles.any():
+                continue
+
+            counts = self.energy_counts[level]
+            means = self.energy_means[level]
+            variances = self.energy_variances[level]
+            exceedances = self.exceedances[level]
+
+            differences = energies[tiles] - means[tiles]
+            within = np.ones(differences.shape, dtype=bool)
+            if not warming_up:
+                limits = self.thresholds[level] * self._get_deviations(level)[tiles]
+                within = differences <= limits
+                exceedances[tiles] = np.where(within, 0, exceedances[tiles] + 1)
+                within |= exceedances[tiles] >= self.adaptation_frames
+                differences = np.where(
+                    within, differences, np.minimum(differences, limits)
+                )
+
+            counts[tiles] += 1
+            weights = np.maximum(self.smoothing, 1.0 / counts[tiles])
+            means[tiles] += weights * differences
+            variances[tiles] = np.where(
+                within,
+                (1 - weights)
+                * (variances[tiles] + weights * differences * differences),
+                variances[tiles],
+            )
@@ -0,0 +1,169 @@
+import warnings
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+class ScoreThresholder:
+    """
+    A class to turn per-frame anomaly scores into attack verdicts with vectorized thresholds.
+
+    Thresholds only need the scores, so they can be tuned again on the scores of a previous
+    run without refitting a model or reading frames. Scores are anomalous when low by default,
+    as Isolation Forest decision scores, set higher_is_anomalous for detectors whose scores grow
+    with the anomaly. Frames whose score is NaN, e.g. while a detector warms up, are never flagged.
+    """
+
+    METHODS = ("fixed", "percentile", "rolling", "hysteresis")
+
+    # Scale turning the median absolute deviation into a standard deviation for normal data
+    MAD_SCALE = 1.4826
+
+    def __init__(self, higher_is_anomalous=False) -> None:
+        """
+        Initializes the ScoreThresholder.
+
+        Args:
+            higher_is_anomalous (bool, optional): Whether higher scores are more anomalous. Defaults to False.
+        """
+        self.higher_is_anomalous = higher_is_anomalous
+
+    def log(self, message):
+        """
+        Logs a message with the class name.
+
+        Args:
+            message (str): The message to log.
+        """
+        print(f"{self.__class__.__name__}: {message}")
+
+    def apply(self, scores, method="fixed", **parameters):
+        """
+        Thresholds scores with one of the METHODS.
+
+        Args:
+            scores (np.ndarray): The score of each frame.
+            method (str, optional): Name of the method. Defaults to "fixed".
+            **parameters: Parameters of the method.
+
+        Returns:
+            np.ndarray: Whether each frame is attacked.
+        """
+        if method not in self.METHODS:
+            raise ValueError(
+                f"Unknown threshold method {method!r}, expected one of {self.METHODS}"
+            )
+        return getattr(self, method)(scores, **parameters)
+
+    def fixed(self, scores, threshold=0.0):
+        """
+        Flags the frames whose score is beyond a fixed threshold.
+
+        Args:
+            scores (np.ndarray): The score of each frame.
+            threshold (float, optional): The threshold, in score units. Defaults to 0.0, the
+                decision boundary of Isolation Forest.
+
+        Returns:
+            np.ndarray: Whether each frame is attacked.
+        """
+        anomaly = self._to_anomaly(scores)
+        return self._beyond(anomaly, self._to_anomaly(threshold))
+
+    def percentile(self, scores, percentile=10.0):
+        """
+        Flags the given percentage of most anomalous frames.
+
+        Args:
+            scores (np.ndarray): The score of each frame.
+            percentile (float, optional): Percentage of frames to flag. Defaults to 10.0.
+
+        Returns:
+            np.ndarray: Whether each frame is attacked.
+        """
+        anomaly = self._to_anomaly(scores)
+        if np.isnan(anomaly).all():
+            return np.zeros(len(anomaly), dtype=bool)
+        threshold = np.nanpercentile(anomaly, 100 - percentile)
+        return self._beyond(anomaly, threshold, inclusive=True)
+
+    def rolling(self, scores, window=31, deviations=3.0):
+        """
+        Flags the frames whose score departs from the rolling median by more than a number of
+        robust deviations, estimated from the median absolute deviation of the window.
+
+        The window is centered on the frame, and shrinks at both ends of the video.
+
+        Args:
+            scores (np.ndarray): The score of each frame.
+            window (int, optional): Number of frames of the window, odd. Defaults to 31.
+            deviations (float, optional): Number of deviations beyond the median. Defaults to 3.0.
+
+        Returns:
+            np.ndarray: Whether each frame is attacked.
+        """
+        anomaly = self._to_anomaly(scores)
+        if len(anomaly) == 0:
+            return np.zeros(0, dtype=bool)
+
+        # Padding with NaN lets the ends use the part of the window inside the video
+        half = window // 2
+        padded = np.pad(anomaly, half, constant_values=np.nan)
+        windows = sliding_window_view(padded, 2 * half + 1)
+        # Windows holding only NaN values, e.g. during warmup, have no median
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)
+            medians = np.nanmedian(windows, axis=1)
+            mads = np.nanmedian(np.abs(windows - medians[:, np.newaxis]), axis=1)
+
+        spread = self.MAD_SCALE * mads
+        # A flat window has no spread, any departure from its median is then flagged
+        spread = np.where(spread > 0, spread, np.finfo(np.float64).eps)
+        return self._beyond(anomaly - medians, deviations * spread)
+
+    def hysteresis(self, scores, enter_threshold=0.0, exit_threshold=None):
+        """
+        Flags runs of frames that start beyond an enter threshold and last until the score comes
+        back past an exit threshold, so a run does not flicker around a single threshold.
+
+        Args:
+            scores (np.ndarray): The score of each frame.
+            enter_threshold (float, optional): Score starting a run, in score units. Defaults to 0.0.
+            exit_threshold (float, optional): Score ending a run, in score units, less anomalous
+                than the enter threshold. Defaults to the enter threshold.
+
+        Returns:
+            np.ndarray: Whether each frame is attacked.
+        """
+        anomaly = self._to_anomaly(scores)
+        enter = self._to_anomaly(enter_threshold)
+        exit = enter if exit_threshold is None else self._to_anomaly(exit_threshold)
+        if exit > enter:
+            raise ValueError(
+                "exit_threshold must not be more anomalous than enter_threshold"
+            )
+
+        starts = self._beyond(anomaly, enter)
+        ends = ~self._beyond(anomaly, exit, inclusive=True)
+
+        # Each frame takes the state set by the last start or end at or before it
+        events = np.flatnonzero(starts | ends)
+        last_event = np.full(len(anomaly), -1)
+        last_event[events] = events
+        last_event = np.maximum.accumulate(last_event)
+        return (last_event >= 0) & starts[np.maximum(last_event, 0)]
+
+    def _to_anomaly(self, scores):
+        """
+        Returns scores, or a threshold, as float values that grow with the anomaly.
+        """
+        anomaly = np.asarray(scores, dtype=np.float64)
+        return anomaly if self.higher_is_anomalous else -anomaly
+
+    def _beyond(self, anomaly, threshold, inclusive=False):
+        """
+        Returns whether anomaly values are beyond a threshold, NaN values never are.
+        """
+        with np.errstate(invalid="ignore"):
+            if inclusive:
+                return np.asarray(anomaly >= threshold)
+            return np.asarray(anomaly > threshold)
@@ -0,0 +1,245 @@
+import asyncio
+import concurrent.futures
+from helpers.Instrumentation import Instrumentation
+
+
+class Stage:
+    """
+    A stage of a StagePipeline, a function turning each item into the item of the next stage.
+    """
+
+    def __init__(self, name, function, workers=1, executor=None) -> None:
+        """
+        Initializes the Stage.
+
+        Args:
+            name (str): Name of the stage, used in the recorded metrics.
+            function (callable): Called with each item, returns the item passed to the next stage.
+            workers (int, optional): Number of items the stage processes at once, stages writing
+                to a shared sink must keep 1. Defaults to 1.
+            executor (concurrent.futures.Executor, optional): Runs the function, e.g. a process
+                pool for CPU-heavy stages. Defaults to the thread pool of the pipeline.
+        """
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
+
+        self.name = name
+        self.function = function
+        self.workers = workers
+        self.executor = executor
+
+
+class StagePipeline:
+    """
+    A class to run stages concurrently over a stream of items, e.g. chunks of frames, instead of
+    running each stage over the whole stream before the next one starts.
+
+    Every stage runs as an asyncio task, connected to the next one by a bounded queue. The
+    stage functions and the iteration of the source run on executors, so the event loop only
+    schedules work while decoding, attacking, detecting and encoding overlap. A full queue
+    blocks the stage feeding it, which caps the items in memory at about queue_size plus the
+    workers of each stage, and the throughput approaches the one of the slowest stage.
+
+    Items leave every stage in the order of the source, also when a stage processes several
+    items at once, so a stage writing a video receives its frames in order.
+    """
+
+    def __init__(self, queue_size=2, max_workers=None, instrumentation=None) -> None:
+        """
+        Initializes the StagePipeline.
+
+        Args:
+            queue_size (int, optional): Number of items waiting between two stages. Defaults to 2.
+            max_workers (int, optional): Number of threads of the default executor. Defaults to
+                the number of stage workers plus one for the source.
+            instrumentation (Instrumentation, optional): Records the time of each stage and the
+                depth of the queues. Defaults to the shared instance.
+        """
+        if queue_size < 1:
+            raise ValueError("queue_size must be at least 1")
+
+        self.queue_size = queue_size
+        self.max_workers = max_workers
+        self.instrumentation = instrumentation or Instrumentation.get_default()
+        self.stages = []
+
+    def log(self, message):
+        """
+        Logs a message with the class name.
+
+        Args:
+            message (str): The message to log.
+        """
+        print(f"{self.__class__.__name__}: {message}")
+
+    def add_stage(self, name, function, workers=1, executor=None):
+        """
+        Appends a stage to the pipeline.
+
+        Args:
+            name (str): Name of the stage.
+            function (callable): Called with each item, returns the item passed to the next stage.
+            workers (int, optional): Number of items the stage processes at once. Defaults to 1.
+            executor (concurrent.futures.Executor, optional): Runs the function. Defaults to the
+                thread pool of the pipeline.
+
+        Returns:
+            StagePipeline: The pipeline, so stages can be chained.
+        """
+        self.stages.append(Stage(name, function, workers, executor))
+        return self
+
+    def run(self, source, collect=True):
+        """
+        Runs every item of the source through the stages.
+
+        Args:
+            source (iterable): The items, e.g. the chunks of MediaConverter.stream_video_frames.
+            collect (bool, optional): Whether to keep the items returned by the last stage. A last
+                stage writing its items away should not, the kept items grow with the source.
+                Defaults to True.
+
+        Returns:
+            list: The items returned by the last stage, in the order of the source, None when
+                  they are not collected.
+        """
+        return asyncio.run(self.run_async(source, collect))
+
+    async def run_async(self, source, collect=True):
+        """
+        Runs every item of the source through the stages in the running event loop.
+
+        The first error of a stage cancels the other stages and is raised.
+
+        Args:
+            source (iterable): The items.
+            collect (bool, optional): Whether to keep the items returned by the last stage.
+                Defaults to True.
+
+        Returns:
+            list: The items returned by the last stage, in the order of the source, None when
+                  they are not collected.
+        """
+        max_workers = self.max_workers or (
+            sum(stage.workers for stage in self.stages) + 1
+        )
+        thread_pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers, thread_name_prefix="StagePipeline"
+        )
+        queues = [asyncio.Queue(self.queue_size) for _ in range(len(self.stages) + 1)]
+        results = [] if collect else None
+
+        tasks = [asyncio.ensure_future(self._feed(source, queues[0], thread_pool))]
+        for stage, input_queue, output_queue in zip(self.stages, queues, queues[1:]):
+            tasks.append(
+                asyncio.ensure_future(
+                    self._run_stage(
+                        stage,
+                        stage.executor or thread_pool,
+                        input_queue,
+                        output_queue,
+                    )
+                )
+            )
+        tasks.append(asyncio.ensure_future(self._collect(queues[-1], results)))
+
+        try:
+            with self.instrumentation.span(
+                "StagePipeline.run", stages=len(self.stages)
+            ):
+                await asyncio.gather(*tasks)
+        finally:
+            # Items still waiting in the queues after an error are cancelled along with the stages
+            for queue in queues:
+                while not queue.empty():
+                    pending_item = queue.get_nowait()
+                    if pending_item is not _END:
+                        tasks.append(pending_item)
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            # Threads still blocked in a cancelled call finish it in the background
+            thread_pool.shutdown(wait=False, cancel_futures=True)
+
+        return results
+
+    async def _feed(self, source, queue, executor):
+        """
+        Puts the items of the source in the first queue, iterating it on the executor since
+        producing an item, e.g. decoding frames, blocks.
+        """
+        loop = asyncio.get_running_loop()
+        iterator = iter(source)
+        while True:
+            item = await loop.run_in_executor(executor, next, iterator, _END)
+            if item is _END:
+                break
+            future = loop.create_future()
+            future.set_result(item)
+            await queue.put(future)
+        await queue.put(_END)
+
+    async def _run_stage(self, stage, executor, input_queue, output_queue):
+        """
+        Starts the function of a stage on each item once the previous stage produced it, and
+        passes the pending results on in order.
+        """
+        loop = asyncio.get_running_loop()
+        slots = asyncio.Semaphore(stage.workers)
+        while True:
+            pending_item = await input_queue.get()
+            if pending_item is _END:
+                await output_queue.put(_END)
+                return
+
+            item = await pending_item
+            await slots.acquire()
+            task = loop.create_task(self._call(stage, executor, item, slots))
+
+            # Blocks while the next stage is behind, this is the backpressure
+            await output_queue.put(task)
+            self.instrumentation.gauge(
+                f"StagePipeline.{stage.name}.queue_depth", output_queue.qsize()
+            )
+
+    async def _call(self, stage, executor, item, slots):
+        """
+        Runs the function of a stage on an item on its executor.
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(
+                executor,
+                _call_timed,
+                self.instrumentation,
+                f"StagePipeline.{stage.name}",
+                stage.function,
+                item,
+            )
+        finally:
+            slots.release()
+
+    async def _collect(self, queue, results):
+        """
+        Gathers the items of the last stage in order, or only waits for them when results is None.
+        """
+        while True:
+            pending_item = await queue.get()
+            if pending_item is _END:
+                return
+            item = await pending_item
+            if results is not None:
+                results.append(item)
+
+
+def _call_timed(instrumentation, name, function, item):
+    """
+    Runs a stage function in the executor thread or process, so the span measures the CPU time
+    of the function and not the one of the event loop.
+    """
+    with instrumentation.span(name, emit=False):
+        return function(item)
+
+
+# Marks the end of the stream in the queues
+_END = object()
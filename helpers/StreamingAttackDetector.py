@@ -0,0 +1,164 @@
+import collections
+import concurrent.futures
+import numpy as np
+from sklearn.ensemble import IsolationForest
+from helpers.FeatureExtractor import ThumbnailFeatureExtractor
+
+
+class StreamingAttackDetector:
+    """
+    A class to detect adversarial attacks on a live stream of frames using Isolation Forest.
+
+    Frames are scored as they arrive against a model fitted on a sliding window of recent
+    clean frames. The model is refreshed periodically in a background thread, so scoring a
+    frame never waits for a refit.
+    """
+
+    def __init__(
+        self,
+        contamination=0.1,
+        window_size=300,
+        refit_interval=60,
+        warmup_frames=30,
+        feature_extractor=None,
+    ) -> None:
+        """
+        Initializes the StreamingAttackDetector.
+
+        Args:
+            contamination (float, optional): The proportion of outliers in the data set. Defaults to 0.1.
+            window_size (int, optional): Number of recent clean frames the model is fitted on. Defaults to 300.
+            refit_interval (int, optional): Number of scored frames between two refits of the model. Defaults to 60.
+            warmup_frames (int, optional): Number of frames collected before the first fit, these
+                frames are never flagged. Defaults to 30.
+            feature_extractor (FeatureExtractor, optional): Turns frames into feature vectors.
+                Defaults to a ThumbnailFeatureExtractor of 32x18 pixels, cheap enough for live feeds.
+        """
+        if warmup_frames < 2:
+            raise ValueError("warmup_frames must be at least 2")
+
+        self.contamination = contamination
+        self.window_size = window_size
+        self.refit_interval = refit_interval
+        self.warmup_frames = warmup_frames
+        self.feature_extractor = feature_extractor or ThumbnailFeatureExtractor(
+            size=(32, 18)
+        )
+
+        self.reference_window = collections.deque(maxlen=window_size)
+        self.model = None
+        self.frames_seen = 0
+        self.frames_since_refit = 0
+        self.refit_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.pending_refit = None
+
+    def log(self, message):
+        """
+        Logs a message with the class name.
+
+        Args:
+            message (str): The message to log.
+        """
+        print(f"{self.__class__.__name__}: {message}")
+
+    def newLine(self):
+        """
+        Prints a new line.
+        """
+        print("\n")
+
+    def extract_features_from_frame(self, frame):
+        """
+        Extracts features from a frame with the configured feature extractor.
+
+        Args:
+            frame (np.ndarray): The frame.
+
+        Returns:
+            np.ndarray: The feature vector of the frame.
+        """
+        return self.feature_extractor.extract(frame)
+
+    def update(self, frame):
+        """
+        Scores a new frame and adds it to the reference window when it looks clean.
+
+        Args:
+            frame (np.ndarray): The new frame.
+
+        Returns:
+            tuple: A tuple containing a boolean indicating whether the frame is attacked and
+                   its anomaly score (negative for outliers), None while warming up.
+        """
+        features = self.extract_features_from_frame(frame)
+        self.frames_seen += 1
+        self._swap_refitted_model()
+
+        if self.model is None:
+            self.reference_window.append(features)
+            if len(self.reference_window) >= self.warmup_frames:
+                # The first model is fitted synchronously so scoring can start right away
+                self.model = self._fit(np.stack(self.reference_window))
+                self.log(f"Warm-up finished after {self.frames_seen} frames")
+            return False, None
+
+        score = float(self.model.decision_function(features[np.newaxis])[0])
+        attacked = score < 0
+
+        # Only clean frames are kept as reference so attacks do not poison the model
+        if not attacked:
+            self.reference_window.append(features)
+
+        self.frames_since_refit += 1
+        if (
+            self.frames_since_refit >= self.refit_interval
+            and self.pending_refit is None
+        ):
+            self.frames_since_refit = 0
+            self.pending_refit = self.refit_executor.submit(
+                self._fit, np.stack(self.reference_window)
+            )
+
+        return attacked, score
+
+    def detect_attack_from_stream(self, frames):
+        """
+        Scores every frame of a stream as it arrives.
+
+        Args:
+            frames (iterable): Frames (as numpy arrays), e.g. a video stream or a live feed.
+
+        Yields:
+            tuple: (index, attacked, score) for each frame.
+        """
+        for index, frame in enumerate(frames):
+            attacked, score = self.update(frame)
+            yield index, attacked, score
+
+    def close(self):
+        """
+        Stops the background refit thread.
+        """
+        self.refit_executor.shutdown(wait=False, cancel_futures=True)
+
+    def _fit(self, features):
+        """
+        Fits a new Isolation Forest on the given feature vectors.
+
+        Args:
+            features (np.ndarray): The reference feature vectors.
+
+        Returns:
+            IsolationForest: The fitted model.
+        """
+        model = IsolationForest(contamination=self.contamination, random_state=0)
+        model.fit(features)
+        return model
+
+    def _swap_refitted_model(self):
+        """
+        Replaces the current model with the refitted one once the background refit is done.
+        """
+        if self.pending_refit is not None and self.pending_refit.done():
+            self.model = self.pending_refit.result()
+            self.pending_refit = None
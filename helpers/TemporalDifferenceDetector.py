@@ -0,0 +1,240 @@
+import cv2
+import numpy as np
+
+
+class TemporalDifferenceDetector:
+    """
+    A class to detect adversarial attacks on a stream of frames from the residuals between neighbours.
+
+    Consecutive frames are highly correlated, so the high-frequency part of the difference between
+    two neighbouring frames is small and mostly zero, while per-pixel FGSM noise is neither. The
+    residual energy of two neighbours is the mean absolute difference of their Laplacians, it is
+    compared to a running mean and deviation of the energy of clean neighbours.
+
+    Noise added to a frame raises the residual with both of its neighbours, whereas a scene cut or
+    the clean frame after an attacked one only raises one of them. A frame is therefore scored by
+    the smaller of its two residual jumps and results come out one frame late. The Laplacian of
+    each frame is computed once, the state is the Laplacian of the previous frame and a few scalars,
+    no model is fitted and no clean twin of the video is needed.
+    """
+
+    def __init__(
+        self,
+        threshold=4.0,
+        smoothing=0.05,
+        warmup_frames=10,
+        min_deviation_ratio=0.02,
+    ) -> None:
+        """
+        Initializes the TemporalDifferenceDetector.
+
+        Args:
+            threshold (float, optional): Number of deviations above the mean residual energy for
+                a frame to be flagged. Defaults to 4.0.
+            smoothing (float, optional): Weight of a new clean residual in the running mean and
+                deviation of the energy. Defaults to 0.05.
+            warmup_frames (int, optional): Number of residuals collected before frames are scored,
+                these frames are never flagged. Defaults to 10.
+            min_deviation_ratio (float, optional): Lower bound of the deviation relative to the mean
+                energy, so a perfectly static scene does not flag every small change. Defaults to 0.02.
+        """
+        if warmup_frames < 1:
+            raise ValueError("warmup_frames must be at least 1")
+        if not 0 < smoothing <= 1:
+            raise ValueError("smoothing must be in (0, 1]")
+
+        self.threshold = threshold
+        self.smoothing = smoothing
+        self.warmup_frames = warmup_frames
+        self.min_deviation_ratio = min_deviation_ratio
+        self.reset()
+
+    def log(self, message):
+        """
+        Logs a message with the class name.
+
+        Args:
+            message (str): The message to log.
+        """
+        print(f"{self.__class__.__name__}: {message}")
+
+    def newLine(self):
+        """
+        Prints a new line.
+        """
+        print("\n")
+
+    def reset(self):
+        """
+        Forgets the previous frame and the energy statistics, e.g. before a new video.
+        """
+        self.previous_laplacian = None
+        self.previous_residual_score = None
+        self.energy_mean = 0.0
+        self.energy_variance = 0.0
+        self.clean_residuals = 0
+        self.frames_seen = 0
+
+    def get_laplacian(self, frame):
+        """
+        Computes the high-pass filtered frame.
+
+        Args:
+            frame (np.ndarray): The (H, W) or (H, W, C) uint8 frame.
+
+        Returns:
+            np.ndarray: The Laplacian of the frame as int16, of the shape of the frame.
+        """
+        return cv2.Laplacian(np.asarray(frame), cv2.CV_16S, ksize=1)
+
+    def get_residual_energy(self, laplacian, previous_laplacian):
+        """
+        Computes the mean absolute high-frequency residual between two neighbouring frames.
+
+        Args:
+            laplacian (np.ndarray): The Laplacian of the frame.
+            previous_laplacian (np.ndarray): The Laplacian of the previous frame.
+
+        Returns:
+            float: The residual energy.
+        """
+        return cv2.norm(laplacian, previous_laplacian, cv2.NORM_L1) / laplacian.size
+
+    def get_residual_score(self, energy):
+        """
+        Returns how many deviations a residual energy is above the running mean of clean residuals.
+
+        Args:
+            energy (float): The residual energy.
+
+        Returns:
+            float: The score, None while warming up.
+        """
+        if self.clean_residuals < self.warmup_frames:
+            return None
+
+        deviation = max(
+            np.sqrt(self.energy_variance),
+            self.min_deviation_ratio * self.energy_mean,
+            np.finfo(np.float64).eps,
+        )
+        return float((energy - self.energy_mean) / deviation)
+
+    def update(self, frame):
+        """
+        Adds a new frame and scores the previous one, which now has both of its neighbours.
+
+        Args:
+            frame (np.ndarray): The new frame.
+
+        Returns:
+            tuple: (index, attacked, score) of the previous frame, None for the first frame.
+                   The score is the number of deviations above the mean residual energy, None while warming up.
+        """
+        laplacian = self.get_laplacian(frame)
+        self.frames_seen += 1
+
+        if self.previous_laplacian is None:
+            self.previous_laplacian = laplacian
+            return None
+        if laplacian.shape != self.previous_laplacian.shape:
+            raise ValueError(
+                f"Frame {self.frames_seen - 1} has shape {laplacian.shape}, "
+                f"expected {self.previous_laplacian.shape}"
+            )
+
+        energy = self.get_residual_energy(laplacian, self.previous_laplacian)
+        residual_score = self.get_residual_score(energy)
+
+        # Jumps are left out of the statistics so attacks do not raise the baseline
+        if residual_score is None or residual_score <= self.threshold:
+            self._update_statistics(energy)
+
+        result = self._score_frame(
+            self.frames_seen - 2, self.previous_residual_score, residual_score
+        )
+        self.previous_laplacian = laplacian
+        self.previous_residual_score = residual_score
+        return result
+
+    def flush(self):
+        """
+        Scores the last frame from its residual with the previous frame only.
+
+        Returns:
+            tuple: (index, attacked, score) of the last frame, None when no frame was added.
+        """
+        if self.previous_laplacian is None:
+            return None
+
+        result = self._score_frame(
+            self.frames_seen - 1, self.previous_residual_score, None
+        )
+        self.reset()
+        return result
+
+    def detect_attack_from_stream(self, frames):
+        """
+        Scores every frame of a stream in one pass, each frame once its next frame has arrived.
+
+        Args:
+            frames (iterable): Frames (as numpy arrays), e.g. a video stream or a live feed.
+
+        Yields:
+            tuple: (index, attacked, score) for each frame, in order.
+        """
+        self.reset()
+        for frame in frames:
+            result = self.update(frame)
+            if result is not None:
+                yield result
+
+        result = self.flush()
+        if result is not None:
+            yield result
+
+    def close(self):
+        """
+        Releases the previous frame, the detector holds no other resources.
+        """
+        self.reset()
+
+    def _score_frame(self, index, previous_residual_score, next_residual_score):
+        """
+        Scores a frame from the residual scores with its previous and next frames.
+
+        Args:
+            index (int): Index of the frame.
+            previous_residual_score (float): Score of the residual with the previous frame, or None.
+            next_residual_score (float): Score of the residual with the next frame, or None.
+
+        Returns:
+            tuple: (index, attacked, score) of the frame.
+        """
+        scores = [
+            score
+            for score in (previous_residual_score, next_residual_score)
+            if score is not None
+        ]
+        if not scores:
+            return index, False, None
+
+        score = min(scores)
+        return index, score > self.threshold, score
+
+    def _update_statistics(self, energy):
+        """
+        Adds a clean residual energy to the exponentially weighted mean and variance.
+
+        The first residuals are averaged with equal weights, so the warm-up is not biased towards zero.
+
+        Args:
+            energy (float): The residual energy.
+        """
+        self.clean_residuals += 1
+        weight = max(self.smoothing, 1.0 / self.clean_residuals)
+        difference = energy - self.energy_mean
+        self.energy_mean += weight * difference
+        self.energy_variance = (1 - weight) * (
+            self.energy_variance + weight * difference * difference
+        )
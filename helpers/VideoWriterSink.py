@@ -0,0 +1,191 @@
+import cv2
+import os
+import threading
+from helpers.FrameStore import FrameStoreWriter
+from helpers.Instrumentation import Instrumentation
+
+
+class VideoWriterSink:
+    """
+    A class to write a video incrementally, frame by frame, as the frames become available.
+
+    Frames may be submitted out of order with their index, they are held in a reorder buffer
+    and written as soon as all of their predecessors have been written.
+    With the "raw" codec the frames are appended to a frame store instead of being encoded.
+    """
+
+    RAW_FOURCC = "raw"
+
+    def __init__(
+        self,
+        output_dir,
+        file_name,
+        fps=30,
+        fourcc="mp4v",
+        start_index=0,
+        instrumentation=None,
+    ):
+        """
+        Initializes the sink, the underlying video writer is opened on the first frame.
+
+        Args:
+            output_dir (str): Directory to save the output video.
+            file_name (str): Name of the output video file.
+            fps (float, optional): Frame rate of the output video. Defaults to 30.
+            fourcc (str, optional): Four character code of the video codec, or "raw" to write a frame store.
+                Defaults to "mp4v".
+            start_index (int, optional): Index of the first frame of the video. Defaults to 0.
+            instrumentation (Instrumentation, optional): Records write times and the reorder buffer depth.
+                Defaults to the shared instance.
+        """
+        self.output_dir = output_dir
+        self.file_name = file_name
+        self.fps = fps
+        self.fourcc = fourcc
+        self.next_index = start_index
+        self.frames_written = 0
+        self.pending_frames = {}
+        self.video = None
+        self.lock = threading.Lock()
+        self.instrumentation = instrumentation or Instrumentation.get_default()
+
+    def log(self, message):
+        """
+        Logs a message with the class name.
+
+        Args:
+            message (str): The message to log.
+        """
+        print(f"{self.__class__.__name__}: {message}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    @property
+    def pending_count(self):
+        """
+        int: Number of frames waiting in the reorder buffer for a predecessor.
+        """
+        return len(self.pending_frames)
+
+    def write(self, frame, index=None):
+        """
+        Submits a frame to the video.
+
+        Args:
+            frame (numpy.ndarray): The frame to write.
+            index (int, optional): Index of the frame in the video. Defaults to the index after
+                the last submitted frame.
+        """
+        with self.lock:
+            if index is None:
+                # Buffered frames may leave gaps, the frame follows the highest one
+                index = max(self.pending_frames, default=self.next_index - 1) + 1
+            if index < self.next_index or index in self.pending_frames:
+                raise ValueError(f"Frame {index} was already submitted")
+
+            self.pending_frames[index] = frame
+
+            # Flush every frame whose predecessors have all been written
+            while self.next_index in self.pending_frames:
+                self._write_frame(self.pending_frames.pop(self.next_index))
+                self.next_index += 1
+
+            self.instrumentation.gauge(
+                "VideoWriterSink.pending_frames", len(self.pending_frames)
+            )
+
+    def write_path(self, image_path, index=None):
+        """
+        Reads an image from disk and submits it to the video.
+
+        Args:
+            image_path (str): Path to the image.
+            index (int, optional): Index of the frame in the video. Defaults to the next index in order.
+        """
+        frame = cv2.imread(image_path)
+        if frame is None:
+            raise OSError(f"Could not read the image {image_path}")
+        self.write(frame, index=index)
+
+    def close(self):
+        """
+        Writes any frames left in the reorder buffer and releases the video.
+
+        Returns:
+            str: The name of the output video file.
+        """
+        with self.lock:
+            if self.pending_frames:
+                self.log(
+                    f"Missing frame {self.next_index}, "
+                    f"writing {len(self.pending_frames)} buffered frames in order"
+                )
+                for index in sorted(self.pending_frames):
+                    self._write_frame(self.pending_frames.pop(index))
+                    self.next_index = index + 1
+
+            if isinstance(self.video, FrameStoreWriter):
+                self.video.close()
+            elif self.video is not None:
+                self.video.release()
+                self.video = None
+
+        return self.file_name
+
+    def abort(self):
+        """
+        Drops the buffered frames and removes the partial video, e.g. after an error, so no
+        incomplete video is left behind.
+        """
+        with self.lock:
+            self.pending_frames.clear()
+            if isinstance(self.video, FrameStoreWriter):
+                self.video.discard()
+            elif self.video is not None:
+                self.video.release()
+                video_path = os.path.join(self.output_dir, self.file_name)
+                if os.path.exists(video_path):
+                    os.remove(video_path)
+            self.video = None
+
+    def _write_frame(self, frame):
+        """
+        Writes a frame to the video, opening the video writer on the first frame.
+
+        Args:
+            frame (numpy.ndarray): The frame to write.
+        """
+        if self.video is None:
+            if not os.path.exists(self.output_dir):
+                os.makedirs(self.output_dir, exist_ok=True)
+
+            video_path = os.path.join(self.output_dir, self.file_name)
+            if self.fourcc == self.RAW_FOURCC:
+                self.video = FrameStoreWriter(video_path, fps=self.fps)
+            else:
+                height, width = frame.shape[:2]
+                video = cv2.VideoWriter(
+                    video_path,
+                    cv2.VideoWriter_fourcc(*self.fourcc),
+                    self.fps,
+                    (width, height),
+                )
+                # OpenCV writes nothing, silently, when it has no encoder for the codec or container
+                if not video.isOpened():
+                    video.release()
+                    raise OSError(
+                        f"Could not open a {self.fourcc} video writer for {video_path}"
+                    )
+                self.video = video
+
+        with self.instrumentation.span("VideoWriterSink.write", emit=False) as span:
+            self.video.write(frame)
+            span.add(frames=1)
+        self.frames_written += 1
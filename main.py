@@ -1,27 +1,28 @@
+import contextlib
 import os
 import random
 import time
 import concurrent.futures
+import numpy as np
 from os import system
 from helpers.MediaConverter import MediaConverter
 from helpers.AdversarialAttack import AdversarialAttack
+from helpers.AttackSchedule import AttackSchedule
 from helpers.AttackDetector import AttackDetector
+from helpers.DetectionResults import DetectionResults
 from helpers.DataVisualizer import DataVisualizer
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_pdf import PdfPages
-
-# Clear the terminal screen
-system("clear")
+from helpers.DetectionReport import DetectionReport
+from helpers.FrameExecutor import FrameExecutor
+from helpers.FrameOverlay import FrameOverlay
+from helpers.StagePipeline import StagePipeline
 
 
 def process_frame(
     i: int,
     image_file_path: str,
-    disturbed_image_file_paths: list,
-    disturbed_decorated_image_file_paths: list,
-    actual_attack_indexes: list,
     media_converter: MediaConverter,
     adversarial_attack: AdversarialAttack,
+    attack_schedule: AttackSchedule,
 ):
     """
     Process each frame of the video, apply attacks if necessary, and decorate the images.
@@ -29,14 +30,13 @@ def process_frame(
     Args:
     - i: Index of the frame
     - image_file_path: Path of the original image
-    - disturbed_image_file_paths: List to store paths of disturbed images
-    - disturbed_decorated_image_file_paths: List to store paths of disturbed and decorated images
-    - actual_attack_indexes: List to store indexes of frames where attacks were applied
     - media_converter: Instance of the MediaConverter class
     - adverserial_attack: Instance of the AdverserialAttack class
+    - attack_schedule: Instance of the AttackSchedule class deciding which frames are attacked
 
     Returns:
-    - Tuple containing index, disturbed image file path, and disturbed decorated image file path
+    - Tuple containing index, disturbed image file path (the original path for clean frames),
+      disturbed decorated image file path and whether the frame was attacked
     """
     # Progress indicator
     if i % 50 == 0:
@@ -44,12 +44,13 @@ def process_frame(
     else:
         print(".", end="")
 
-    if i >= 50 and i <= 100:
+    if attack_schedule.is_attacked(i):
         # Apply adversarial attack
         disturbed_image_file_path = adversarial_attack.fgsm_attack(
             image_path=image_file_path,
-            epsilon=5,
+            epsilon=attack_schedule.epsilon,
             output_dir=disturbed_output_frames_dir,
+            rng=adversarial_attack.get_frame_rng(i),
         )
 
         # Decorate the disturbed image
@@ -60,15 +61,10 @@ def process_frame(
             count=i,
         )
 
-        disturbed_decorated_image_file_paths.append(disturbed_decorated_image_file_path)
-        disturbed_image_file_paths.append(disturbed_image_file_path)
-        actual_attack_indexes.append(i)
+        return i, disturbed_image_file_path, disturbed_decorated_image_file_path, True
     else:
-        # Copy and paste the original image
-        disturbed_image_file_path = media_converter.copy_and_paste_file(
-            original_filepath=image_file_path,
-            destination_directory=disturbed_output_frames_dir,
-        )
+        # Clean frames are not copied, the disturbed frame resolves to the original image
+        disturbed_image_file_path = image_file_path
 
         # Decorate the disturbed image
         disturbed_decorated_image_file_path = media_converter.decorate_image(
@@ -78,18 +74,14 @@ def process_frame(
             count=i,
         )
 
-        disturbed_decorated_image_file_paths.append(disturbed_decorated_image_file_path)
-        disturbed_image_file_paths.append(disturbed_image_file_path)
-
-    return i, disturbed_image_file_path, disturbed_decorated_image_file_path
+        return i, disturbed_image_file_path, disturbed_decorated_image_file_path, False
 
 
 def detect_attack(
     i: int,
     original_image_path: str,
     disturbed_image_path: str,
-    detected_attack_indexes: list,
-    generated_detection_file_paths: list,
+    detection_results: DetectionResults,
     media_converter: MediaConverter,
     attack_detector: AttackDetector,
 ):
@@ -100,8 +92,7 @@ def detect_attack(
     - i: Index of the frame
     - original_image_path: Path of the original image
     - disturbed_image_path: Path of the disturbed image
-    - detected_attack_indexes: List to store indexes of frames where attacks were detected
-    - generated_detection_file_paths: List to store paths of generated detection images
+    - detection_results: Results of every frame, this frame only writes its own slot
     - media_converter: Instance of the MediaConverter class
     - attack_detector: Instance of the AttackDetector class
     """
@@ -116,28 +107,298 @@ def detect_attack(
     else:
         print(".", end="")
 
-    if attacked:
-        # If attack detected, decorate the image in red
-        detected_attack_indexes.append(i)
-        file_path = media_converter.decorate_image(
-            image_path=disturbed_image_path,
-            output_dir=generated_decorated_detection_frames_dir,
-            color=(0, 0, 255),
-            count=i,
+    # Red border for detected attacks, green otherwise
+    file_path = media_converter.decorate_image(
+        image_path=disturbed_image_path,
+        output_dir=generated_decorated_detection_frames_dir,
+        color=(0, 0, 255) if attacked else (0, 255, 0),
+        count=i,
+    )
+    detection_results.record(i, bool(attacked), score=float(attacked), path=file_path)
+
+
+def process_frame_in_memory(
+    i: int,
+    frames: dict,
+    outputs: dict,
+    media_converter: MediaConverter,
+    adversarial_attack: AdversarialAttack,
+    attack_schedule: AttackSchedule,
+):
+    """
+    Process an in-memory frame of the video, apply attacks if necessary, and decorate it.
+
+    Runs as a FrameExecutor stage, the output frames are written in place.
+
+    Args:
+    - i: Index of the frame
+    - frames: Dict holding the "original" frame
+    - outputs: Dict holding the "disturbed" and "disturbed_decorated" frames to fill
+    - media_converter: Instance of the MediaConverter class
+    - adversarial_attack: Instance of the AdversarialAttack class
+    - attack_schedule: Instance of the AttackSchedule class deciding which frames are attacked
+
+    Returns:
+    - Whether the frame was attacked
+    """
+    # Progress indicator
+    if i % 50 == 0:
+        print("")
+    else:
+        print(".", end="")
+
+    if attack_schedule.is_attacked(i):
+        # Apply adversarial attack and decorate the disturbed frame
+        outputs["disturbed"][...] = adversarial_attack.fgsm_attack_frame(
+            frames["original"],
+            epsilon=attack_schedule.epsilon,
+            rng=adversarial_attack.get_frame_rng(i),
         )
-        generated_detection_file_paths.append(file_path)
+        outputs["disturbed_decorated"][...] = outputs["disturbed"]
+        media_converter.decorate_frame(
+            outputs["disturbed_decorated"], color=(0, 0, 255), index=i, in_place=True
+        )
+        return True
+
+    outputs["disturbed"][...] = frames["original"]
+    outputs["disturbed_decorated"][...] = frames["original"]
+    media_converter.decorate_frame(
+        outputs["disturbed_decorated"], color=(0, 255, 0), index=i, in_place=True
+    )
+    return False
+
+
+def detect_attack_in_memory(
+    i: int,
+    frames: dict,
+    outputs: dict,
+    media_converter: MediaConverter,
+    attack_detector: AttackDetector,
+):
+    """
+    Detect attacks between in-memory original and disturbed frames.
+
+    Runs as a FrameExecutor stage, the output frame is written in place.
+
+    Args:
+    - i: Index of the frame
+    - frames: Dict holding the "original" and "disturbed" frames
+    - outputs: Dict holding the "generated_detection" frame to fill
+    - media_converter: Instance of the MediaConverter class
+    - attack_detector: Instance of the AttackDetector class
+
+    Returns:
+    - The difference of image statistics, non-zero when an attack was detected
+    """
+    attacked = attack_detector.detect_attack_given_two_frames(
+        main_frame=frames["original"], second_frame=frames["disturbed"]
+    )
+
+    # Progress indicator
+    if i % 50 == 0:
+        print("")
     else:
-        # If no attack detected, decorate the image in green
-        file_path = media_converter.decorate_image(
-            image_path=disturbed_image_path,
-            output_dir=generated_decorated_detection_frames_dir,
-            color=(0, 255, 0),
-            count=i,
+        print(".", end="")
+
+    # Red border for detected attacks, green otherwise, drawn over a copy of the disturbed frame
+    color = (0, 0, 255) if attacked else (0, 255, 0)
+    outputs["generated_detection"][...] = frames["disturbed"]
+    media_converter.decorate_frame(
+        outputs["generated_detection"],
+        color,
+        index=i,
+        score=float(attacked),
+        in_place=True,
+    )
+    return float(attacked)
+
+
+def run_in_memory_pipeline(
+    original_video_filepath: str,
+    result_dir: str,
+    save_frames_to_disk: bool,
+    media_converter: MediaConverter,
+    adversarial_attack: AdversarialAttack,
+    attack_detector: AttackDetector,
+    data_visualizer: DataVisualizer,
+    frame_executor: FrameExecutor,
+    chunk_size: int = 64,
+    disturbed_video_codec: str = "mp4v",
+    queue_size: int = 2,
+    attack_schedule: AttackSchedule = None,
+):
+    """
+    Run the attack and detection pipeline keeping frames in memory between stages.
+
+    The video is streamed in chunks through a StagePipeline, decoding, the attack and detection
+    stages on the frame executor and encoding work on different chunks at the same time. Its
+    bounded queues keep only a few chunks of frames in memory at a time.
+    Only the videos and the report are written to disk, frames are saved only when requested.
+
+    Args:
+    - original_video_filepath: Path of the input video
+    - result_dir: Directory to store the results
+    - save_frames_to_disk: Whether to also save the intermediate frames as images
+    - media_converter: Instance of the MediaConverter class
+    - adversarial_attack: Instance of the AdversarialAttack class
+    - attack_detector: Instance of the AttackDetector class
+    - data_visualizer: Instance of the DataVisualizer class
+    - frame_executor: Instance of the FrameExecutor class running the stages
+    - chunk_size: Number of frames decoded and processed together
+    - disturbed_video_codec: Codec of the disturbed video
+    - queue_size: Number of chunks waiting between two stages
+    - attack_schedule: Frames to attack, defaults to frames 50 to 100 with epsilon 5
+    """
+    if attack_schedule is None:
+        attack_schedule = AttackSchedule.from_range(50, 101, epsilon=5)
+
+    output_videos_dir = os.path.join(result_dir, "output_videos")
+    output_frames_dirs = {
+        "original": os.path.join(result_dir, "original_output_frames"),
+        "disturbed": os.path.join(result_dir, "disturbed_output_frames"),
+        "disturbed_decorated": os.path.join(
+            result_dir, "disturbed_decorated_output_frames"
+        ),
+        "generated_detection": os.path.join(
+            result_dir, "generated_decorated_detection_frames"
+        ),
+    }
+    actual_attack_indexes = []
+    detection_results = DetectionResults()
+    original_frame_paths = []
+    disturbed_frame_paths = {}
+
+    # The helper instances are sent to worker processes once, not with every chunk
+    frame_executor.register_args(
+        "attack", (media_converter, adversarial_attack, attack_schedule)
+    )
+    frame_executor.register_args("detect", (media_converter, attack_detector))
+
+    def attack_chunk(chunk):
+        indexes, _, frames = chunk
+        # Both frame stages read the original frames from the same shared buffer
+        frames = frame_executor.share(frames)
+        frame_spec = (frames.shape[1:], frames.dtype)
+        attacked, disturbed_frames = frame_executor.map_frames(
+            process_frame_in_memory,
+            inputs={"original": frames},
+            outputs={"disturbed": frame_spec, "disturbed_decorated": frame_spec},
+            indexes=indexes,
+            registered_args="attack",
+        )
+        return indexes, attacked, {"original": frames, **disturbed_frames}
+
+    def detect_chunk(chunk):
+        indexes, attacked, chunk_frames = chunk
+        frames = chunk_frames["original"]
+        scores, detection_frames = frame_executor.map_frames(
+            detect_attack_in_memory,
+            inputs={"original": frames, "disturbed": chunk_frames["disturbed"]},
+            outputs={"generated_detection": (frames.shape[1:], frames.dtype)},
+            indexes=indexes,
+            registered_args="detect",
+        )
+        return indexes, attacked, scores, {**chunk_frames, **detection_frames}
+
+    def encode_chunk(chunk):
+        indexes, attacked, scores, chunk_frames = chunk
+        actual_attack_indexes.extend(indexes[attacked].tolist())
+        detection_results.record_chunk(indexes, np.asarray(scores) != 0, scores=scores)
+        for name, video in videos.items():
+            for i, frame, frame_attacked in zip(indexes, chunk_frames[name], attacked):
+                video.write(frame, index=i)
+
+                # Clean disturbed frames are the original frames, the manifest points to them
+                if save_frames_to_disk and (name != "disturbed" or frame_attacked):
+                    saved_path = media_converter.save_frame(
+                        frame, output_frames_dirs[name], i
+                    )
+                    if name == "original":
+                        original_frame_paths.append(saved_path)
+                    elif name == "disturbed":
+                        disturbed_frame_paths[i] = saved_path
+
+    # Video writers take frames in order from a single thread, the encode stage has one worker
+    print("\nProcessing original, disturbed and detection videos...")
+    pipeline = StagePipeline(queue_size=queue_size)
+    pipeline.add_stage("attack", attack_chunk)
+    pipeline.add_stage("detect", detect_chunk)
+    pipeline.add_stage("encode", encode_chunk)
+
+    # An error aborts every video, so no partial video is left behind as if it were complete
+    with contextlib.ExitStack() as sinks:
+        videos = {
+            "original": sinks.enter_context(
+                media_converter.open_video_sink(
+                    output_videos_dir, "resulting_original_video.mp4"
+                )
+            ),
+            "disturbed": sinks.enter_context(
+                media_converter.open_video_sink(
+                    output_videos_dir,
+                    media_converter.get_video_file_name(
+                        "disturbed_video", disturbed_video_codec
+                    ),
+                    disturbed_video_codec,
+                )
+            ),
+            "disturbed_decorated": sinks.enter_context(
+                media_converter.open_video_sink(
+                    output_videos_dir, "disturbed_decorated_video.mp4"
+                )
+            ),
+            "generated_detection": sinks.enter_context(
+                media_converter.open_video_sink(
+                    output_videos_dir, "generated_detection_video.mp4"
+                )
+            ),
+        }
+        pipeline.run(
+            media_converter.stream_video_frames(
+                original_video_filepath, chunk_size=chunk_size
+            ),
+            collect=False,
+        )
+
+    if save_frames_to_disk:
+        FrameOverlay(original_frame_paths, disturbed_frame_paths).save_manifest(
+            output_frames_dirs["disturbed"]
         )
-        generated_detection_file_paths.append(file_path)
+
+    resulting_original_video_filepath = videos["original"].file_name
+    disturbed_video_filepath = videos["disturbed"].file_name
+    generated_detection_video_filepath = videos["generated_detection"].file_name
+
+    detected_attack_indexes = detection_results.attacked_indexes
+    print(f"\nOriginal video saved to {resulting_original_video_filepath}")
+    print("Disturbed video saved to " + disturbed_video_filepath)
+    print("\nDetected attacks:", detected_attack_indexes)
+    print(f"Detection video saved to {generated_detection_video_filepath}")
+
+    report_path = DetectionReport(
+        detected_attack_indexes, actual_attack_indexes, len(detection_results)
+    ).write_json(
+        os.path.join(result_dir, "parallel_detection_results.json"),
+        video_filepath=original_video_filepath,
+        attack_schedule=attack_schedule.to_spec(),
+    )
+    print(f"Detection report saved to {report_path}")
+
+    # The PDF is rendered in a background process, the caller waits for it with shutdown
+    print("\nSaving data into pdf.")
+    data_visualizer.submit_visualize_data(
+        detected_attack_indexes=detected_attack_indexes,
+        actual_attack_indexes=actual_attack_indexes,
+        length_of_all_indexes=len(detection_results),
+        output_dir=result_dir,
+        output_file_name="parallel_detection_results.pdf",
+    )
 
 
 if __name__ == "__main__":
+    # Clear the terminal screen
+    system("clear")
+
     start_time = time.time()
 
     # Directories
@@ -155,114 +416,181 @@ if __name__ == "__main__":
     # Input video
     original_video_filepath = "sample_video/video.avi"
 
-    # Initialize instances
-    media_converter = MediaConverter()
-    adversarial_attack = AdversarialAttack()
-    attack_detector = AttackDetector()
-    data_visualizer = DataVisualizer()
-
-    # Process original video
-    print("\nProcessing original video...")
-    images_vectors = media_converter.convert_video_to_frames(
-        video_filepath=original_video_filepath
-    )
-    original_images_file_paths = media_converter.save_frames_to_folder(
-        frames=images_vectors, output_dir=original_output_frames_dir
-    )
-    resulting_original_video_filepath = media_converter.convert_images_to_video(
-        image_paths=original_images_file_paths,
-        output_dir=output_videos_dir,
-        file_name="resulting_original_video.mp4",
-    )
-    print(f"Original video saved to {resulting_original_video_filepath}")
+    # Keep frames in memory between stages, frames are only written to disk on request
+    keep_frames_in_memory = True
+    save_frames_to_disk = False
 
-    # Process disturbed video
-    disturbed_image_file_paths = []
-    disturbed_decorated_image_file_paths = []
-    generated_detection_file_paths = []
-    detected_attack_indexes = []
-    actual_attack_indexes = []
+    # Backend running the in-memory frame stages: "processes", "threads" or "sequential"
+    executor_backend = "processes"
+    max_workers = None
 
-    print("\nProcessing disturbed video...")
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        futures = [
-            executor.submit(
-                process_frame,
-                i,
-                image_file_path,
-                disturbed_image_file_paths,
-                disturbed_decorated_image_file_paths,
-                actual_attack_indexes,
-                media_converter,
-                adversarial_attack,
-            )
-            for i, image_file_path in enumerate(original_images_file_paths)
-        ]
+    # Frames saved to disk and the disturbed video are stored losslessly, so detection on the
+    # saved files sees the perturbation as it was applied. In memory, frames are never encoded.
+    frame_format = "png"
+    disturbed_video_codec = "FFV1"
 
-    # Ensure correct order after parallel processing
-    results = sorted(
-        [future.result() for future in concurrent.futures.as_completed(futures)],
-        key=lambda x: x[0],
-    )
-
-    disturbed_image_file_paths = [result[1] for result in results]
-    disturbed_decorated_image_file_paths = [result[2] for result in results]
-    print(f"\nSaving disturbed video")
+    # Frames to attack, e.g. {"type": "rate", "rate": 0.05} or {"type": "burst", "rate": 0.01,
+    # "length": 10} patterns, see AttackSchedule
+    attack_schedule_spec = {
+        "patterns": [{"type": "range", "start": 50, "end": 101}],
+        "seed": 0,
+        "epsilon": 5,
+    }
 
-    disturbed_video_filepath = media_converter.convert_images_to_video(
-        image_paths=disturbed_image_file_paths,
-        output_dir=output_videos_dir,
-        file_name="disturbed_video.mp4",
-    )
-    disturbed_decorated_video_filepath = media_converter.convert_images_to_video(
-        image_paths=disturbed_decorated_image_file_paths,
-        output_dir=output_videos_dir,
-        file_name="disturbed_decorated_video.mp4",
-    )
-
-    print("Disturbed video saved to " + disturbed_video_filepath)
+    # Initialize instances
+    media_converter = MediaConverter(frame_format=frame_format)
+    adversarial_attack = AdversarialAttack(image_format=frame_format)
+    attack_schedule = AttackSchedule.from_spec(attack_schedule_spec)
+    attack_detector = AttackDetector()
+    data_visualizer = DataVisualizer()
 
-    # Detect attacks
-    if len(disturbed_image_file_paths) != len(original_images_file_paths):
-        print("\nUnable to run detection. Unequal amount of frames.")
+    if keep_frames_in_memory:
+        with FrameExecutor(
+            backend=executor_backend, max_workers=max_workers, chunk_size=4
+        ) as frame_executor:
+            run_in_memory_pipeline(
+                original_video_filepath=original_video_filepath,
+                result_dir=result_dir,
+                save_frames_to_disk=save_frames_to_disk,
+                media_converter=media_converter,
+                adversarial_attack=adversarial_attack,
+                attack_detector=attack_detector,
+                data_visualizer=data_visualizer,
+                frame_executor=frame_executor,
+                disturbed_video_codec=disturbed_video_codec,
+                attack_schedule=attack_schedule,
+            )
     else:
-        print("\nProcessing detection video...")
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            futures = [
-                executor.submit(
-                    detect_attack,
-                    i,
-                    original_images_file_paths[i],
-                    disturbed_image_file_paths[i],
-                    detected_attack_indexes,
-                    generated_detection_file_paths,
-                    media_converter,
-                    attack_detector,
-                )
-                for i in range(len(original_images_file_paths))
-            ]
-
-        print("\nDetected attacks:", detected_attack_indexes)
-
-        # Save detection video
-        generated_detection_video_filepath = media_converter.convert_images_to_video(
-            image_paths=generated_detection_file_paths,
+        # Process original video
+        print("\nProcessing original video...")
+        images_vectors = media_converter.convert_video_to_frames(
+            video_filepath=original_video_filepath
+        )
+        original_images_file_paths = media_converter.save_frames_to_folder(
+            frames=images_vectors, output_dir=original_output_frames_dir
+        )
+        resulting_original_video_filepath = media_converter.convert_images_to_video(
+            image_paths=original_images_file_paths,
             output_dir=output_videos_dir,
-            file_name="generated_detection_video.mp4",
+            file_name="resulting_original_video.mp4",
         )
+        print(f"Original video saved to {resulting_original_video_filepath}")
+
+        # Process disturbed video
+        print("\nProcessing disturbed video...")
+        results = []
+        # An error aborts both videos, so no partial video is left behind as if it were complete
+        with media_converter.open_video_sink(
+            output_videos_dir,
+            media_converter.get_video_file_name(
+                "disturbed_video", disturbed_video_codec
+            ),
+            disturbed_video_codec,
+        ) as disturbed_video, media_converter.open_video_sink(
+            output_videos_dir, "disturbed_decorated_video.mp4"
+        ) as disturbed_decorated_video:
+            with concurrent.futures.ThreadPoolExecutor() as executor:
+                futures = [
+                    executor.submit(
+                        process_frame,
+                        i,
+                        image_file_path,
+                        media_converter,
+                        adversarial_attack,
+                        attack_schedule,
+                    )
+                    for i, image_file_path in enumerate(original_images_file_paths)
+                ]
+
+                # Write each frame as soon as its predecessors are ready
+                for future in concurrent.futures.as_completed(futures):
+                    result = future.result()
+                    disturbed_video.write_path(result[1], index=result[0])
+                    disturbed_decorated_video.write_path(result[2], index=result[0])
+                    results.append(result)
+
+        # Ensure correct order after parallel processing
+        results = sorted(results, key=lambda x: x[0])
+
+        # Only the attacked frames are stored, the others resolve to the original frames
+        disturbed_frames = FrameOverlay(original_images_file_paths)
+        for result in results:
+            if result[3]:
+                disturbed_frames.set_frame(result[0], result[1])
+        disturbed_frames.save_manifest(disturbed_output_frames_dir)
+
+        disturbed_image_file_paths = disturbed_frames.get_paths()
+        disturbed_decorated_image_file_paths = [result[2] for result in results]
+        actual_attack_indexes = [result[0] for result in results if result[3]]
+        disturbed_video_filepath = disturbed_video.file_name
+        disturbed_decorated_video_filepath = disturbed_decorated_video.file_name
+
+        print("Disturbed video saved to " + disturbed_video_filepath)
+
+        # Detect attacks
+        if len(disturbed_image_file_paths) != len(original_images_file_paths):
+            print("\nUnable to run detection. Unequal amount of frames.")
+        else:
+            print("\nProcessing detection video...")
+            # Every frame writes its own slot, so the results are ordered by frame
+            detection_results = DetectionResults(len(original_images_file_paths))
+            with concurrent.futures.ThreadPoolExecutor() as executor:
+                futures = [
+                    executor.submit(
+                        detect_attack,
+                        i,
+                        original_images_file_paths[i],
+                        disturbed_image_file_paths[i],
+                        detection_results,
+                        media_converter,
+                        attack_detector,
+                    )
+                    for i in range(len(original_images_file_paths))
+                ]
+            for future in futures:
+                future.result()
+            # The cached statistics belong to the frames of this video
+            attack_detector.frame_comparator.clear()
+
+            detected_attack_indexes = detection_results.attacked_indexes
+            generated_detection_file_paths = detection_results.get_paths()
+            print("\nDetected attacks:", detected_attack_indexes)
+
+            # Save detection video
+            generated_detection_video_filepath = (
+                media_converter.convert_images_to_video(
+                    image_paths=generated_detection_file_paths,
+                    output_dir=output_videos_dir,
+                    file_name="generated_detection_video.mp4",
+                )
+            )
 
-        print(f"Detection video saved to {generated_detection_video_filepath}")
+            print(f"Detection video saved to {generated_detection_video_filepath}")
 
-        print("\nSaving data into pdf.")
-        # Save all plots in a single PDF
-        data_visualizer.visualize_data(
-            detected_attack_indexes=detected_attack_indexes,
-            actual_attack_indexes=actual_attack_indexes,
-            length_of_all_indexes=len(original_images_file_paths),
-            output_dir=result_dir,
-            output_file_name="parallel_detection_results.pdf",
-        )
-        print("Done saving data into pdf.")
+            report_path = DetectionReport(
+                detected_attack_indexes,
+                actual_attack_indexes,
+                len(original_images_file_paths),
+            ).write_json(
+                os.path.join(result_dir, "parallel_detection_results.json"),
+                video_filepath=original_video_filepath,
+                attack_schedule=attack_schedule.to_spec(),
+            )
+            print(f"Detection report saved to {report_path}")
+
+            print("\nSaving data into pdf.")
+            # Save all plots in a single PDF, rendered in a background process
+            data_visualizer.submit_visualize_data(
+                detected_attack_indexes=detected_attack_indexes,
+                actual_attack_indexes=actual_attack_indexes,
+                length_of_all_indexes=len(original_images_file_paths),
+                output_dir=result_dir,
+                output_file_name="parallel_detection_results.pdf",
+            )
+
+    # Wait for the PDF reports
+    data_visualizer.shutdown()
+    print("Done saving data into pdf.")
 
     end_time = time.time()
 
@@ -1,13 +1,21 @@
 import time
+import numpy as np
 from os import system
 from helpers.AttackDetector import AttackDetector
+from helpers.AttackSchedule import AttackSchedule
 from helpers.DataVisualizer import DataVisualizer
+from helpers.DetectionReport import DetectionReport
+from helpers.FeatureCache import FeatureCache
 from helpers.MediaConverter import MediaConverter
-
-# Clear the terminal screen
-system("clear")
+from helpers.ModelRegistry import ModelRegistry
+from helpers.MultiResolutionAttackDetector import MultiResolutionAttackDetector
+from helpers.StreamingAttackDetector import StreamingAttackDetector
+from helpers.TemporalDifferenceDetector import TemporalDifferenceDetector
 
 if __name__ == "__main__":
+    # Clear the terminal screen
+    system("clear")
+
     start_time = time.time()
 
     # Directories for storing results
@@ -19,91 +27,280 @@ if __name__ == "__main__":
         result_dir + "generated_disturbed_decorated_output_frames"
     )
     output_videos_dir = result_dir + "output_videos/"
-    disturbed_video_filepath = output_videos_dir + "disturbed_video.mp4"
+
+    # Codec the disturbed video was written with by attack_video.py
+    disturbed_video_codec = "FFV1"
+    frame_format = "png"
+
+    # Attacked frame intervals written by attack_video.py, attacked_indexes.txt files of
+    # previous versions are read as well
+    ground_truth_filepath = "attacked_intervals.json"
+
+    # Keep frames in memory between stages, frames are only written to disk on request
+    keep_frames_in_memory = True
+    save_frames_to_disk = False
+
+    # How frames are scored: "batch" fits an Isolation Forest on the whole video, "incremental"
+    # scores frames one by one as they are decoded as for a live feed, "temporal_difference"
+    # flags jumps of the residual between neighbouring frames in one pass without a model, and
+    # "multi_resolution" triages tiles on decimated frames and escalates suspicious ones
+    detection_mode = "batch"
+
+    # In batch mode, score frames against a baseline fitted once on clean footage of the source
+    # instead of fitting a model on every video, it is saved on the first run and loaded afterwards
+    use_baseline_model = False
+    baseline_source = "sample_video"
+    baseline_video_filepath = "sample_video/video.avi"
+
+    # Render the PDF report in a background process while the decorated video is written,
+    # the JSON report with the metrics and attack intervals is always written right away
+    render_report_in_background = True
+
+    # Reuse the features of previous runs on the same video, e.g. when tuning contamination
+    use_feature_cache = True
+
+    # How batch decision scores become verdicts: "fixed" is the decision boundary of the model,
+    # "percentile", "rolling" (median and MAD of neighbouring frames) and "hysteresis" are
+    # the other ScoreThresholder methods, tuning them needs no refit
+    threshold_method = "fixed"
+    threshold_parameters = {}
 
     # Initialize helper instances
-    media_converter = MediaConverter()
-    attack_detector = AttackDetector(contamination=0.2)
+    media_converter = MediaConverter(frame_format=frame_format)
+    attack_detector = AttackDetector(
+        contamination=0.2,
+        threshold_method=threshold_method,
+        threshold_parameters=threshold_parameters,
+    )
     data_visualizer = DataVisualizer()
+    feature_cache = None
+    if use_feature_cache:
+        feature_cache = FeatureCache(cache_dir=result_dir + "feature_cache")
+
+    disturbed_video_filepath = output_videos_dir + media_converter.get_video_file_name(
+        "disturbed_video", disturbed_video_codec
+    )
 
     # Process disturbed video
     print("\nProcessing disturbed video...")
-    generated_disturbed_images_vectors = media_converter.convert_video_to_frames(
-        video_filepath=disturbed_video_filepath
-    )
-    generated_disturbed_images_file_paths = media_converter.save_frames_to_folder(
-        frames=generated_disturbed_images_vectors,
-        output_dir=generated_disturbed_output_frames_dir,
-    )
+    generated_disturbed_images_file_paths = []
+    if not keep_frames_in_memory or save_frames_to_disk:
+        generated_disturbed_images_file_paths = media_converter.save_frames_to_folder(
+            frames=(
+                frame
+                for _, _, frame in media_converter.stream_video_frames(
+                    disturbed_video_filepath
+                )
+            ),
+            output_dir=generated_disturbed_output_frames_dir,
+        )
 
     # Detect attacks in the processed frames
     print("\nProcessing detection ...")
-    with open("attacked_indexes.txt") as f:
-        actual_attack_indexes = [int(x) for x in f.readlines()]
+    actual_attack_indexes = AttackSchedule.load_ground_truth(ground_truth_filepath)
 
-    detected, attacked_images_indexes, threshold_list = (
-        attack_detector.detect_attack_from_image_paths(
-            generated_disturbed_images_file_paths
-        )
+    if use_baseline_model and detection_mode == "batch":
+        model_registry = ModelRegistry(model_dir=result_dir + "models")
+        if not attack_detector.load_baseline(model_registry, baseline_source):
+            attack_detector.fit_baseline_from_video(
+                baseline_video_filepath,
+                media_converter=media_converter,
+                feature_cache=feature_cache,
+            )
+            attack_detector.save_baseline(
+                model_registry,
+                baseline_source,
+                metadata={"video_filepath": baseline_video_filepath},
+            )
+
+    # Only a fixed threshold is a single line over the scores
+    batch_score_threshold = None
+    if threshold_method == "fixed":
+        batch_score_threshold = threshold_parameters.get("threshold", 0.0)
+
+    # Frames the detector never flags while it warms up, scores of a baseline model have none
+    warmup_frames = (
+        attack_detector.warmup_frames
+        if attack_detector.baseline_model is None
+        else None
     )
+
+    if detection_mode in ("incremental", "temporal_difference", "multi_resolution"):
+        if detection_mode == "incremental":
+            streaming_attack_detector = StreamingAttackDetector(contamination=0.2)
+            score_threshold = 0.0
+        elif detection_mode == "temporal_difference":
+            streaming_attack_detector = TemporalDifferenceDetector()
+            score_threshold = streaming_attack_detector.threshold
+        else:
+            streaming_attack_detector = MultiResolutionAttackDetector(
+                pyramid=(4, 1), escalation_thresholds=(2.0,), tile_size=64
+            )
+            score_threshold = streaming_attack_detector.attack_threshold
+        detections = list(
+            streaming_attack_detector.detect_attack_from_stream(
+                frame
+                for _, _, frame in media_converter.stream_video_frames(
+                    disturbed_video_filepath
+                )
+            )
+        )
+        streaming_attack_detector.close()
+        attacked_images_indexes = [i for i, attacked, _ in detections if attacked]
+        # Frames scored during the warm-up have no score
+        threshold_list = np.array(
+            [np.nan if score is None else score for _, _, score in detections]
+        )
+        number_of_frames = len(detections)
+        warmup_frames = streaming_attack_detector.warmup_frames
+    elif keep_frames_in_memory:
+        # Frames are streamed from the video, or skipped entirely on a feature cache hit
+        detected, attacked_images_indexes, threshold_list = (
+            attack_detector.detect_attack_from_video(
+                disturbed_video_filepath,
+                media_converter=media_converter,
+                feature_cache=feature_cache,
+            )
+        )
+        number_of_frames = attack_detector.current_frame_count
+        score_threshold = batch_score_threshold
+    else:
+        detected, attacked_images_indexes, threshold_list = (
+            attack_detector.detect_attack_from_image_paths(
+                generated_disturbed_images_file_paths
+            )
+        )
+        number_of_frames = attack_detector.current_frame_count
+        score_threshold = batch_score_threshold
     print(f"\nAttacked images indexes: {actual_attack_indexes}")
     print(f"\nDetected images indexes: {attacked_images_indexes}")
 
-    # Visualize the detection results
-    data_visualizer.visualize_data(
+    # Report the detection results
+    report_path = DetectionReport(
+        attacked_images_indexes,
+        actual_attack_indexes,
+        number_of_frames,
+        scores=threshold_list,
+    ).write_json(
+        result_dir + "approach_2_detection_results.json",
+        video_filepath=disturbed_video_filepath,
+        detection_mode=detection_mode,
+    )
+    print(f"\nDetection report saved to {report_path}")
+
+    visualize_data = (
+        data_visualizer.submit_visualize_data
+        if render_report_in_background
+        else data_visualizer.visualize_data
+    )
+    visualize_data(
         detected_attack_indexes=attacked_images_indexes,
         actual_attack_indexes=actual_attack_indexes,
-        length_of_all_indexes=len(generated_disturbed_images_file_paths),
+        length_of_all_indexes=number_of_frames,
         threshold_list=threshold_list,
+        score_threshold=score_threshold,
+        warmup_frames=warmup_frames,
         output_dir=result_dir,
         output_file_name="approach_2_detection_results.pdf",
     )
 
-    # Generate decorated detected video
-    print("\nGenerating decorated detected video...")
-    generated_disturbed_decorated_image_file_paths = []
+    def get_border_color(i):
+        """
+        Picks the border color of a frame from the detection outcome.
 
-    for i in range(len(generated_disturbed_images_file_paths)):
+        Args:
+            i (int): Index of the frame.
+
+        Returns:
+            tuple: Color of the border (B, G, R).
+        """
         if i % 50 == 0:
             print("")
         else:
             print(".", end="")
 
-        image_file_path = generated_disturbed_images_file_paths[i]
-
         if i in attacked_images_indexes and i in actual_attack_indexes:
-            color = (0, 255, 0)  # Green for correct detection
+            return (0, 255, 0)  # Green for correct detection
         elif (i in attacked_images_indexes and i not in actual_attack_indexes) or (
             i not in attacked_images_indexes and i in actual_attack_indexes
         ):
-            color = (0, 0, 255)  # Red for false positive or false negative
-        else:
-            color = (0, 255, 0)  # Green for no attack detected
+            return (0, 0, 255)  # Red for false positive or false negative
+        return (0, 255, 0)  # Green for no attack detected
+
+    def decorate_frame(i, frame):
+        """
+        Draws the border of a decoded frame on it and, when requested, saves it as it passes on
+        to the video, so the decorated video is never held in memory.
+
+        Args:
+            i (int): Index of the frame.
+            frame (numpy.ndarray): The frame, decorated in place.
 
-        generated_disturbed_decorated_image_file_path = media_converter.decorate_image(
-            image_path=image_file_path,
-            output_dir=generated_disturbed_decorated_output_frames_dir,
-            color=color,
-            count=i,
+        Returns:
+            numpy.ndarray: The decorated frame.
+        """
+        media_converter.decorate_frame(
+            frame, color=get_border_color(i), index=i, in_place=True
         )
-        generated_disturbed_decorated_image_file_paths.append(
-            generated_disturbed_decorated_image_file_path
+        if save_frames_to_disk:
+            media_converter.save_frame(
+                frame, generated_disturbed_decorated_output_frames_dir, i
+            )
+        return frame
+
+    # Generate decorated detected video
+    print("\nGenerating decorated detected video...")
+    generated_disturbed_decorated_image_file_paths = []
+
+    if keep_frames_in_memory:
+        # Decorated frames are produced lazily while the video is being written,
+        # each decoded frame is only used once so the border is drawn on it directly
+        generated_disturbed_decorated_frames = (
+            decorate_frame(i, frame)
+            for i, _, frame in media_converter.stream_video_frames(
+                disturbed_video_filepath
+            )
         )
+    else:
+        for i in range(number_of_frames):
+            generated_disturbed_decorated_image_file_path = (
+                media_converter.decorate_image(
+                    image_path=generated_disturbed_images_file_paths[i],
+                    output_dir=generated_disturbed_decorated_output_frames_dir,
+                    color=get_border_color(i),
+                    count=i,
+                )
+            )
+            generated_disturbed_decorated_image_file_paths.append(
+                generated_disturbed_decorated_image_file_path
+            )
 
     # Save the detected decorated video
     print("\nSaving detected decorated video")
-    generated_disturbed_decorated_video_filepath = (
-        media_converter.convert_images_to_video(
-            image_paths=generated_disturbed_decorated_image_file_paths,
-            output_dir=output_videos_dir,
-            file_name="generated_decorated_detected_video.mp4",
+    if keep_frames_in_memory:
+        generated_disturbed_decorated_video_filepath = (
+            media_converter.convert_frames_to_video(
+                frames=generated_disturbed_decorated_frames,
+                output_dir=output_videos_dir,
+                file_name="generated_decorated_detected_video.mp4",
+            )
+        )
+    else:
+        generated_disturbed_decorated_video_filepath = (
+            media_converter.convert_images_to_video(
+                image_paths=generated_disturbed_decorated_image_file_paths,
+                output_dir=output_videos_dir,
+                file_name="generated_decorated_detected_video.mp4",
+            )
         )
-    )
     print(
         "Detected decorated video saved to "
         + generated_disturbed_decorated_video_filepath
     )
 
+    # Wait for the PDF report
+    data_visualizer.shutdown()
+
     # Print elapsed time
     end_time = time.time()
     elapsed_time = end_time - start_time